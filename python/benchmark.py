@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:02:11 2026
+
+@author: Diego Wanderley
+@python: 3.6 and Pytroch
+@description: Script for performance benchmarks (throughput and numerics)
+"""
+
+import sys
+import time
+import argparse
+import subprocess
+import torch
+import torch.optim as optim
+from torch.utils.data import DataLoader
+from nets.registry import build_model, available_models
+from utils.datasets import OvaryDataset
+from utils.losses import DiceLoss, BatchDiceCoefficients
+
+
+def time_steps(model, image, target, steps=10, warmup=2, train=True, bf16=False):
+    '''
+        Measure the throughput (images per second) of training or inference steps.
+
+        Arguments:
+            @param model: network model
+            @param image: input batch (B x C x H x W)
+            @param target: one-hot ground truth (B x N x H x W)
+            @param steps: number of timed steps
+            @param warmup: number of untimed steps
+            @param train: run forward/backward/step (True) or forward only (False)
+            @param bf16: run the network with bfloat16 autocast
+    '''
+    if train:
+        loss_function = DiceLoss()
+        optimizer = optim.Adam(model.parameters(), lr=0.001)
+        model.train()
+    else:
+        model.eval()
+
+    for i in range(warmup + steps):
+        if i == warmup:
+            start = time.perf_counter()
+        if train:
+            with torch.autocast(image.device.type, dtype=torch.bfloat16, enabled=bf16):
+                pred = model(image)
+            loss = loss_function(pred.float(), target)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+        else:
+            with torch.no_grad(), torch.autocast(image.device.type, dtype=torch.bfloat16,
+                                                 enabled=bf16):
+                pred = model(image)
+    elapsed = time.perf_counter() - start
+
+    return steps * len(image) / elapsed
+
+
+def random_batch(batch_size, in_channels, n_classes, size, device):
+    '''
+        Random input batch and one-hot ground truth.
+    '''
+    image = torch.rand(batch_size, in_channels, size, size, device=device)
+    labels = torch.randint(n_classes, (batch_size, size, size), device=device)
+    target = torch.zeros(batch_size, n_classes, size, size, device=device)
+    target.scatter_(1, labels.unsqueeze(1), 1.)
+
+    return image, target
+
+
+def bench_precision(args, device):
+    '''
+        Throughput of float32 against bfloat16 autocast and (optional) Dice
+        comparison of both modes with a float32 checkpoint.
+    '''
+    image, target = random_batch(args.batch_size, 1, 3, args.size, device)
+
+    print('--- Throughput (images/s) ---')
+    print('{:16s} {:>10s} {:>10s} {:>10s} {:>10s}'.format('network',
+          'train fp32', 'train bf16', 'infer fp32', 'infer bf16'))
+    for net_type in args.nets:
+        model = build_model(net_type, 1, 3).to(device)
+        results = []
+        for train in [True, False]:
+            for bf16 in [False, True]:
+                results.append(time_steps(model, image, target, steps=args.steps,
+                                          warmup=args.warmup, train=train, bf16=bf16))
+        print('{:16s} {:10.2f} {:10.2f} {:10.2f} {:10.2f}'.format(net_type, *results))
+    print('')
+
+    # Dice comparison with a trained (float32) checkpoint
+    if args.weights is None:
+        return
+    state = torch.load(args.weights, map_location='cpu')
+    if 'build_kwargs' in state:
+        model = build_model(state['arch'], **state['build_kwargs'])
+    else:
+        model = build_model(args.nets[0], 1, 3)
+    model.load_state_dict(state['state_dict'])
+    model = model.to(device)
+    model.eval()
+
+    criterion = BatchDiceCoefficients()
+    dataset = OvaryDataset(im_dir='../datasets/ovarian/im/test/',
+                           gt_dir='../datasets/ovarian/gt/test/')
+    data_loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False)
+
+    dsc = {False: [], True: []}
+    agreement = []
+    for sample in data_loader:
+        image = sample['image'].to(device)
+        gt_mask = sample['gt_mask'].to(device)
+        if len(image.size()) < 4:
+            image.unsqueeze_(1)
+        labels = {}
+        for bf16 in [False, True]:
+            with torch.no_grad(), torch.autocast(device.type, dtype=torch.bfloat16,
+                                                 enabled=bf16):
+                pred = model(image)
+            if type(pred) is list:
+                pred = pred[0]
+            labels[bf16] = pred.float().argmax(dim=1)
+            pred_final = torch.zeros_like(gt_mask).scatter_(1, labels[bf16].unsqueeze(1), 1.)
+            dsc[bf16].append(criterion(pred_final, gt_mask))
+        agreement.append((labels[False] == labels[True]).float().mean(dim=(1, 2)))
+
+    dsc_fp32 = torch.cat(dsc[False]).mean(dim=0)
+    dsc_bf16 = torch.cat(dsc[True]).mean(dim=0)
+    print('--- Dice against ground truth (float32 checkpoint) ---')
+    print('{:10s} {:>10s} {:>10s}'.format('class', 'fp32', 'bf16'))
+    for c, cname in enumerate(['background', 'stroma', 'follicles']):
+        print('{:10s} {:10.4f} {:10.4f}'.format(cname, dsc_fp32[c].item(), dsc_bf16[c].item()))
+    print('Pixel agreement (fp32 vs bf16): {:f}'.format(torch.cat(agreement).mean().item()))
+    print('')
+
+
+def nchw_outputs(model, image):
+    '''
+        Names of the modules whose 4D outputs went back to the NCHW memory
+        format (tensors contiguous in both formats are not reported).
+    '''
+    names = []
+    hooks = []
+    def hook_fn(name):
+        def hook(module, inputs, output):
+            outputs = output if type(output) in [list, tuple] else [output]
+            for out in outputs:
+                if torch.is_tensor(out) and out.dim() == 4 and out.is_contiguous() and \
+                    not out.is_contiguous(memory_format=torch.channels_last):
+                    names.append(name)
+        return hook
+    for name, module in model.named_modules():
+        if name != '':
+            hooks.append(module.register_forward_hook(hook_fn(name)))
+    with torch.no_grad():
+        model(image)
+    for h in hooks:
+        h.remove()
+
+    return names
+
+
+def bench_channels_last(args, device):
+    '''
+        Throughput of each network in NCHW against channels-last (NHWC)
+        memory format, output difference between both and modules that do
+        not preserve the channels-last format.
+    '''
+    image, target = random_batch(args.batch_size, 1, 3, args.size, device)
+    image_cl = image.contiguous(memory_format=torch.channels_last)
+    target_cl = target.contiguous(memory_format=torch.channels_last)
+
+    print('--- Throughput (images/s) ---')
+    print('{:16s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s} {:>8s}'.format('network',
+          'train nchw', 'train nhwc', 'infer nchw', 'infer nhwc', 'max diff', 'to nchw'))
+    for net_type in args.nets:
+        model = build_model(net_type, 1, 3).to(device)
+        # Output difference (same weights)
+        model.eval()
+        with torch.no_grad():
+            pred = model(image)
+            model = model.to(memory_format=torch.channels_last)
+            pred_cl = model(image_cl)
+        if type(pred) is list:
+            pred, pred_cl = pred[0], pred_cl[0]
+        max_diff = (pred.float() - pred_cl.float()).abs().max().item()
+        # Modules converting back to NCHW
+        changes = nchw_outputs(model, image_cl)
+        # Throughput
+        results = []
+        for train in [True, False]:
+            for channels_last in [False, True]:
+                fmt = torch.channels_last if channels_last else torch.contiguous_format
+                model = model.to(memory_format=fmt)
+                results.append(time_steps(model, image_cl if channels_last else image,
+                                          target_cl if channels_last else target,
+                                          steps=args.steps, warmup=args.warmup,
+                                          train=train, bf16=args.bf16))
+        print('{:16s} {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:10.2e} {:8d}'.format(net_type,
+              *results, max_diff, len(changes)))
+        if len(changes) > 0:
+            print('    NCHW outputs: {:s}'.format(', '.join(sorted(set(changes)))))
+    print('')
+
+
+def bench_jit(args, device):
+    '''
+        Inference throughput of each network in eager mode against the
+        TorchScript compiled one (frozen and fused), compilation time and
+        output difference, in float32 and under bfloat16 autocast.
+    '''
+    from utils.jit import script_model, optimize_for_inference, output_difference
+    image, target = random_batch(args.batch_size, 1, 3, args.size, device)
+
+    print('--- Inference throughput (images/s) ---')
+    print('{:16s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s}'.format('network',
+          'eager', 'jit', 'compile s', 'max diff', 'bf16 diff'))
+    mismatch = []
+    for net_type in args.nets:
+        model = build_model(net_type, 1, 3).to(device)
+        model.eval()
+        eager = time_steps(model, image, target, steps=args.steps,
+                           warmup=args.warmup, train=False, bf16=args.bf16)
+        # Compilation
+        start = time.perf_counter()
+        scripted = optimize_for_inference(script_model(model))
+        compile_time = time.perf_counter() - start
+        jit = time_steps(scripted, image, target, steps=args.steps,
+                         warmup=args.warmup, train=False, bf16=args.bf16)
+        # Output difference (same autocast on both paths)
+        max_diff = output_difference(model, scripted, image)
+        bf16_diff = output_difference(model, scripted, image, bf16=True)
+        print('{:16s} {:10.2f} {:10.2f} {:10.2f} {:10.2e} {:10.2e}'.format(net_type,
+              eager, jit, compile_time, max_diff, bf16_diff))
+        # Softmax outputs: bfloat16 keeps 2-3 significant digits
+        if max_diff > 1e-3 or bf16_diff > 5e-2:
+            mismatch.append(net_type)
+    print('')
+    if len(mismatch) > 0:
+        print('Compiled output differs from the eager one: {:s}'.format(', '.join(mismatch)))
+        print('')
+
+
+# Time to first batch of a unet2 training run (main.py imports included)
+FIRST_BATCH_SCRIPT = '''
+import time
+t0 = time.perf_counter()
+import main
+import torch
+from nets.unet import Unet2
+from utils.losses import DiceLoss
+t1 = time.perf_counter()
+model = Unet2(n_channels=1, n_classes=3)
+image = torch.rand(1, 1, {size}, {size})
+target = torch.zeros(1, 3, {size}, {size})
+target[:, 0] = 1.
+loss = DiceLoss()(model(image), target)
+loss.backward()
+t2 = time.perf_counter()
+print(t1 - t0, t2 - t0)
+'''
+
+
+def bench_startup(args):
+    '''
+        Import time of the main modules and time to first batch of a unet2
+        training run, each measured on a fresh interpreter.
+    '''
+    modules = ['torch', 'torchvision', 'utils.losses', 'utils.datasets', 'utils.logger',
+               'train', 'main', 'predict', 'nets.unet', 'nets.deeplab', 'nets.fcn',
+               'nets.gcn', 'nets.rcnn']
+
+    print('--- Import time (s) ---')
+    for module in modules:
+        script = 'import time; t0 = time.perf_counter(); import {:s}; print(time.perf_counter() - t0)'.format(module)
+        out = subprocess.run([sys.executable, '-c', script], stdout=subprocess.PIPE,
+                             universal_newlines=True, check=True).stdout
+        print('{:16s} {:8.3f}'.format(module, float(out.split()[-1])))
+    print('')
+
+    out = subprocess.run([sys.executable, '-c', FIRST_BATCH_SCRIPT.format(size=args.size)],
+                         stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    t_import, t_batch = [float(t) for t in out.split()[-2:]]
+    print('--- unet2 startup (s) ---')
+    print('imports:         {:8.3f}'.format(t_import))
+    print('first batch:     {:8.3f}'.format(t_batch))
+    print('')
+
+
+# Main calls
+if __name__ == '__main__':
+
+    # Load inputs
+    parser = argparse.ArgumentParser(description="PyTorch segmentation network benchmarks.")
+    parser.add_argument('--mode', type=str, default='precision',
+                        choices=['precision', 'startup', 'channels_last', 'jit'],
+                        help='benchmark to run (default: precision)')
+    parser.add_argument('--nets', type=str, nargs='+', default=None,
+                        choices=[n for n in available_models() if n != 'mask_rcnn'],
+                        help='networks to benchmark (default: unet2 unet_light deeplabv3_r50 fcn_r50, '
+                             'channels_last and jit: unet2 unet_light sp_unet sp_unet2 gcn b_gcn deeplabv3p)')
+    parser.add_argument('--batch_size', type=int, default=2,
+                        help='batch size (default: 2)')
+    parser.add_argument('--size', type=int, default=256,
+                        help='input image size (default: 256)')
+    parser.add_argument('--steps', type=int, default=10,
+                        help='number of timed steps (default: 10)')
+    parser.add_argument('--warmup', type=int, default=2,
+                        help='number of warmup steps (default: 2)')
+    parser.add_argument('--weights', type=str, default=None,
+                        help='float32 checkpoint for the Dice comparison (default: None)')
+    parser.add_argument('--bf16', action='store_true',
+                        help='whether to run the channels_last and jit benchmarks with bfloat16 autocast (default: False)')
+
+    # Parse input data
+    args = parser.parse_args()
+
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+    # Default networks of each benchmark
+    if args.nets is None:
+        if args.mode in ['channels_last', 'jit']:
+            args.nets = ['unet2', 'unet_light', 'sp_unet', 'sp_unet2', 'gcn', 'b_gcn', 'deeplabv3p']
+        else:
+            args.nets = ['unet2', 'unet_light', 'deeplabv3_r50', 'fcn_r50']
+
+    if args.mode == 'precision':
+        bench_precision(args, device)
+    elif args.mode == 'startup':
+        bench_startup(args)
+    elif args.mode == 'channels_last':
+        bench_channels_last(args, device)
+    elif args.mode == 'jit':
+        bench_jit(args, device)
@@ -8,27 +8,24 @@ Created on Wed Mar 03 10:39:30 2019
 """
 
 import os
+import re
 import ast
 import sys
 import time
 import argparse
 import torch
-import torchvision
 
 import torch.nn as nn
 import utils.transformations as tsfrm
 
 from torch import optim
 from utils.logger import Logger
-from nets.deeplab import DeepLabv3, DeepLabv3_plus
-from nets.unet import *
-from nets.gcn import *
-from nets.fcn import *
-from nets.rcnn import *
 from utils.datasets import OvaryDataset, VOC2012Dataset, collate_fn_ov_list
 from utils.losses import *
 from train import Training
-from predict import Inference
+from utils.resources import ResourceManager, available_cores
+from utils.distributed import init_distributed, cleanup_distributed, get_world_size, is_main_process
+from nets.registry import available_models, build_model
 
 
 # Get time to generate output name
@@ -51,47 +48,68 @@ def gettrainname(name):
     return tm_str + '_' + name
 
 
-# Main calls
-if __name__ == '__main__':
+def resumedtrainname(weights_path):
+    '''
+    Get the train name of a checkpoint file
+    (<train_name>_weights.pth.tar or <train_name>_epochNNN_weights.pth.tar).
 
-    parser = argparse.ArgumentParser(description="PyTorch segmentation network training and prediction.")
-    parser.add_argument('--net', type=str, default='unet2',
-                        choices=['fcn_r101', 'fcn_r50',
-                                'deeplabv3', 'deeplabv3_r50', 'deeplabv3p', 'deeplabv3p_r50',
-                                 'unet', 'unet_light', 'unet2', 'd_unet2',
-                                 'sp_unet', 'sp_unet2',
-                                 'gcn', 'gcn2', 'b_gcn', 'u_gcn',
-                                 'mask_rcnn'],
-                        help='network name (default: unet2)')
-    parser.add_argument('--epochs', type=int, default=1,
-                        help='number of epochs (default: 1)')
-    parser.add_argument('--batch_size', type=int, default=4,
-                        help='batch size (default: 1)')
-    parser.add_argument('--dataset', type=str, default='ovarian',
-                        choices=['ovarian', 'voc2012'],
-                        help='select dataset, it also defines the input depth and the output classes (default: ovarian)')
-    parser.add_argument('--multitask', type=str, default='none',
-                        choices=['none', 'ovary', 'follicle', 'both'],
-                        help='select dataset (default: ovarian)')
-    parser.add_argument('--opt', type=str, default='adam',
-                        choices=['adam', 'adamax', 'sgd'],
-                        help='optmization process (default: adam)')
-    parser.add_argument('--loss', type=str, default='dsc',
-                        choices=['dice', 'wdice', 'discriminative', 'crossentropy', 'multitaskdict'],
-                        help='loss function (default: dice)')
-    parser.add_argument('--clahe', type=bool, default=False,
-                        help='whether to use adaptive histogram equalization (default: False)')
-    parser.add_argument('--interaction', type=bool, default=False,
-                        help='whether to use interaction points (default: False)')
-    parser.add_argument('--bilinear', type=bool, default=False,
-                        help='whether to use bilinear upsampling should be used instead of Transpose Conv. (default: False)')
+    Arguments:
+    @weights_path (string): checkpoint file
 
-    # Parse input data
-    args = parser.parse_args()
+    Returns: train_name (string)
+    '''
+    filename = os.path.basename(weights_path)
+    match = re.match(r'(.+?)(_epoch\d+)?_weights\.pth\.tar$', filename)
+    if match is None:
+        return filename.split('.')[0]
+    return match.group(1)
+
+
+def run(local_rank, args):
+    '''
+    Train and test a network (one worker process in data-parallel mode).
+
+    Arguments:
+    @local_rank (int): process index on this host
+    @args (Namespace): command line arguments
+    '''
+
+    # Distributed (data-parallel) execution
+    world_size = args.nnodes * args.nproc
+    local_world_size = args.nproc
+    if world_size > 1:
+        rank = args.node_rank * args.nproc + local_rank
+        init_distributed(world_size, rank, backend='gloo',
+                         init_method='tcp://{:s}:{:d}'.format(args.master_addr, args.master_port))
+    elif 'WORLD_SIZE' in os.environ and int(os.environ['WORLD_SIZE']) > 1:
+        # Launched by torchrun (or torch.distributed.launch)
+        init_distributed(backend='gloo', init_method='env://')
+        world_size = get_world_size()
+        local_rank = int(os.environ.get('LOCAL_RANK', 0))
+        local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+    main_process = is_main_process()
+
+    # CPU resources: compute threads and data loader workers (cores of the
+    # host are split among its data-parallel processes)
+    cores = available_cores()
+    if local_world_size > 1:
+        n_cores = max(1, len(cores) // local_world_size)
+        cores = cores[local_rank * n_cores:(local_rank + 1) * n_cores]
+    resources = ResourceManager(compute_threads=args.threads, loader_workers=args.workers,
+                                cores=cores, pin=args.pin_cores)
+    resources.apply()
 
     # Input parameters
     n_epochs = args.epochs
     batch_size = args.batch_size
+    micro_batch = args.micro_batch
+    val_interval = args.val_interval
+    val_subset = args.val_subset
+    val_full_interval = args.val_full_interval
+    val_batch_size = args.val_batch_size
+    patience = args.patience
+    plateau_patience = args.plateau_patience
+    min_delta = args.min_delta
     dataset_name = args.dataset
     opt = args.opt
     loss = args.loss
@@ -100,6 +118,19 @@ if __name__ == '__main__':
     clahe = args.clahe
     interaction = args.interaction
     multitask = args.multitask
+    intensity_aug = args.intensity_aug
+    ignore_void = args.ignore_void
+    loss_samples = args.loss_samples
+    loss_sampling = args.loss_sampling
+    logits = args.logits
+    bf16 = args.bf16
+    channels_last = args.channels_last
+    checkpointing = args.checkpointing
+    resume = args.resume
+    weights_only = args.weights_only
+    keep_last = args.keep_last
+    histo_interval = args.histo_interval
+    histo_layers = args.histo_layers
 
     network_name = net_type
 
@@ -129,6 +160,11 @@ if __name__ == '__main__':
         target = 'gt_mask'
         network_name += '_voc2012'
 
+    # Void channel (last VOC class) to be ignored by the losses
+    ignore_index = None
+    if ignore_void and dataset_name == 'voc2012':
+        ignore_index = n_classes - 1
+
     if clahe:
         in_channels += 1
 
@@ -145,40 +181,12 @@ if __name__ == '__main__':
         target = 'targets'
         loss = 'multitaskdict'
         train_with_targets = True
-        model = MaskRCNN(n_channels=in_channels, n_classes=n_classes, pretrained=True)
-    # FCN models
-    elif net_type == 'fcn_r101':
-        model = FCN(n_channels=in_channels, n_classes=n_classes, resnet_type=101, pretrained=True)
-    elif net_type == 'fcn_r50':
-        model = FCN(n_channels=in_channels, n_classes=n_classes, resnet_type=50)
-    # Deeplab v3
-    elif net_type == 'deeplabv3':
-        model = DeepLabv3(n_channels=in_channels, n_classes=n_classes, resnet_type=101, pretrained=True)
-    elif net_type == 'deeplabv3_r50':
-        model = DeepLabv3(n_channels=in_channels, n_classes=n_classes, resnet_type=50, pretrained=True)
-    # Deeplab v3+
-    elif net_type == 'deeplabv3p':
-        model = DeepLabv3_plus(nInputChannels=in_channels, n_classes=n_classes, os=16, pretrained=True)
-    elif net_type == 'deeplabv3p_r50':
-        model = DeepLabv3_plus(nInputChannels=in_channels, n_classes=n_classes, os=16, resnet_type=50, pretrained=True)
-    # Global Convolution Network
-    elif net_type == 'gcn':
-        model = GCN(n_channels=in_channels, n_classes=n_classes)
-    elif net_type == 'b_gcn':
-        model = BalancedGCN(n_channels=in_channels, n_classes=n_classes)
-    # Unet models
-    elif net_type == 'unet':
-        model = Unet(n_channels=in_channels, n_classes=n_classes)
-    elif net_type == 'unet_light':
-        model = UnetLight(n_channels=in_channels, n_classes=n_classes, bilinear=bilinear)
-    elif net_type == 'sp_unet':
-        model = SpatialPyramidUnet(n_channels=in_channels, n_classes=n_classes, bilinear=bilinear)
-    elif net_type == 'sp_unet2':
-        model = SpatialPyramidUnet2(n_channels=in_channels, n_classes=n_classes, bilinear=bilinear)
-    elif net_type == 'd_unet':
-        model = DilatedUnet2(n_channels=in_channels, n_classes=n_classes, bilinear=bilinear)
-    else:
-        model = Unet2(n_channels=in_channels, n_classes=n_classes, bilinear=bilinear)
+    # Cross entropy applies log-softmax itself: the network returns logits
+    if loss == 'crossentropy':
+        logits = True
+    build_kwargs = {'n_channels': in_channels, 'n_classes': n_classes,
+                    'bilinear': bilinear, 'train_logits': logits}
+    model = build_model(net_type, pretrained=True, **build_kwargs)
 
     # Define training name
     train_name = gettrainname(network_name)
@@ -196,13 +204,25 @@ if __name__ == '__main__':
     print('')
 
     # Load CUDA if exist
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    device = torch.device("cuda:0" if torch.cuda.is_available() and world_size == 1 else "cpu")
 
     # Transformation parameters
     transform = tsfrm.Compose([tsfrm.RandomHorizontalFlip(p=0.5),
                            tsfrm.RandomVerticalFlip(p=0.5),
                            tsfrm.RandomAffine(90, translate=(0.15, 0.15), scale=(0.75, 1.5), resample=3, fillcolor=0)
                            ])
+    # Batch transformations (applied on device)
+    batch_transform = None
+    if intensity_aug:
+        # Image channels only (ovarian: CLAHE first, interaction map last)
+        if dataset_name == 'ovarian':
+            image_channels = slice(int(clahe), int(clahe) + 1)
+        else:
+            image_channels = slice(0, 3)
+        batch_transform = tsfrm.Compose([tsfrm.BatchColorJitter(brightness=0.2, contrast=0.2, gamma=0.2,
+                                                                channels=image_channels),
+                                         tsfrm.BatchRandomDefocusBlur(radius=1.5, channels=image_channels)
+                                         ])
 
     # Dataset definitions
     if dataset_name == 'ovarian':
@@ -217,8 +237,10 @@ if __name__ == '__main__':
         im_dir = '../datasets/voc2012/JPEGImages/'
         gt_dir = '../datasets/voc2012/SegmentationClass/'
         list_dir = '../datasets/voc2012/'
-        dataset_train = VOC2012Dataset(im_dir=im_dir, gt_dir=gt_dir, file_list=list_dir+'train.txt')
-        dataset_val =   VOC2012Dataset(im_dir=im_dir, gt_dir=gt_dir, file_list=list_dir+'val.txt')
+        dataset_train = VOC2012Dataset(im_dir=im_dir, gt_dir=gt_dir, file_list=list_dir+'train.txt',
+                                       pad_void=ignore_index is not None)
+        dataset_val =   VOC2012Dataset(im_dir=im_dir, gt_dir=gt_dir, file_list=list_dir+'val.txt',
+                                       pad_void=ignore_index is not None)
         dataset_test =  VOC2012Dataset(im_dir=im_dir, gt_dir=gt_dir, file_list=list_dir+'val.txt')
 
     # Training Parameters
@@ -233,9 +255,9 @@ if __name__ == '__main__':
 
     # Loss function
     if loss == 'dsc' or loss == 'dice':
-        loss_function = DiceLoss()
+        loss_function = DiceLoss(ignore_index=ignore_index, logits=logits)
     elif loss == 'wdice' or loss == 'weighted_dice':
-        loss_function = WeightedDiceLoss()
+        loss_function = WeightedDiceLoss(ignore_index=ignore_index, logits=logits)
         train_name += '_wdsc'
     elif loss == 'discriminative' or loss == 'dlf':
         loss_function = DiscriminativeLoss(n_features=2)
@@ -244,24 +266,75 @@ if __name__ == '__main__':
         loss_function = MultiTaskDictLoss()
         train_name += '_mtd'
     else:
+        # Cross entropy applies log-softmax (network trained on logits)
         loss_function = nn.CrossEntropyLoss()
         train_name += '_entp'
+    # Sparse (pixel sampled) training loss
+    if loss_samples > 0 and loss not in ['discriminative', 'dlf', 'multitaskdict']:
+        if loss_samples > 1:
+            loss_samples = int(loss_samples)
+        loss_function = SampledLoss(loss_function, samples=loss_samples, mode=loss_sampling)
+        train_name += '_sp'
+    # Resumed training keeps its name (checkpoints and logs)
+    if resume:
+        train_name = resumedtrainname(resume)
     # Validation loss
-    val_loss = DiceLoss()
+    val_loss = DiceLoss(ignore_index=ignore_index)
 
-    # Set logs folder
-    logger = Logger('../logs/' + train_name + '/')
+    # Set logs folder (main process only)
+    logger = Logger('../logs/' + train_name + '/') if main_process else None
 
     # Run training
     training = Training(model, device, dataset_train, dataset_val,
                         optmizer, loss_function,
                         eval_loss=val_loss, target=target,
                         train_with_targets = train_with_targets,
-                        logger=logger, train_name=train_name, arch=net_type)
-    training.train(epochs=n_epochs, batch_size=batch_size)
+                        logger=logger, train_name=train_name, arch=net_type,
+                        build_kwargs=build_kwargs,
+                        batch_transform=batch_transform, bf16=bf16,
+                        weights_only=weights_only, keep_last=keep_last,
+                        histo_interval=histo_interval, histo_layers=histo_layers,
+                        resources=resources, channels_last=channels_last,
+                        checkpointing=checkpointing)
+    if args.autotune_batch:
+        if world_size > 1:
+            if main_process:
+                print('Batch size autotune runs in a single process: --batch_size {:d} kept.'.format(batch_size))
+        elif train_with_targets:
+            print('Batch size autotune does not support detection targets: --batch_size {:d} kept.'.format(batch_size))
+        else:
+            budget = int(args.memory_budget * 1024 ** 3) if args.memory_budget > 0 else None
+            recommended = training.autotune_batch_size(budget=budget, max_batch=args.max_batch)
+            # The budget bounds the images per forward/backward pass
+            if micro_batch > 0:
+                micro_batch = min(recommended, batch_size)
+            else:
+                batch_size = recommended
+    if args.autotune_resources:
+        resources = training.autotune_resources(batch_size=batch_size, cores=cores, pin=args.pin_cores)
+    if training.checkpointing:
+        training.report_checkpointing(batch_size=micro_batch if micro_batch > 0 else batch_size)
+    if main_process:
+        resources.report()
+    if resume:
+        training.resume(resume)
+        print('resumed from:   {:s} (epoch {:d})'.format(resume, training.start_epoch))
+    training.train(epochs=n_epochs, batch_size=batch_size, micro_batch=micro_batch,
+                   val_interval=val_interval, val_subset=val_subset,
+                   val_full_interval=val_full_interval, val_batch_size=val_batch_size,
+                   patience=patience, plateau_patience=plateau_patience, min_delta=min_delta)
+    # Stop the flush thread and close the event file
+    if logger is not None:
+        logger.close()
     print('------------- END OF TRAINING -------------')
     print(' ')
 
+    # Test only on the main process
+    if world_size > 1:
+        cleanup_distributed()
+    if not main_process:
+        return
+
     # Test network model
     print('Testing')
     print('')
@@ -271,5 +344,124 @@ if __name__ == '__main__':
     if not os.path.exists(out_folder):
         os.makedirs(out_folder)
     # Load inference
-    inference = Inference(model, device, weights_path, folder=out_folder)
-    inference.predict(dataset_test)
\ No newline at end of file
+    from predict import Inference
+    if checkpointing:
+        from nets.checkpointing import disable_checkpointing
+        disable_checkpointing(model)
+    inference = Inference(model, device, weights_path, folder=out_folder, bf16=bf16,
+                          resources=resources, channels_last=channels_last,
+                          jit=args.jit, jit_cache='../weights/jit_cache/',
+                          ignore_index=ignore_index)
+    inference.predict(dataset_test)
+
+
+# Main calls
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="PyTorch segmentation network training and prediction.")
+    parser.add_argument('--net', type=str, default='unet2',
+                        choices=available_models(aliases=True),
+                        help='network name (default: unet2)')
+    parser.add_argument('--epochs', type=int, default=1,
+                        help='number of epochs (default: 1)')
+    parser.add_argument('--batch_size', type=int, default=4,
+                        help='batch size (default: 1)')
+    parser.add_argument('--micro_batch', type=int, default=0,
+                        help='images per forward/backward pass with gradient accumulation, 0 for the whole batch (default: 0)')
+    parser.add_argument('--val_interval', type=int, default=1,
+                        help='epochs between validations (default: 1)')
+    parser.add_argument('--val_subset', type=float, default=0,
+                        help='validation images (>1) or fraction (<=1) of a fixed random subset, 0 for the whole set (default: 0)')
+    parser.add_argument('--val_full_interval', type=int, default=0,
+                        help='epochs between full validation passes with --val_subset, 0 for the last epoch only (default: 0)')
+    parser.add_argument('--val_batch_size', type=int, default=1,
+                        help='validation batch size (default: 1)')
+    parser.add_argument('--patience', type=int, default=0,
+                        help='epochs without validation improvement before early stopping, 0 to disable (default: 0)')
+    parser.add_argument('--plateau_patience', type=int, default=0,
+                        help='epochs without validation improvement before reducing the learning rate, 0 to disable (default: 0)')
+    parser.add_argument('--min_delta', type=float, default=0.,
+                        help='minimum validation loss decrease counted as improvement (default: 0)')
+    parser.add_argument('--dataset', type=str, default='ovarian',
+                        choices=['ovarian', 'voc2012'],
+                        help='select dataset, it also defines the input depth and the output classes (default: ovarian)')
+    parser.add_argument('--multitask', type=str, default='none',
+                        choices=['none', 'ovary', 'follicle', 'both'],
+                        help='select dataset (default: ovarian)')
+    parser.add_argument('--opt', type=str, default='adam',
+                        choices=['adam', 'adamax', 'sgd'],
+                        help='optmization process (default: adam)')
+    parser.add_argument('--loss', type=str, default='dsc',
+                        choices=['dice', 'wdice', 'discriminative', 'crossentropy', 'multitaskdict'],
+                        help='loss function (default: dice)')
+    parser.add_argument('--clahe', type=bool, default=False,
+                        help='whether to use adaptive histogram equalization (default: False)')
+    parser.add_argument('--interaction', type=bool, default=False,
+                        help='whether to use interaction points (default: False)')
+    parser.add_argument('--bilinear', type=bool, default=False,
+                        help='whether to use bilinear upsampling should be used instead of Transpose Conv. (default: False)')
+    parser.add_argument('--loss_samples', type=float, default=0,
+                        help='pixels per image (>1) or fraction of pixels (<=1) used by the training loss, 0 for all pixels (default: 0)')
+    parser.add_argument('--loss_sampling', type=str, default='stratified',
+                        choices=['random', 'stratified', 'uncertainty'],
+                        help='pixel sampling of the training loss (default: stratified)')
+    parser.add_argument('--ignore_void', action='store_true',
+                        help='whether to ignore VOC void and padding pixels in the Dice losses (default: False)')
+    parser.add_argument('--intensity_aug', action='store_true',
+                        help='whether to apply batched intensity augmentation (jitter + defocus blur) on device (default: False)')
+    parser.add_argument('--logits', action='store_true',
+                        help='whether to train on logits, fusing the softmax into the loss '
+                             '(always on with crossentropy) (default: False)')
+    parser.add_argument('--resume', type=str, default='',
+                        help='checkpoint to resume the training from, keeping its training name (default: none)')
+    parser.add_argument('--weights_only', action='store_true',
+                        help='whether to save checkpoints without the optimizer state (default: False)')
+    parser.add_argument('--keep_last', type=int, default=0,
+                        help='number of rolling last epoch checkpoints to keep, 0 to save only the best (default: 0)')
+    parser.add_argument('--histo_interval', type=int, default=1,
+                        help='epochs between parameter histograms in the logs, 0 to disable (default: 1)')
+    parser.add_argument('--histo_layers', type=str, nargs='*', default=[],
+                        help='parameter names (or parts of them) to log histograms for (default: all)')
+    parser.add_argument('--nproc', type=int, default=1,
+                        help='data-parallel worker processes per host (default: 1)')
+    parser.add_argument('--nnodes', type=int, default=1,
+                        help='number of hosts (default: 1)')
+    parser.add_argument('--node_rank', type=int, default=0,
+                        help='index of this host (default: 0)')
+    parser.add_argument('--master_addr', type=str, default='127.0.0.1',
+                        help='address of the host with rank 0 (default: 127.0.0.1)')
+    parser.add_argument('--master_port', type=int, default=29500,
+                        help='port of the host with rank 0 (default: 29500)')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='compute (intra-op) threads, 0 for the cores not used by loader workers (default: 0)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='data loader workers (default: 0)')
+    parser.add_argument('--pin_cores', action='store_true',
+                        help='whether to pin compute threads and loader workers to their cores (default: False)')
+    parser.add_argument('--autotune_resources', action='store_true',
+                        help='whether to measure a few threads/workers partitions and use the fastest (default: False)')
+    parser.add_argument('--bf16', action='store_true',
+                        help='whether to run training and inference with bfloat16 autocast (default: False)')
+    parser.add_argument('--channels_last', action='store_true',
+                        help='whether to run training and inference in channels-last memory format (default: False)')
+    parser.add_argument('--autotune_batch', action='store_true',
+                        help='whether to train with the largest batch size (micro batch, if set) that fits the memory budget (default: False)')
+    parser.add_argument('--memory_budget', type=float, default=0,
+                        help='memory budget of the batch size autotune in GB, 0 for 90%% of the GPU memory or of the available RAM (default: 0)')
+    parser.add_argument('--max_batch', type=int, default=256,
+                        help='largest batch size tried by the autotune (default: 256)')
+    parser.add_argument('--checkpointing', type=str, nargs='*', default=[],
+                        choices=['encoder', 'decoder', 'aspp', 'resnet'],
+                        help='blocks of the network recomputed in backward (activation checkpointing), '
+                             'the groups available depend on the architecture (default: none)')
+    parser.add_argument('--jit', action='store_true',
+                        help='whether to run the inference (test) with the network compiled with TorchScript (default: False)')
+
+    # Parse input data
+    args = parser.parse_args()
+
+    # Launch workers (data-parallel) or run in this process
+    if args.nproc > 1:
+        torch.multiprocessing.spawn(run, args=(args,), nprocs=args.nproc)
+    else:
+        run(0, args)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 15:36:08 2026
+
+@author: Diego Wanderley
+@python: 3.6 and Pytroch
+@description: Activation checkpointing - selected blocks of the networks
+    are recomputed during backward instead of keeping their activations
+"""
+
+import torch
+import contextlib
+
+from torch.utils.checkpoint import checkpoint
+from nets.registry import resolve_name
+
+
+def _names(prefix, first, last):
+    return ['{:s}{:d}'.format(prefix, i) for i in range(first, last + 1)]
+
+
+# Groups of blocks that can be recomputed
+GROUPS = ['encoder', 'decoder', 'aspp', 'resnet']
+
+# name: {group: list of module names}
+BLOCKS = {
+    'fcn_r101':       {'resnet': _names('fcn_body.backbone.layer', 1, 4)},
+    'fcn_r50':        {'resnet': _names('fcn_body.backbone.layer', 1, 4)},
+    'deeplabv3':      {'resnet': _names('deeplab.backbone.layer', 1, 4),
+                       'aspp': ['deeplab.classifier.0']},
+    'deeplabv3_r50':  {'resnet': _names('deeplab.backbone.layer', 1, 4),
+                       'aspp': ['deeplab.classifier.0']},
+    'deeplabv3p':     {'resnet': _names('resnet_features.layer', 1, 4),
+                       'aspp': _names('aspp', 1, 4) + ['global_avg_pool'],
+                       'decoder': ['last_conv']},
+    'deeplabv3p_r50': {'resnet': _names('resnet_features.layer', 1, 4),
+                       'aspp': _names('aspp', 1, 4) + ['global_avg_pool'],
+                       'decoder': ['last_conv']},
+    'gcn':            {'resnet': _names('resnet', 1, 4),
+                       'decoder': _names('gcn', 1, 4) + _names('deconv', 1, 5)},
+    'b_gcn':          {'resnet': _names('resnet', 1, 4),
+                       'decoder': _names('gcn', 1, 4) + _names('deconv', 1, 5)},
+    'u_gcn':          {'encoder': _names('conv_down', 1, 6),
+                       'decoder': _names('gcn', 0, 5) + _names('conv_up', 1, 6)},
+    'unet':           {'encoder': _names('conv_down', 1, 4) + ['conv_fwd'],
+                       'decoder': _names('conv_up', 1, 4)},
+    'unet_light':     {'encoder': _names('conv_down', 1, 6),
+                       'decoder': _names('conv_up', 1, 6)},
+    'unet2':          {'encoder': _names('conv_down', 1, 6),
+                       'decoder': _names('conv_up', 1, 6)},
+    'd_unet2':        {'encoder': _names('conv_', 1, 6),
+                       'decoder': _names('conv_up', 1, 3)},
+    'sp_unet':        {'encoder': _names('conv_down', 1, 4) + ['conv_bottom'],
+                       'aspp': ['aspp_block'],
+                       'decoder': _names('conv_up', 1, 4)},
+    'sp_unet2':       {'encoder': _names('conv_down', 1, 4) + ['conv_bottom'],
+                       'aspp': ['aspp_block'],
+                       'decoder': _names('conv_up', 1, 4)},
+}
+
+
+def checkpoint_blocks(arch, groups=None):
+    '''
+        Names of the blocks of an architecture in the given groups.
+
+        Arguments:
+            @param arch: architecture name (see nets.registry)
+            @param groups: list of groups (None: all of them)
+    '''
+    arch = resolve_name(arch)
+    if arch not in BLOCKS:
+        raise ValueError("Activation checkpointing is not available for '{}'.".format(arch))
+    if groups is None:
+        groups = GROUPS
+    names = []
+    for group in groups:
+        names += BLOCKS[arch].get(group, [])
+    return names
+
+
+@contextlib.contextmanager
+def _frozen_batch_norm(module):
+    '''
+        Restore the batch normalization buffers (running statistics and
+        number of batches tracked) of a module on exit.
+    '''
+    buffers = []
+    for m in module.modules():
+        if isinstance(m, torch.nn.modules.batchnorm._BatchNorm) and m.track_running_stats:
+            buffers += [b for b in [m.running_mean, m.running_var, m.num_batches_tracked]
+                        if b is not None]
+    saved = [b.clone() for b in buffers]
+    try:
+        yield
+    finally:
+        with torch.no_grad():
+            for b, value in zip(buffers, saved):
+                b.copy_(value)
+
+
+def _checkpointed_forward(module):
+    ''' Forward method of a module recomputed in backward '''
+    forward = module.forward
+    def checkpointed_forward(*args, **kwargs):
+        # Only when the activations would be kept for backward
+        if module.training and torch.is_grad_enabled():
+            calls = [0]
+            def run(*args, **kwargs):
+                calls[0] += 1
+                if calls[0] == 1:
+                    return forward(*args, **kwargs)
+                # Recomputation in backward: statistics already updated
+                with _frozen_batch_norm(module):
+                    return forward(*args, **kwargs)
+            return checkpoint(run, *args, use_reentrant=False, **kwargs)
+        return forward(*args, **kwargs)
+    return checkpointed_forward
+
+
+def enable_checkpointing(model, arch, groups=None):
+    '''
+        Recompute the selected blocks of a network during backward. The
+        weights and buffers (state_dict) are the ones of the network without
+        checkpointing.
+
+        Arguments:
+            @param model: network model
+            @param arch: architecture name of the model
+            @param groups: list of groups (None: all of them)
+
+        Returns: names of the checkpointed blocks
+    '''
+    names = checkpoint_blocks(arch, groups)
+    for name in names:
+        module = model.get_submodule(name)
+        if 'forward' not in module.__dict__:
+            module.forward = _checkpointed_forward(module)
+    return names
+
+
+def disable_checkpointing(model):
+    '''
+        Restore the forward method of all checkpointed blocks.
+    '''
+    for module in model.modules():
+        if 'forward' in module.__dict__:
+            del module.forward
+
+
+def saved_tensors_bytes(fn, model=None):
+    '''
+        Run a forward function and measure the memory of the tensors it
+        keeps for backward.
+
+        Arguments:
+            @param fn: function running the forward pass
+            @param model: network model, whose parameters are not counted
+
+        Returns: number of bytes, output of fn
+    '''
+    params = set()
+    if model is not None:
+        params = set(p.untyped_storage().data_ptr() for p in model.parameters())
+    storages = {}
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in params:
+            storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+    def unpack(tensor):
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, unpack):
+        output = fn()
+    return sum(storages.values()), output
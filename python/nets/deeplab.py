@@ -201,7 +201,8 @@ class ASPP_module(nn.Module):
 
 class DeepLabv3_plus(nn.Module):
     def __init__(self, nInputChannels=3, n_classes=21, os=16, softmax_out=True, dropout=0.2,
-                        resnet_type=101, pretrained=False, freeze_bn=False, _print=True):
+                        resnet_type=101, pretrained=False, freeze_bn=False, _print=True,
+                        train_logits=False):
         if _print:
             print("Constructing DeepLabv3+ model...")
             print("Backbone: Resnet-" + str(resnet_type))
@@ -266,7 +267,7 @@ class DeepLabv3_plus(nn.Module):
 
         # Softmax alternative
         self.has_softmax = softmax_out
-        self.softmax = nn.Softmax2d()
+        self.softmax = SoftmaxOut(train_logits)
 
 
     def forward(self, input):
@@ -279,6 +280,8 @@ class DeepLabv3_plus(nn.Module):
         x4 = self.aspp4(x)
         x5 = self.global_avg_pool(x)
         x5 = F.interpolate(x5, size=x4.size()[2:], mode='bilinear', align_corners=True)
+        # Pooling branch (1x1) loses the memory format
+        x5 = match_memory_format(x5, x4)
 
         x = torch.cat((x1, x2, x3, x4, x5), dim=1)
 
@@ -294,7 +297,7 @@ class DeepLabv3_plus(nn.Module):
         low_level_features = self.bn2(low_level_features)
         low_level_features = self.relu(low_level_features)
 
-        x = torch.cat((x, low_level_features), dim=1)
+        x = torch.cat((match_memory_format(x, x4), match_memory_format(low_level_features, x4)), dim=1)
         x = self.last_conv(x)
         x = F.interpolate(x, size=input.size()[2:], mode='bilinear', align_corners=True)
 
@@ -347,7 +350,7 @@ def get_10x_lr_params(model):
 
 class DeepLabv3(nn.Module):
     def __init__(self, n_channels=3, n_classes=21, softmax_out=True,
-                        resnet_type=101, pretrained=False):
+                        resnet_type=101, pretrained=False, train_logits=False):
         super(DeepLabv3, self).__init__()
 
         self.resnet_type = resnet_type
@@ -380,16 +383,16 @@ class DeepLabv3(nn.Module):
         # Softmax alternative
         self.has_softmax = softmax_out
         if softmax_out:
-            self.softmax = nn.Softmax2d()
+            self.softmax = SoftmaxOut(train_logits)
         else:
             self.softmax = None
 
     def forward(self, x):
-        if self.inconv != None:
+        if self.inconv is not None:
             x = self.inconv(x)
         x_deep = self.deeplab(x)
         x_out = x_deep["out"]
-        if self.softmax != None:
+        if self.softmax is not None:
             x_out = self.softmax(x_out)
         return x_out
 
@@ -16,7 +16,7 @@ from nets.modules import *
 
 class FCN(nn.Module):
     def __init__(self, n_channels=3, n_classes=21, softmax_out=True,
-                        resnet_type=101, pretrained=False):
+                        resnet_type=101, pretrained=False, train_logits=False):
         super(FCN, self).__init__()
 
         self.resnet_type = resnet_type
@@ -49,16 +49,16 @@ class FCN(nn.Module):
         # Softmax alternative
         self.has_softmax = softmax_out
         if softmax_out:
-            self.softmax = nn.Softmax2d()
+            self.softmax = SoftmaxOut(train_logits)
         else:
             self.softmax = None
 
     def forward(self, x):
-        if self.inconv != None:
+        if self.inconv is not None:
             x = self.inconv(x)
         x_deep = self.fcn_body(x)
         x_out = x_deep["out"]
-        if self.softmax != None:
+        if self.softmax is not None:
             x_out = self.softmax(x_out)
         return x_out
 
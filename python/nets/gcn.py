@@ -19,7 +19,7 @@ class GCN(nn.Module):
     '''
         Fully Global Convolution Network
     '''
-    def __init__(self, n_channels, n_classes):
+    def __init__(self, n_channels, n_classes, train_logits=False):
         ''' Constructor '''
         super(GCN, self).__init__()
         # Number of classes definition
@@ -68,7 +68,7 @@ class GCN(nn.Module):
         self.deconv5 = UpConv(n_classes, n_classes) # Spatial size 256x256 -> 512x512
 
         # Softmax
-        self.softmax = nn.Softmax2d()
+        self.softmax = SoftmaxOut(train_logits)
 
 
     def forward(self, x):
@@ -128,7 +128,7 @@ class BalancedGCN(nn.Module):
     '''
         Balanced Fully Global Convolution Network with simetric features reducing to number of classes.
     '''
-    def __init__(self, n_channels, n_classes, bnorm=True, reg=True, convout=True):
+    def __init__(self, n_channels, n_classes, bnorm=True, reg=True, convout=True, train_logits=False):
         ''' Constructor '''
         super(BalancedGCN, self).__init__()
         # Number of classes definition
@@ -180,7 +180,7 @@ class BalancedGCN(nn.Module):
         self.deconv5 = UpConv(16, 3) # Spatial size 256x256 -> 512x512
 
         # Softmax
-        self.softmax = nn.Softmax2d()
+        self.softmax = SoftmaxOut(train_logits)
 
 
     def forward(self, x):
@@ -240,15 +240,19 @@ class UGCN(nn.Module):
     '''
     U-net with Global convolutions class from end-to-end ovarian structures segmentation
     '''
-    def __init__(self, n_channels, n_classes, bilinear=False):
+    # Multiple output heads (static branch when scripted)
+    __constants__ = ['multi_head']
+
+    def __init__(self, n_channels, n_classes, bilinear=False, train_logits=False):
         ''' Constructor '''
         super(UGCN, self).__init__()
 
         # Number of classes definition
         self.n_classes = n_classes
+        self.multi_head = type(n_classes) is list
 
         # Set input layer
-        self.conv_init  = inconv(n_channels, 8)
+        self.conv_init  = InConv(n_channels, 8)
 
         # Set downconvolution layer 1
         self.conv_down1 = DownConv(8, 8, dropout=0.2) # 512 -> 256
@@ -293,7 +297,7 @@ class UGCN(nn.Module):
         else:
             self.conv_out = OutConv(8, n_classes)
         # Define Softmax
-        self.softmax = nn.Softmax2d()
+        self.softmax = SoftmaxOut(train_logits)
 
     def forward(self, x):
         ''' Foward method '''
@@ -322,7 +326,7 @@ class UGCN(nn.Module):
         uc_x5 = self.conv_up5(uc_x4, gc_x1)
         uc_x6 = self.conv_up6(uc_x5, gc_x0)
         # output
-        if type(self.n_classes) is list:
+        if self.multi_head:
             x_out = []
             for c_out in self.conv_out:
                 x = c_out(uc_x6)
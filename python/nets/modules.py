@@ -12,6 +12,27 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 
+def is_channels_last(x):
+    '''
+        Check if a 4D tensor is in channels-last memory format. Ambiguous
+        tensors (1x1 spatial size or a single channel) are reported as NCHW.
+    '''
+    return x.dim() == 4 and not x.is_contiguous() and \
+        x.is_contiguous(memory_format=torch.channels_last)
+
+
+def match_memory_format(x, ref):
+    '''
+        Convert a 4D tensor to the memory format of ref (no copy when it is
+        already in it).
+    '''
+    if x.dim() != 4:
+        return x
+    if is_channels_last(ref):
+        return x.contiguous(memory_format=torch.channels_last)
+    return x.contiguous()
+
+
 class InConv(nn.Module):
     '''
     Input layer
@@ -239,13 +260,16 @@ class UpConv(nn.Module):
         self.conv.add_module("fwdconv_2", FwdConv(out_ch, out_ch, batch_norm=batch_norm))
 
     def forward(self, x, x_res=None):
+        # type: (Tensor, Optional[Tensor]) -> Tensor
         ''' Foward method '''
         x_up = self.up(x)
+        # Keep the memory format of the input (torch.cat follows its inputs)
+        x_up = match_memory_format(x_up, x)
 
         if x_res is None:
             x_cat = x_up
         else:
-            x_cat = torch.cat((x_up, x_res), 1)
+            x_cat = torch.cat((x_up, match_memory_format(x_res, x)), 1)
 
         x_conv = self.conv(x_cat)
 
@@ -275,6 +299,27 @@ class OutConv(nn.Module):
         return x
 
 
+class SoftmaxOut(nn.Softmax2d):
+    '''
+    Output Softmax (over channels).
+    With train_logits, the raw logits are returned in training mode, so the
+    loss can fuse the softmax (or log-softmax) with its own computation.
+    The softmax is always computed in float32 (safe under autocast) and
+    returned in the memory format of the input.
+    '''
+    def __init__(self, train_logits=False):
+        ''' Constructor '''
+        super(SoftmaxOut, self).__init__()
+        self.train_logits = train_logits
+
+    def forward(self, x):
+        ''' Foward method '''
+        if self.train_logits and self.training:
+            return x
+        out = F.softmax(x.float(), dim=-3)
+        return match_memory_format(out, x)
+
+
 class GlobalAvgPool(nn.Module):
     '''
     Atrous or dilated convolution layer
@@ -389,8 +434,9 @@ class ASPP(nn.Module):
         ]
         # Image pooling
         x_pool = self.im_pooling(x)
-        # Upsampling image average
-        y.append(F.interpolate(x_pool, size=x.size()[2:], mode='bilinear', align_corners=True))
+        # Upsampling image average (1x1 pooling output loses the memory format)
+        x_pool = F.interpolate(x_pool, size=x.size()[2:], mode='bilinear', align_corners=True)
+        y.append(match_memory_format(x_pool, y[0]))
         # Concat volumes
         x_cat = torch.cat(y, dim=1)
         # volumer reduction
@@ -403,6 +449,9 @@ class GlobalConv(nn.Module):
     '''
         Global Convolutional module
     '''
+    # conv_sum only exists with convout (static branch when scripted)
+    __constants__ = ['convout']
+
     def __init__(self, in_ch, m_ch, out_ch=None, k=7, batch_norm=False, reg=False, dropout=0, convout=False):
         ''' Constructor '''
         super(GlobalConv, self).__init__()
@@ -464,8 +513,8 @@ class GlobalConv(nn.Module):
         ''' Foward method '''
         x_l = self.conv_left(x)
         x_r = self.conv_right(x)
-        # Sum
-        x_out = x_l + x_r
+        # Sum (in the memory format of the input)
+        x_out = match_memory_format(x_l, x) + match_memory_format(x_r, x)
         # Output
         if self.convout:
             x_out = self.conv_sum(x_out)
@@ -477,6 +526,8 @@ class Btneck_Gconv(nn.Module):
     '''
         Global Convolutional bottleneck module
     '''
+    __constants__ = ['reg']
+
     def __init__(self, in_ch, m_ch, k=7, batch_norm=True, reg=True, dropout=0):
         ''' Constructor '''
         super(Btneck_Gconv, self).__init__()
@@ -502,6 +553,8 @@ class BrConv(nn.Module):
     '''
         Boundary Refine Convolutional module
     '''
+    __constants__ = ['convout']
+
     def __init__(self, out_ch, bnorm=False, reg=False, convout=False):
         ''' Constructor '''
         super(BrConv, self).__init__()
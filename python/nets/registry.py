@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 18:41:27 2026
+
+@author: Diego Wanderley
+@python: 3.6
+@description: Networks registry - maps architecture names to (lazily
+    imported) constructors and their default arguments
+"""
+
+import importlib
+
+
+# name: (module, class, input channels argument, default kwargs, options)
+# options lists the build_model arguments supported by the constructor
+MODELS = {
+    # Mask R-CNN
+    'mask_rcnn':      ('nets.rcnn', 'MaskRCNN', 'n_channels', {}, ('pretrained',)),
+    # FCN models
+    'fcn_r101':       ('nets.fcn', 'FCN', 'n_channels', {'resnet_type': 101},
+                                ('pretrained', 'train_logits')),
+    'fcn_r50':        ('nets.fcn', 'FCN', 'n_channels', {'resnet_type': 50},
+                                ('train_logits',)),
+    # Deeplab v3
+    'deeplabv3':      ('nets.deeplab', 'DeepLabv3', 'n_channels', {'resnet_type': 101},
+                                ('pretrained', 'train_logits')),
+    'deeplabv3_r50':  ('nets.deeplab', 'DeepLabv3', 'n_channels', {'resnet_type': 50},
+                                ('pretrained', 'train_logits')),
+    # Deeplab v3+
+    'deeplabv3p':     ('nets.deeplab', 'DeepLabv3_plus', 'nInputChannels', {'os': 16},
+                                ('pretrained', 'train_logits')),
+    'deeplabv3p_r50': ('nets.deeplab', 'DeepLabv3_plus', 'nInputChannels', {'os': 16, 'resnet_type': 50},
+                                ('pretrained', 'train_logits')),
+    # Global Convolution Network
+    'gcn':            ('nets.gcn', 'GCN', 'n_channels', {}, ('train_logits',)),
+    'b_gcn':          ('nets.gcn', 'BalancedGCN', 'n_channels', {}, ('train_logits',)),
+    'u_gcn':          ('nets.gcn', 'UGCN', 'n_channels', {}, ('bilinear', 'train_logits')),
+    # Unet models
+    'unet':           ('nets.unet', 'Unet', 'n_channels', {}, ('train_logits',)),
+    'unet_light':     ('nets.unet', 'UnetLight', 'n_channels', {}, ('bilinear', 'train_logits')),
+    'unet2':          ('nets.unet', 'Unet2', 'n_channels', {}, ('bilinear', 'train_logits')),
+    'd_unet2':        ('nets.unet', 'DilatedUnet2', 'n_channels', {}, ('bilinear', 'train_logits')),
+    'sp_unet':        ('nets.unet', 'SpatialPyramidUnet', 'n_channels', {}, ('bilinear', 'train_logits')),
+    'sp_unet2':       ('nets.unet', 'SpatialPyramidUnet2', 'n_channels', {}, ('bilinear', 'train_logits')),
+}
+
+# Former names (used by older scripts and checkpoints)
+ALIASES = {
+    'deeplab_v3+': 'deeplabv3p',
+    'deeplab_r50': 'deeplabv3p_r50',
+    'd_unet': 'd_unet2',
+    # main.py built a Unet2 for gcn2 (no GCN2 class)
+    'gcn2': 'unet2',
+}
+
+
+def available_models(aliases=False):
+    '''
+        List the registered architecture names.
+
+        Arguments:
+            @param aliases: include the former names (see ALIASES)
+    '''
+    names = list(MODELS.keys())
+    if aliases:
+        names += list(ALIASES.keys())
+    return names
+
+
+def resolve_name(name):
+    '''
+        Get the registered name of an architecture (aliases included).
+    '''
+    name = ALIASES.get(name, name)
+    if name not in MODELS:
+        raise ValueError("Unknown architecture '{}'. Available: {}".format(
+                         name, ', '.join(available_models())))
+    return name
+
+
+def get_model_class(name):
+    '''
+        Import (only) the module of an architecture and get its class.
+    '''
+    module, class_name = MODELS[resolve_name(name)][:2]
+    return getattr(importlib.import_module(module), class_name)
+
+
+def build_model(name, n_channels, n_classes, pretrained=False, bilinear=False, train_logits=False):
+    '''
+        Build a network model from its architecture name.
+
+        Arguments:
+            @param name: architecture name (see MODELS)
+            @param n_channels: input channels
+            @param n_classes: output classes
+            @param pretrained: load pre-trained backbone weights (if supported)
+            @param bilinear: bilinear upsampling (if supported)
+            @param train_logits: return logits in training mode (if supported)
+
+        Returns: model (nn.Module)
+    '''
+    name = resolve_name(name)
+    _, _, in_arg, defaults, options = MODELS[name]
+
+    kwargs = dict(defaults)
+    kwargs[in_arg] = n_channels
+    kwargs['n_classes'] = n_classes
+    requested = {'pretrained': pretrained, 'bilinear': bilinear, 'train_logits': train_logits}
+    for opt in options:
+        kwargs[opt] = requested[opt]
+
+    return get_model_class(name)(**kwargs)
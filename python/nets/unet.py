@@ -18,7 +18,7 @@ class Unet(nn.Module):
     '''
     U-net class
     '''
-    def __init__(self, n_channels, n_classes):
+    def __init__(self, n_channels, n_classes, train_logits=False):
         ''' Constructor '''
         super(Unet, self).__init__()
         # Number of classes definition
@@ -53,7 +53,7 @@ class Unet(nn.Module):
         # Output
         self.conv_out = OutConv(64, n_classes)
         # Define Softmax
-        self.softmax = nn.Softmax2d()
+        self.softmax = SoftmaxOut(train_logits)
 
     def forward(self, x):
         ''' Foward method '''
@@ -83,12 +83,16 @@ class UnetLight(nn.Module):
     '''
     U-net light class (same as U-net but lower number of convs).
     '''
-    def __init__(self, n_channels, n_classes, bilinear=False, dropout=[0,0.2]):
+    # Multiple output heads (static branch when scripted)
+    __constants__ = ['multi_head']
+
+    def __init__(self, n_channels, n_classes, bilinear=False, dropout=[0,0.2], train_logits=False):
         ''' Constructor '''
         super(UnetLight, self).__init__()
 
         # Number of classes definition
         self.n_classes = n_classes
+        self.multi_head = type(n_classes) is list
         self.dp_down = 0
         if type(dropout) == list:
             self.dp_down = dropout[0]
@@ -147,7 +151,7 @@ class UnetLight(nn.Module):
         else:
             self.conv_out = OutConv(8, n_classes)
         # Define Softmax
-        self.softmax = nn.Softmax2d()
+        self.softmax = SoftmaxOut(train_logits)
 
 
     def forward(self, x):
@@ -170,7 +174,7 @@ class UnetLight(nn.Module):
         uc_x5 = self.conv_up5(uc_x4, dc_x1)
         uc_x6 = self.conv_up6(uc_x5, c_x1)
         # output
-        if type(self.n_classes) is list:
+        if self.multi_head:
             x_out = []
             for c_out in self.conv_out:
                 x_7 = c_out(uc_x6)
@@ -186,12 +190,15 @@ class Unet2(nn.Module):
     '''
     U-net class from end-to-end ovarian structures segmentation
     '''
-    def __init__(self, n_channels, n_classes, bilinear=False, dropout=[0,0.2]):
+    __constants__ = ['multi_head']
+
+    def __init__(self, n_channels, n_classes, bilinear=False, dropout=[0,0.2], train_logits=False):
         ''' Constructor '''
         super(Unet2, self).__init__()
 
         # Number of classes definition
         self.n_classes = n_classes
+        self.multi_head = type(n_classes) is list
         self.dp_down = 0
         if type(dropout) == list:
             self.dp_down = dropout[0]
@@ -237,7 +244,7 @@ class Unet2(nn.Module):
         else:
             self.conv_out = OutConv(8, n_classes)
         # Define Softmax
-        self.softmax = nn.Softmax2d()
+        self.softmax = SoftmaxOut(train_logits)
 
     def forward(self, x):
         ''' Foward method '''
@@ -259,7 +266,7 @@ class Unet2(nn.Module):
         uc_x5 = self.conv_up5(uc_x4, dc_x1)
         uc_x6 = self.conv_up6(uc_x5, c_x0)
         # output
-        if type(self.n_classes) is list:
+        if self.multi_head:
             x_out = []
             for c_out in self.conv_out:
                 x_7 = c_out(uc_x6)
@@ -275,16 +282,19 @@ class DilatedUnet2(nn.Module):
     '''
     Dilated U-net (light) class from end-to-end segmentation
     '''
-    def __init__(self, n_channels, n_classes, bilinear=False):
+    __constants__ = ['multi_head']
+
+    def __init__(self, n_channels, n_classes, bilinear=False, train_logits=False):
         ''' Constructor '''
         super(DilatedUnet2, self).__init__()
 
         # Number of classes definition
         self.n_classes = n_classes
+        self.multi_head = type(n_classes) is list
         self.n_input = n_channels
         self.bilinear = bilinear
         # Load unet 2 model
-        u_body = Unet2(n_channels, n_classes, bilinear=bilinear, dropout=0)
+        u_body = Unet2(n_channels, n_classes, bilinear=bilinear, dropout=0, train_logits=train_logits)
 
         # Set input layer
         self.conv_init  = u_body.conv_init # 512 x 8
@@ -331,7 +341,7 @@ class DilatedUnet2(nn.Module):
         uc_x2 = self.conv_up2(uc_x1, dc_x1)
         uc_x3 = self.conv_up3(uc_x2, c_x0)
         # output
-        if type(self.n_classes) is list:
+        if self.multi_head:
             x_out = []
             for c_out in self.conv_out:
                 x = c_out(uc_x3)
@@ -347,7 +357,9 @@ class SpatialPyramidUnet(nn.Module):
     '''
     Dilated U-net (light) class usint Spatial Pyramid Pooling from end-to-end segmentation
     '''
-    def __init__(self, n_channels, n_classes, bilinear=False, dropout=[0,0.2]):
+    __constants__ = ['multi_head']
+
+    def __init__(self, n_channels, n_classes, bilinear=False, dropout=[0,0.2], train_logits=False):
         ''' Constructor '''
         super(SpatialPyramidUnet, self).__init__()
 
@@ -355,6 +367,7 @@ class SpatialPyramidUnet(nn.Module):
         u_body = UnetLight(n_channels, n_classes, bilinear=bilinear, dropout=dropout)
         # Number of classes definition
         self.n_classes = n_classes
+        self.multi_head = type(n_classes) is list
         self.n_input = n_channels
         self.bilinear = bilinear
         self.dp_down = u_body.dp_down
@@ -401,7 +414,7 @@ class SpatialPyramidUnet(nn.Module):
         else:
             self.conv_out = OutConv(64, n_classes)
         # Define Softmax
-        self.softmax = nn.Softmax2d()
+        self.softmax = SoftmaxOut(train_logits)
 
 
     def forward(self, x):
@@ -422,7 +435,7 @@ class SpatialPyramidUnet(nn.Module):
         uc_x3 = self.conv_up3(uc_x2, dc_x1)
         uc_x4 = self.conv_up4(uc_x3, c_x1)
         # output
-        if type(self.n_classes) is list:
+        if self.multi_head:
             x_out = []
             for c_out in self.conv_out:
                 x_5 = c_out(uc_x4)
@@ -438,7 +451,9 @@ class SpatialPyramidUnet2(nn.Module):
     '''
     Dilated U-net (light) class usint Spatial Pyramid Pooling from end-to-end segmentation
     '''
-    def __init__(self, n_channels, n_classes, bilinear=False, dropout=[0,0.2]):
+    __constants__ = ['multi_head']
+
+    def __init__(self, n_channels, n_classes, bilinear=False, dropout=[0,0.2], train_logits=False):
         ''' Constructor '''
         super(SpatialPyramidUnet2, self).__init__()
 
@@ -446,6 +461,7 @@ class SpatialPyramidUnet2(nn.Module):
         u_body = Unet2(n_channels, n_classes, bilinear=bilinear, dropout=dropout)
         # Number of classes definition
         self.n_classes = n_classes
+        self.multi_head = type(n_classes) is list
         self.n_input = n_channels
         self.bilinear = bilinear
         self.dp_down = u_body.dp_down
@@ -492,7 +508,7 @@ class SpatialPyramidUnet2(nn.Module):
         else:
             self.conv_out = OutConv(64, n_classes)
         # Define Softmax
-        self.softmax = nn.Softmax2d()
+        self.softmax = SoftmaxOut(train_logits)
 
 
     def forward(self, x):
@@ -513,7 +529,7 @@ class SpatialPyramidUnet2(nn.Module):
         uc_x3 = self.conv_up3(uc_x2, dc_x1)
         uc_x4 = self.conv_up4(uc_x3, c_x1)
         # output
-        if type(self.n_classes) is list:
+        if self.multi_head:
             x_out = []
             for c_out in self.conv_out:
                 x_5 = c_out(uc_x4)
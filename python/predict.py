@@ -14,15 +14,12 @@ import argparse
 import torch
 import numpy as np
 from PIL import Image
-from torch.autograd import Variable
 from torch.utils.data import DataLoader
-from nets.deeplab import DeepLabv3, DeepLabv3_plus
-from nets.unet import *
-from nets.gcn import *
-from nets.fcn import *
-from nets.rcnn import *
 from utils.datasets import OvaryDataset
-from utils.losses import DiceCoefficients
+from nets.registry import available_models, build_model
+from utils.resources import ResourceManager
+from utils.losses import BatchDiceCoefficients
+from utils.metrics import ConfusionMatrix, InstanceMatcher, SurfaceDistance
 
 
 class Inference():
@@ -31,16 +28,77 @@ class Inference():
     """
 
     def __init__(self, model, device, weights_path, batch_size=1,
-                target=['gt_mask','ovary_mask'], folder='../predictions/'):
+                target=['gt_mask','ovary_mask'], folder='../predictions/',
+                tta=None, tta_merge='mean', tta_crop=None, tta_max_batch=0,
+                dist_cache=None, bf16=False, resources=None, channels_last=False,
+                jit=False, jit_cache=None, ignore_index=None, class_names=None):
         '''
             Inference class - Constructor
+
+            Arguments:
+                @param model: network model - None rebuilds it from the
+                    architecture ('arch') saved in the checkpoint
+                @param dist_cache: folder to cache the ground truth distance
+                    maps of the surface distance metrics (None: memory only)
+                @param tta: list of test-time augmentations ('hflip', 'vflip',
+                    'rot90', 'five_crop') - None disables TTA
+                @param tta_merge: how to merge the TTA outputs ('mean' or 'max')
+                @param tta_crop: crop size (int or (h, w)) for 'five_crop'
+                @param tta_max_batch: maximum number of images per forward pass
+                    when running the expanded TTA batch (0 means no limit)
+                @param bf16: run the network with bfloat16 autocast (outputs
+                    and metrics are computed in float32)
+                @param resources: CPU resources manager (ResourceManager) with
+                    the data loader workers layout (None: loading in the main
+                    process)
+                @param channels_last: run the network (weights and inputs) in
+                    channels-last (NHWC) memory format
+                @param jit: run the network compiled with TorchScript (frozen
+                    and fused for inference)
+                @param jit_cache: folder to cache the compiled networks across
+                    runs (None: compiled on every run)
+                @param ignore_index: ground truth class not evaluated by the
+                    confusion matrix, e.g. VOC void (None: all classes)
+                @param class_names: names of the classes in the metrics (None:
+                    ovarian classes, or class0..classN for other datasets)
         '''
         self.model = model
         self.device = device
         self.weights_path = weights_path
         self.batch_size = batch_size
+        # Test-time augmentation
+        self.tta = list(tta) if tta else []
+        if tta_merge not in ['mean', 'max']:
+            raise ValueError("TTA merge must be 'mean' or 'max'.")
+        self.tta_merge = tta_merge
+        if type(tta_crop) is int:
+            tta_crop = (tta_crop, tta_crop)
+        if 'five_crop' in self.tta and tta_crop is None:
+            raise ValueError("'five_crop' TTA requires a crop size.")
+        self.tta_crop = tta_crop
+        self.tta_max_batch = tta_max_batch
+        # Mixed precision (bfloat16 autocast)
+        self.bf16 = bf16
+        # CPU resources (threads and data loader workers)
+        self.resources = resources
+        # Memory format of the network and its inputs
+        self.channels_last = channels_last
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        # TorchScript compilation
+        self.jit = jit
+        self.jit_cache = jit_cache
+        # Ground truth class ignored by the evaluation
+        self.ignore_index = ignore_index
+        self.class_names = class_names
+        # Surface distances (ground truth distance maps cached across runs)
+        self.surface = SurfaceDistance(structures={'ovary': [1, 2], 'follicles': [2]},
+                                       cache_dir=dist_cache)
         self._load_network()
-        self.criterion = DiceCoefficients()
+        # Detection outputs (instances) cannot be merged across augmentations
+        if len(self.tta) > 0 and (self.state.get('arch') == 'mask_rcnn' or
+                                  type(self.model).__name__ == 'MaskRCNN'):
+            raise ValueError("Test-time augmentation is not available for detection networks (mask_rcnn).")
+        self.criterion = BatchDiceCoefficients()
         if type(target) == list:
             self.target = target
         else:
@@ -57,14 +115,48 @@ class Inference():
         '''
             Load weights and network state.
         '''
-
         if self.device.type == 'cpu':
             state = torch.load(self.weights_path, map_location='cpu')
         else:
             state = torch.load(self.weights_path)
+
+        # Compiled network from the cache
+        if self.jit:
+            from utils.jit import compiled_path, load_compiled, optimize_for_inference
+            compiled_file = None
+            if self.jit_cache is not None:
+                if self.model is None:
+                    arch = state.get('arch', 'checkpoint')
+                else:
+                    arch = type(self.model).__name__
+                build_kwargs = sorted(state.get('build_kwargs', {}).items())
+                compiled_file = compiled_path(self.weights_path, self.jit_cache, arch, build_kwargs,
+                                              self.device, self.channels_last, self.bf16)
+            if compiled_file is not None and os.path.exists(compiled_file):
+                self.model, self.state = load_compiled(compiled_file, map_location=self.device)
+                self.model = optimize_for_inference(self.model)
+                print('Compiled network loaded from {:s}'.format(compiled_file))
+                return
+
+        # Rebuild the network from the checkpoint
+        if self.model is None:
+            if 'build_kwargs' not in state:
+                raise ValueError("Checkpoint without the network arguments (build_kwargs): "
+                                 "the network model must be given.")
+            self.model = build_model(state['arch'], **state['build_kwargs'])
         self.model.load_state_dict(state['state_dict'])
+        if self.channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
         self.state = state
 
+        # Compile (weights are frozen in the device)
+        if self.jit:
+            from utils.jit import script_model, save_compiled
+            self.model = script_model(self.model.to(self.device))
+            if compiled_file is not None:
+                save_compiled(self.model, compiled_file, state)
+            self.model = optimize_for_inference(self.model)
+
 
     def _save_data(self, table_r):
         '''
@@ -126,6 +218,192 @@ class Inference():
             a.writerows(table_s)
 
 
+    def _save_surface(self, results):
+        '''
+            Save boundary distance metrics (HD95 and ASD) on a CSV file
+        '''
+        fields = ['hd_ovary', 'asd_ovary', 'hd_follicles', 'asd_follicles']
+        table_d = [['name'] + fields]
+        for row in results['per_image']:
+            table_d.append([row['name']] + [row[f] for f in fields])
+        table_d.append(['mean'] + [results[f] for f in fields])
+        with open(self.pred_folder + "surface.csv",'w') as fp:
+            a = csv.writer(fp, delimiter=';')
+            a.writerows(table_d)
+
+        print('Ovary HD95:          {:f}'.format(results['hd_ovary']))
+        print('Ovary ASD:           {:f}'.format(results['asd_ovary']))
+        print('Follicles HD95:      {:f}'.format(results['hd_follicles']))
+        print('Follicles ASD:       {:f}'.format(results['asd_follicles']))
+        print('')
+
+
+    def _save_follicles(self, results):
+        '''
+            Save follicles detection (instances) metrics on a CSV file
+        '''
+        fields = ['n_gt', 'n_pred', 'matched', 'missed', 'false', 'dice_instances']
+        table_f = [['name'] + fields]
+        for row in results['per_image']:
+            table_f.append([row['name']] + [row[f] for f in fields])
+        table_f.append(['total'] + [results[f] for f in fields])
+        with open(self.pred_folder + "follicles.csv",'w') as fp:
+            a = csv.writer(fp, delimiter=';')
+            a.writerows(table_f)
+
+        print('Follicles matched:   {:d}/{:d}'.format(results['matched'], results['n_gt']))
+        print('Follicles false:     {:d}'.format(results['false']))
+        print('Follicles F1:        {:f}'.format(results['f1']))
+        print('Follicle inst. DSC:  {:f}'.format(results['dice_instances']))
+        print('')
+
+
+    def _save_metrics(self, results, class_names, group_names=[]):
+        '''
+            Save global and per image metrics (confusion matrix) on CSV files
+        '''
+        metrics = ['dice', 'iou', 'precision', 'recall']
+
+        # Global metrics - one row per class
+        table_g = [['class'] + metrics]
+        for c, cname in enumerate(class_names):
+            table_g.append([cname] + [results['global'][m][c].item() for m in metrics])
+        for g, gname in enumerate(group_names):
+            table_g.append([gname] + [results['global_groups'][m][g,1].item() for m in metrics])
+        with open(self.pred_folder + "metrics_global.csv",'w') as fp:
+            a = csv.writer(fp, delimiter=';')
+            a.writerows(table_g)
+
+        # Per image metrics - one row per image
+        if 'per_image' in results:
+            header = ['name']
+            for m in metrics:
+                header += [m + '_' + cname for cname in class_names + group_names]
+            table_i = [header]
+            for i, iname in enumerate(results['names']):
+                row = [iname]
+                for m in metrics:
+                    row += results['per_image'][m][i].tolist()
+                    if len(group_names) > 0:
+                        row += results['per_image_groups'][m][i,:,1].tolist()
+                table_i.append(row)
+            with open(self.pred_folder + "metrics_images.csv",'w') as fp:
+                a = csv.writer(fp, delimiter=';')
+                a.writerows(table_i)
+
+
+    def _tta_variants(self, height, width):
+        '''
+            List the test-time augmentation variants.
+
+            Returns: variants (list of ((top, left), flip dims, 90 degree rotations)),
+                crop size (tuple)
+        '''
+        # Crops (same boxes as FiveCrop) or the full image
+        if 'five_crop' in self.tta:
+            crop_h, crop_w = self.tta_crop
+            top = int(round((height - crop_h) / 2.))
+            left = int(round((width - crop_w) / 2.))
+            boxes = [(0, 0), (0, width - crop_w), (height - crop_h, 0),
+                     (height - crop_h, width - crop_w), (top, left)]
+        else:
+            crop_h, crop_w = height, width
+            boxes = [(0, 0)]
+        # Geometric operations
+        geometric = [([], 0)]
+        if 'hflip' in self.tta:
+            geometric.append(([3], 0))
+        if 'vflip' in self.tta:
+            geometric.append(([2], 0))
+        if 'rot90' in self.tta:
+            # 90 and 270 degrees only keep the shape of square inputs
+            rotations = [1, 2, 3] if crop_h == crop_w else [2]
+            for k in rotations:
+                geometric.append(([], k))
+
+        variants = [(box, flips, rot) for box in boxes for flips, rot in geometric]
+
+        return variants, (crop_h, crop_w)
+
+
+    def _tta_merge_output(self, y, variants, bs, height, width):
+        '''
+            Invert the geometric operations of each variant and merge them.
+        '''
+        n_ch, crop_h, crop_w = y.shape[1:]
+        y = y.view(len(variants), bs, n_ch, crop_h, crop_w)
+
+        if self.tta_merge == 'max':
+            merged = torch.full((bs, n_ch, height, width), -float('inf'),
+                                dtype=y.dtype, device=y.device)
+        else:
+            merged = torch.zeros(bs, n_ch, height, width, dtype=y.dtype, device=y.device)
+        counts = torch.zeros(1, 1, height, width, dtype=y.dtype, device=y.device)
+
+        for v, ((top, left), flips, rot) in enumerate(variants):
+            out = y[v]
+            # Inverse order: rotation then flip
+            if rot > 0:
+                out = torch.rot90(out, -rot, dims=(2, 3))
+            if len(flips) > 0:
+                out = out.flip(flips)
+            region = (Ellipsis, slice(top, top + crop_h), slice(left, left + crop_w))
+            if self.tta_merge == 'max':
+                merged[region] = torch.max(merged[region], out)
+            else:
+                merged[region] += out
+            counts[region] += 1
+
+        # Pixels not covered by any crop are set to zero
+        if self.tta_merge == 'max':
+            merged = torch.where(counts > 0, merged, torch.zeros_like(merged))
+        else:
+            merged = merged / counts.clamp(min=1)
+
+        return merged
+
+
+    def _predict_tta(self, image):
+        '''
+            Run test-time augmentation as a single (expanded) batch.
+        '''
+        bs, _, height, width = image.shape
+        variants, (crop_h, crop_w) = self._tta_variants(height, width)
+
+        # Expand batch with all variants: (n_variants * bs) x ch x crop_h x crop_w
+        expanded = []
+        for (top, left), flips, rot in variants:
+            x = image[..., top:top + crop_h, left:left + crop_w]
+            if len(flips) > 0:
+                x = x.flip(flips)
+            if rot > 0:
+                x = torch.rot90(x, rot, dims=(2, 3))
+            expanded.append(x)
+        expanded = torch.cat(expanded, dim=0).contiguous(memory_format=self.memory_format)
+
+        # Forward pass, split when the expanded batch exceeds the limit
+        if self.tta_max_batch > 0:
+            chunk_size = self.tta_max_batch
+        else:
+            chunk_size = len(expanded)
+        outputs = []
+        for x in torch.split(expanded, chunk_size, dim=0):
+            out = self.model(x)
+            if type(out) is not list:
+                out = [out]
+            outputs.append(out)
+
+        # Merge each output head
+        merged = []
+        for h in range(len(outputs[0])):
+            y = torch.cat([out[h] for out in outputs], dim=0)
+            merged.append(self._tta_merge_output(y, variants, bs, height, width))
+
+        if len(merged) == 1:
+            return merged[0]
+        return merged
+
+
     def predict(self, images, save=True):
         '''
             Predict segmentation function
@@ -139,9 +417,17 @@ class Inference():
         self.model = self.model.to(self.device)
 
         dsc_data = []
-        dsc_data.append(['name', 'backgound', 'stroma', 'follicles', 'ovary'])
 
-        data_loader = DataLoader(images, batch_size=self.batch_size, shuffle=False)
+        # Streaming evaluation (dataset level)
+        evaluator = None
+        class_names = self.class_names
+        # Ovarian dataset only: ovary, follicles detection and boundary distances
+        ovarian = False
+        follicle_matcher = InstanceMatcher(channel=2)
+        self.surface.reset()
+
+        loader_kwargs = self.resources.loader_kwargs() if self.resources is not None else {}
+        data_loader = DataLoader(images, batch_size=self.batch_size, shuffle=False, **loader_kwargs)
         # Read images
         for _, sample in enumerate(data_loader):
 
@@ -150,19 +436,26 @@ class Inference():
             gt_mask = sample['gt_mask'].to(self.device)
             im_name = sample['im_name']
             # ovary prediction (interim)
-            ov_mask = sample['ovary_mask'].to(self.device)  # load mask
+            ovarian = 'ovary_mask' in sample
+            if ovarian:
+                ov_mask = sample['ovary_mask'].to(self.device)  # load mask
 
             # data size
-            bs, n_classes, height, width =  gt_mask.shape
+            bs, n_classes = gt_mask.shape[:2]
 
             # Handle input
             if len(image.size()) < 4:
                 image.unsqueeze_(1) # add a dimension to the tensor
+            image = image.contiguous(memory_format=self.memory_format)
 
             # Prediction
             pred = None
-            with torch.no_grad():
-                pred = self.model(image)
+            with torch.no_grad(), torch.autocast(self.device.type, dtype=torch.bfloat16,
+                                                 enabled=self.bf16):
+                if len(self.tta) > 0:
+                    pred = self._predict_tta(image)
+                else:
+                    pred = self.model(image)
 
 
 
@@ -170,58 +463,104 @@ class Inference():
             if type(pred) is list:
 
                 if type(pred[0]) is dict:
+                    from nets.rcnn import get_semantic_segmentation
                     pred_dtct = [get_semantic_segmentation(pred, n_classes).to(self.device),
                                 pred]
                     pred = pred_dtct
                 # Main pred
                 pred = pred[0]
+            pred = pred.float()
 
             pred_max, pred_idx = pred.max(dim=1)
             pred_final = torch.clamp((pred - pred_max.unsqueeze_(1)) \
                                             + 0.0001, min=0)*10000
 
-            # Compute Dice image by image
-            for i in range(bs):
+            # Update confusion matrix
+            if evaluator is None:
+                evaluator = ConfusionMatrix(n_classes, ignore_index=self.ignore_index,
+                                            device=self.device)
+                if class_names is None:
+                    if ovarian:
+                        class_names = ['background', 'stroma', 'follicles']
+                    else:
+                        class_names = ['class{:d}'.format(c) for c in range(n_classes)]
+                dsc_data.append(['name'] + class_names + (['ovary'] if ovarian else []))
+            # Pixels without any ground truth class (padding) are not evaluated
+            valid = gt_mask.sum(dim=1) > 0
+            evaluator.update(pred, gt_mask, valid=valid, names=im_name)
+
+            # Compute Dice of the whole batch (bs x n_classes)
+            dsc = self.criterion(pred_final, gt_mask)
+            if ovarian:
+                follicle_matcher.update(pred_idx, gt_mask, names=im_name)
+                self.surface.update(pred_idx, gt_mask, im_name)
+                # Ovary prediction: stroma + follicles
+                pred_ovary = torch.stack((pred_final[:,0,...],
+                                        torch.clamp(pred_final[:,1,...] + pred_final[:,2,...],
+                                                    min=0, max=1)), dim=1)
+                dsc_ov = self.criterion(pred_ovary, ov_mask)
+                dsc = torch.cat((dsc[:,:3], dsc_ov[:,1:2]), dim=1)
+
+            # Single device to host transfer per batch
+            scores = dsc.cpu().tolist()
+            if n_classes <= 4:
+                pred_final_np = pred_final.detach().cpu().permute(0,2,3,1).numpy()
+                pred_np = pred.detach().cpu().permute(0,2,3,1).numpy()
+            else:
+                # Too many channels for an image: labels and their probability
+                pred_final_np = pred_idx.cpu().numpy() / 255.
+                pred_np = pred_max[:,0].detach().cpu().numpy()
 
-                # Get unique prediction
-                pred_un = pred_final[i,...]
-                pred_un.unsqueeze_(0)
-                # Get unique GT
-                gt_un = gt_mask[i,...]
-                gt_un.unsqueeze_(0)
-                ov_mask_un = ov_mask[i,...]
-                ov_mask_un.unsqueeze_(0)
-
-                # Evaluate - dice
-                dsc = self.criterion(pred_un, gt_un)
-                pred_ovary = torch.zeros(1, 2, height, width).to(self.device)
-                pred_ovary[:,0,...] = pred_un[:,0,...]
-                pred_ovary[:,1,...] = torch.clamp(pred_un[:,1,...] + pred_un[:,2,...],
-                                                min=0, max=1)
-                dsc_ov = self.criterion(pred_ovary, ov_mask_un)
+            for i in range(bs):
 
                 # Display evaluation
                 iname = im_name[i]
-                dsc_data.append([iname,
-                                dsc[0].item(), dsc[1].item(), dsc[2].item(),
-                                dsc_ov[1].item()])
+                dsc_data.append([iname] + scores[i])
 
                 print('Filename:     {:s}'.format(iname))
-                print('Stroma DSC:   {:f}'.format(dsc[1]))
-                print('Follicle DSC: {:f}'.format(dsc[2]))
-                print('Ovary DSC:    {:f}'.format(dsc_ov[1]))
+                if ovarian:
+                    print('Stroma DSC:   {:f}'.format(scores[i][1]))
+                    print('Follicle DSC: {:f}'.format(scores[i][2]))
+                    print('Ovary DSC:    {:f}'.format(scores[i][3]))
+                else:
+                    print('Mean DSC:     {:f}'.format(sum(scores[i]) / len(scores[i])))
                 print('')
+                # Output image file (names without extension saved as PNG)
+                if os.path.splitext(iname)[1] == '':
+                    iname = iname + '.png'
                 # Save prediction
-                img_out = pred_final[i].detach().cpu().permute(1,2,0).numpy()
+                img_out = pred_final_np[i]
                 Image.fromarray((255*img_out).astype(np.uint8)).save( \
                                                 self.pred_folder + iname)
                 # Save probabilities
-                img_prob = pred[i].detach().cpu().permute(1,2,0).numpy()
+                img_prob = pred_np[i]
                 Image.fromarray((255*img_prob).astype(np.uint8)).save( \
                                                     self.prob_folder + iname)
 
         self._save_data(dsc_data)
 
+        # Dataset level metrics
+        if evaluator is not None:
+            if ovarian:
+                # ovary = stroma + follicles
+                results = evaluator.compute(groups=[[1, 2]])
+                self._save_metrics(results, class_names, ['ovary'])
+                print('Global Stroma DSC:   {:f}'.format(results['global']['dice'][1].item()))
+                print('Global Follicle DSC: {:f}'.format(results['global']['dice'][2].item()))
+                print('Global Ovary DSC:    {:f}'.format(results['global_groups']['dice'][0,1].item()))
+            else:
+                results = evaluator.compute()
+                self._save_metrics(results, class_names)
+                for c, cname in enumerate(class_names):
+                    print('Global {:s} DSC: {:f}'.format(cname, results['global']['dice'][c].item()))
+            print('')
+
+        if ovarian:
+            # Follicle detection metrics
+            self._save_follicles(follicle_matcher.compute())
+            # Surface distance metrics
+            self._save_surface(self.surface.compute())
+
 
 
 # Main calls
@@ -230,14 +569,9 @@ if __name__ == '__main__':
     # Load inputs
     parser = argparse.ArgumentParser(description="PyTorch segmentation network predictions \
         (only ovarian dataset).")
-    parser.add_argument('--net', type=str, default='unet2',
-                        choices=['fcn_r101', 'fcn_r50',
-                                'deeplabv3', 'deeplabv3_r50', 'deeplabv3p', 'deeplabv3p_r50',
-                                 'unet', 'unet_light', 'unet2', 'd_unet2',
-                                 'sp_unet', 'sp_unet2',
-                                 'gcn', 'gcn2', 'b_gcn', 'u_gcn',
-                                 'mask_rcnn'],
-                        help='network name (default: unet2)')
+    parser.add_argument('--net', type=str, default=None,
+                        choices=available_models(aliases=True),
+                        help='network name (default: architecture saved in the checkpoint)')
     parser.add_argument('--train_name', type=str, default='20190428_1133_unet2',
                         help='training name (default: 20190428_1133_unet2)')
     parser.add_argument('--batch_size', type=int, default=1,
@@ -246,6 +580,32 @@ if __name__ == '__main__':
                         help='Weights root folder (default: ../weights/)')
     parser.add_argument('--folder_preds', type=str, default='../predictions/',
                         help='Predctions root folder (default: ../predictions/)')
+    parser.add_argument('--dist_cache', type=str, default='../predictions/gt_dist_cache/',
+                        help='Ground truth distance maps cache folder (default: ../predictions/gt_dist_cache/)')
+    parser.add_argument('--tta', type=str, nargs='*', default=[],
+                        choices=['hflip', 'vflip', 'rot90', 'five_crop'],
+                        help='test-time augmentations (default: none)')
+    parser.add_argument('--tta_merge', type=str, default='mean',
+                        choices=['mean', 'max'],
+                        help='how to merge test-time augmentations (default: mean)')
+    parser.add_argument('--tta_crop', type=int, default=384,
+                        help='crop size for five_crop test-time augmentation (default: 384)')
+    parser.add_argument('--tta_max_batch', type=int, default=0,
+                        help='maximum images per forward pass with test-time augmentation, 0 for no limit (default: 0)')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='compute (intra-op) threads, 0 for the cores not used by loader workers (default: 0)')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='data loader workers (default: 0)')
+    parser.add_argument('--pin_cores', action='store_true',
+                        help='whether to pin compute threads and loader workers to their cores (default: False)')
+    parser.add_argument('--bf16', action='store_true',
+                        help='whether to run the network with bfloat16 autocast (default: False)')
+    parser.add_argument('--channels_last', action='store_true',
+                        help='whether to run the network in channels-last memory format (default: False)')
+    parser.add_argument('--jit', action='store_true',
+                        help='whether to run the network compiled with TorchScript (default: False)')
+    parser.add_argument('--jit_cache', type=str, default='../weights/jit_cache/',
+                        help='compiled networks cache folder (default: ../weights/jit_cache/)')
 
     # Parse input data
     args = parser.parse_args()
@@ -256,54 +616,30 @@ if __name__ == '__main__':
     batch_size = args.batch_size
     folder_weights = args.folder_weigths
     folder_preds = args.folder_preds
+    dist_cache = args.dist_cache
+    tta = args.tta
+    tta_merge = args.tta_merge
+    tta_crop = args.tta_crop
+    tta_max_batch = args.tta_max_batch
+    bf16 = args.bf16
+    channels_last = args.channels_last
+    jit = args.jit
+    jit_cache = args.jit_cache
+
+    # CPU resources
+    resources = ResourceManager(compute_threads=args.threads, loader_workers=args.workers,
+                                pin=args.pin_cores)
+    resources.apply()
+    resources.report()
 
     # Define input and output
     in_channels=1
     n_classes=3
 
-    bilinear = False
-    # Load Network model
-    if net_type == 'mask_rcnn':
-        n_classes = 3
-        target = 'targets'
-        loss = 'multitaskdict'
-        train_with_targets = True
-        model = MaskRCNN(n_channels=in_channels, n_classes=n_classes, pretrained=True)
-    # FCN models
-    elif net_type == 'fcn_r101':
-        model = FCN(n_channels=in_channels, n_classes=n_classes, resnet_type=101)
-    elif net_type == 'fcn_r50':
-        model = FCN(n_channels=in_channels, n_classes=n_classes, resnet_type=50)
-    # Deeplab v3
-    elif net_type == 'deeplabv3':
-        model = DeepLabv3(n_channels=in_channels, n_classes=n_classes, resnet_type=101)
-    elif net_type == 'deeplabv3_r50':
-        model = DeepLabv3(n_channels=in_channels, n_classes=n_classes, resnet_type=50)
-    # Deeplab v3+
-    elif net_type == 'deeplab_v3+':
-        model = DeepLabv3_plus(nInputChannels=in_channels, n_classes=n_classes, os=16)
-    elif net_type == 'deeplab_r50':
-        model = DeepLabv3_plus(nInputChannels=in_channels, n_classes=n_classes, os=16, resnet_type=50)
-    # Global Convolution Network
-    elif net_type == 'gcn':
-        model = GCN(n_channels=in_channels, n_classes=n_classes)
-    elif net_type == 'gcn2':
-        model = FCN_GCN(n_channels=in_channels, num_classes=n_classes)
-    elif net_type == 'b_gcn':
-        model = BalancedGCN(n_channels=in_channels, n_classes=n_classes)
-    # Unet models
-    elif net_type == 'unet':
-        model = Unet(n_channels=in_channels, n_classes=n_classes)
-    elif net_type == 'unet_light':
-        model = UnetLight(n_channels=in_channels, n_classes=n_classes, bilinear=bilinear)
-    elif net_type == 'sp_unet':
-        model = SpatialPyramidUnet(n_channels=in_channels, n_classes=n_classes, bilinear=bilinear)
-    elif net_type == 'sp_unet2':
-        model = SpatialPyramidUnet2(n_channels=in_channels, n_classes=n_classes, bilinear=bilinear)
-    elif net_type == 'd_unet':
-        model = DilatedUnet2(n_channels=in_channels, n_classes=n_classes, bilinear=bilinear)
-    else:
-        model = Unet2(n_channels=in_channels, n_classes=n_classes, bilinear=bilinear)
+    # Load Network model (None: rebuilt from the checkpoint architecture)
+    model = None
+    if net_type is not None:
+        model = build_model(net_type, in_channels, n_classes)
 
     # Load CUDA if exist
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
@@ -322,6 +658,10 @@ if __name__ == '__main__':
         os.makedirs(out_folder)
     # Load inference
     inference = Inference(model, device, weights_path,
-                    batch_size=batch_size, folder=out_folder)
+                    batch_size=batch_size, folder=out_folder,
+                    tta=tta, tta_merge=tta_merge, tta_crop=tta_crop,
+                    tta_max_batch=tta_max_batch, dist_cache=dist_cache, bf16=bf16,
+                    resources=resources, channels_last=channels_last,
+                    jit=jit, jit_cache=jit_cache)
     # Run inference
     inference.predict(dataset_test)
\ No newline at end of file
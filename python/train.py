@@ -7,10 +7,16 @@ Created on Wed Fev 08 00:40:00 2019
 @description: Script for network training
 """
 
+import time
 import torch
-from torch.utils.data import DataLoader
+import contextlib
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset
+from torch.utils.data.distributed import DistributedSampler
 from utils.datasets import collate_fn_ov_list
-from nets.rcnn import get_semantic_segmentation
+from utils.checkpoint import CheckpointWriter
+from utils.logger import histogram_proto
+from utils.distributed import get_world_size, is_main_process, all_reduce_sum, ShardSampler
 
 class Training:
     """
@@ -19,10 +25,63 @@ class Training:
 
     def __init__(self, model, device, train_set, valid_set, opt, train_loss, eval_loss=None,
                   target='gt_mask', loss_weights=None, train_name='net', logger=None,
-                  arch='unet', train_with_targets=False):
+                  arch='unet', build_kwargs=None, train_with_targets=False, batch_transform=None, bf16=False,
+                  weights_only=False, keep_last=0,
+                  histo_interval=1, histo_layers=None, histo_bins=100, histo_samples=65536,
+                  resources=None, channels_last=False, checkpointing=None):
         '''
             Training class - Constructor
+
+            In data-parallel mode (process group initialized before), the model
+            is wrapped with DistributedDataParallel, the datasets are sharded
+            and only the main process (rank 0) saves checkpoints.
+
+            Arguments:
+                @param build_kwargs: arguments of nets.registry.build_model used
+                    to build the model (n_channels, n_classes, bilinear,
+                    train_logits), saved in the checkpoints to rebuild it
+                @param batch_transform: augmentation applied on device to the
+                    input batch (None disables it)
+                @param bf16: run the network forward/backward with bfloat16
+                    autocast (losses and softmax are kept in float32)
+                @param weights_only: save checkpoints without the optimizer state
+                @param keep_last: keep a rolling checkpoint of the last N epochs
+                    (0 saves only the best checkpoint)
+                @param histo_interval: epochs between parameter histograms (0 disables)
+                @param histo_layers: parameter names (or parts of them) to log
+                    histograms for (None logs all parameters)
+                @param histo_bins: number of bins of the histograms
+                @param histo_samples: maximum values per tensor used for the bins
+                    (larger tensors are subsampled, 0 uses all values)
+                @param resources: CPU resources manager (ResourceManager) with
+                    the data loader workers layout (None: loading in the main
+                    process)
+                @param channels_last: run the network (weights and inputs) in
+                    channels-last (NHWC) memory format
+                @param checkpointing: groups of blocks recomputed in backward
+                    (activation checkpointing), e.g. ['encoder', 'decoder',
+                    'aspp', 'resnet'] - None disables it
         '''
+        # Memory format of the network and its inputs
+        self.channels_last = channels_last
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        if channels_last:
+            model = model.to(memory_format=torch.channels_last)
+        # Activation checkpointing (blocks of the architecture)
+        self.checkpointing = checkpointing
+        self.checkpoint_blocks = []
+        if checkpointing:
+            from nets.checkpointing import enable_checkpointing
+            self.checkpoint_blocks = enable_checkpointing(model, arch, checkpointing)
+            if len(self.checkpoint_blocks) == 0:
+                print("No '{:s}' blocks in {:s}: activation checkpointing disabled.".format(
+                      "', '".join(checkpointing), arch))
+                self.checkpointing = None
+        # Data-parallel execution (process group initialized by the caller)
+        self.world_size = get_world_size()
+        self.main_process = is_main_process()
+        if self.world_size > 1:
+            model = DistributedDataParallel(model.to(device))
         self.model = model
         self.device = device
         self.dataset_train = train_set
@@ -50,25 +109,361 @@ class Training:
         else:
             self.loss_weights = 1.
         self.arch = arch
+        self.build_kwargs = dict(build_kwargs) if build_kwargs is not None else None
         self.train_with_targets = train_with_targets
+        # Augmentation applied on device to the whole input batch
+        self.batch_transform = batch_transform
+        # Mixed precision (bfloat16 autocast)
+        self.bf16 = bf16
+        # Checkpoints (written on a background thread)
+        self.keep_last = keep_last
+        self.checkpoint_writer = CheckpointWriter(weights_only=weights_only, keep_last=keep_last,
+                                                  rolling_pattern='../weights/' + train_name +
+                                                                  '_epoch*_weights.pth.tar')
+        # Histograms (computed on device)
+        self.histo_interval = histo_interval
+        self.histo_layers = histo_layers
+        self.histo_bins = histo_bins
+        self.histo_samples = histo_samples
+        # CPU resources (threads and data loader workers)
+        self.resources = resources
+        # Resume parameters
+        self.start_epoch = 0
+        self.best_loss = 1000    # Init best loss with a too high value
+
+    def _unwrap(self):
+        '''
+            Network model without the data-parallel wrapper.
+        '''
+        if isinstance(self.model, DistributedDataParallel):
+            return self.model.module
+        return self.model
+
+
+    def _val_loader(self, dataset, batch_size):
+        '''
+            Validation data loader (sharded over processes in data-parallel
+            mode, without repeated samples).
+        '''
+        sampler = None
+        if self.world_size > 1:
+            sampler = ShardSampler(dataset)
+        return DataLoader(dataset, batch_size=batch_size, shuffle=False, sampler=sampler,
+                          **self._loader_kwargs())
+
+
+    def _loader_kwargs(self, persistent=False):
+        '''
+            Data loader workers arguments (persistent workers for the
+            training loader only).
+        '''
+        if self.resources is None:
+            return {}
+        return self.resources.loader_kwargs(persistent=persistent)
+
+
+    def autotune_resources(self, batch_size=4, n_batches=10, candidates=None, cores=None, pin=False):
+        '''
+            Select the partition of CPU cores (compute threads and loader
+            workers) with the best training throughput. The network weights
+            are restored after the measurements.
+
+            Arguments:
+                @param batch_size: training batch size
+                @param n_batches: timed batches per partition
+                @param candidates: numbers of loader workers to try
+                @param cores: cores to partition (None: all available)
+                @param pin: pin the main process and the workers to their cores
+
+            Returns: selected ResourceManager
+        '''
+        from copy import deepcopy
+        from utils.resources import ResourceManager
+
+        model = self._unwrap()
+        state = deepcopy(model.state_dict())
+        self.model.train()
+        self.model = self.model.to(self.device)
+
+        def step_fn(sample):
+            image, targets = self._load_batch(sample)
+            loss, _ = self._forward_loss(image, targets)
+            loss.backward()
+            self.optimizer.zero_grad()
+
+        collate_fn = collate_fn_ov_list if self.train_with_targets else None
+        self.resources = ResourceManager.autotune(self.dataset_train, step_fn,
+                                                  batch_size=batch_size, n_batches=n_batches,
+                                                  candidates=candidates, cores=cores,
+                                                  pin=pin, collate_fn=collate_fn)
+        model.load_state_dict(state)
+
+        return self.resources
+
+
+    def autotune_batch_size(self, budget=None, max_batch=256, candidates=None, steps=3):
+        '''
+            Find the largest batch size whose training step (forward, backward
+            and optimizer step) fits a memory budget, and report the training
+            throughput of a few batch sizes. Batches replicate the first
+            training image, so the network, input channels, resolution and
+            loss are the ones of the training. The network weights and the
+            optimizer state are restored after the measurements.
+            Only segmentation targets are supported (not the detection
+            targets of mask_rcnn).
+
+            Arguments:
+                @param budget: memory budget in bytes (None: 90% of the GPU
+                    memory, or of the available RAM on CPU)
+                @param max_batch: largest batch size tried
+                @param candidates: batch sizes of the throughput report
+                    (None: the recommended size, its half and its quarter)
+                @param steps: timed steps per batch size
+
+            Returns: recommended batch size
+        '''
+        from copy import deepcopy
+        from utils.batch_size import find_batch_size, measure_throughput
+
+        model = self._unwrap()
+        state = deepcopy(model.state_dict())
+        opt_state = deepcopy(self.optimizer.state_dict())
+        self.model.train()
+        self.model = self.model.to(self.device)
+
+        sample = self.dataset_train[0]
+        def step_fn(batch_size):
+            image = sample['image'].unsqueeze(0)
+            image = image.expand((batch_size,) + image.shape[1:]).to(self.device)
+            if len(image.size()) < 4:
+                image = image.unsqueeze(1)
+            image = image.contiguous(memory_format=self.memory_format)
+            targets = []
+            for tgt_str in self.target:
+                tgt = sample[tgt_str].unsqueeze(0)
+                targets.append(tgt.expand((batch_size,) + tgt.shape[1:]).contiguous().to(self.device))
+            loss, _ = self._forward_loss(image, targets)
+            loss.backward()
+            self.optimizer.step()
+            self.optimizer.zero_grad()
+
+        batch_size, memory = find_batch_size(step_fn, self.device, budget=budget,
+                                             max_batch=max_batch, verbose=self.main_process)
+        if candidates is None:
+            candidates = [batch_size // 4, batch_size // 2, batch_size]
+        candidates = sorted(set(b for b in candidates if 0 < b <= batch_size))
+        throughput = measure_throughput(step_fn, candidates, self.device, steps=steps)
+
+        model.load_state_dict(state)
+        self.optimizer.load_state_dict(opt_state)
+
+        if self.main_process:
+            print('--- Batch size (images/s) ---')
+            for b in candidates:
+                peak = '{:10.1f} MB'.format(memory[b] / 1024. ** 2) if b in memory else ' ' * 13
+                print('batch {:4d}: {:10.2f} {:s}'.format(b, throughput[b], peak))
+            print('recommended:  {:d}'.format(batch_size))
+            print('-----------------------------')
+            print('')
 
-    def _saveweights(self, state):
+        return batch_size
+
+
+    def report_checkpointing(self, batch_size=4, steps=3):
         '''
-            Save network weights.
+            Measure the memory of the activations kept for backward and the
+            training step time, with and without activation checkpointing,
+            on a training batch. The network weights are restored after the
+            measurements.
+
+            Arguments:
+                @param batch_size: training batch size
+                @param steps: timed steps (forward and backward)
+
+            Returns: dictionary with the measurements (bytes and seconds)
+        '''
+        from copy import deepcopy
+        from nets.checkpointing import enable_checkpointing, disable_checkpointing, \
+                                       saved_tensors_bytes
+
+        model = self._unwrap()
+        state = deepcopy(model.state_dict())
+        self.model.train()
+        self.model = self.model.to(self.device)
+
+        collate_fn = collate_fn_ov_list if self.train_with_targets else None
+        data_loader = DataLoader(self.dataset_train, batch_size=batch_size, shuffle=False,
+                                 collate_fn=collate_fn)
+        image, targets = self._load_batch(next(iter(data_loader)))
+
+        def synchronize():
+            if self.device.type == 'cuda':
+                torch.cuda.synchronize(self.device)
+
+        results = {}
+        for enabled in [False, True]:
+            if enabled:
+                enable_checkpointing(model, self.arch, self.checkpointing)
+            else:
+                disable_checkpointing(model)
+            # Activations memory
+            memory, (loss, _) = saved_tensors_bytes(lambda: self._forward_loss(image, targets),
+                                                    model=model)
+            loss.backward()
+            self.optimizer.zero_grad()
+            # Step time
+            synchronize()
+            start = time.perf_counter()
+            for _ in range(steps):
+                loss, _ = self._forward_loss(image, targets)
+                loss.backward()
+                self.optimizer.zero_grad()
+            synchronize()
+            key = 'checkpointing' if enabled else 'baseline'
+            results[key + '_memory'] = memory
+            results[key + '_time'] = (time.perf_counter() - start) / steps
+        model.load_state_dict(state)
+
+        if self.main_process:
+            mb = 1024. ** 2
+            print('--- Activation checkpointing ---')
+            print('blocks:          {:s}'.format(', '.join(self.checkpoint_blocks)))
+            print('activations:     {:.1f} MB -> {:.1f} MB ({:.1f} MB saved)'.format(
+                  results['baseline_memory'] / mb, results['checkpointing_memory'] / mb,
+                  (results['baseline_memory'] - results['checkpointing_memory']) / mb))
+            print('step time:       {:.3f} s -> {:.3f} s ({:+.1f}%)'.format(
+                  results['baseline_time'], results['checkpointing_time'],
+                  100. * (results['checkpointing_time'] / results['baseline_time'] - 1)))
+            print('--------------------------------')
+            print('')
+
+        return results
+
+
+    def _saveweights(self, state, last=False):
+        '''
+            Save network weights (asynchronous).
 
             Arguments:
             @state (dict): parameters of the network
+            @last (bool): save as rolling checkpoint of the epoch instead of
+                the best one
         '''
         path = '../weights/'
-        filename = path + self.train_name + '_weights.pth.tar'
-        torch.save(state, filename)
+        if last:
+            filename = path + self.train_name + '_epoch{:03d}_weights.pth.tar'.format(state['epoch'])
+            self.checkpoint_writer.save(state, filename, slot='last', rolling=True)
+        else:
+            filename = path + self.train_name + '_weights.pth.tar'
+            self.checkpoint_writer.save(state, filename)
+
+
+    def resume(self, weights_path):
+        '''
+            Resume training from a checkpoint.
+
+            Arguments:
+            @weights_path (str): checkpoint file
+        '''
+        state = torch.load(weights_path, map_location='cpu')
+        self._unwrap().load_state_dict(state['state_dict'])
+        # Optimizer state follows the parameters device
+        self.model = self.model.to(self.device)
+        if 'optimizer_dict' in state:
+            self.optimizer.load_state_dict(state['optimizer_dict'])
+        else:
+            print('Checkpoint without optimizer state: optimizer restarted.')
+        if 'epoch' in state:
+            self.start_epoch = state['epoch']
+        if 'best_loss' in state:
+            self.best_loss = state['best_loss']
+
 
+    def _forward_loss(self, image, targets):
+        '''
+            Run the network and compute the training loss of a (micro) batch.
+
+            Arguments:
+                @param image: input batch
+                @param targets: list of targets (one per output)
 
-    def _iterate_train(self, data_loader_train):
+            Returns: loss, main prediction
+        '''
+        if self.train_with_targets:
+            loss_dict = self.model(image.to(self.device), targets[0])
+            loss = self.train_loss(loss_dict)
+            prediction = torch.zeros(image.shape) # To develop a function to generate an image with masks
+        else:
+            with torch.autocast(self.device.type, dtype=torch.bfloat16, enabled=self.bf16):
+                pred_masks = self.model(image)
+            # Handle multiples outputs (losses computed in float32)
+            if type(pred_masks) is list:
+                prediction = pred_masks[0]
+                losses = []
+                for k in range(len(pred_masks)):
+                    losses.append(self.train_loss(pred_masks[k].float(), targets[k]) * self.loss_weights[k])
+                loss = sum(losses)
+            else:
+                prediction = pred_masks
+                # Calculate loss for each batch
+                loss = self.train_loss(pred_masks.float(), targets[0])
 
-        # Init loss count
-        loss_train_sum = 0
-        data_train_len = len(self.dataset_train)
+        return loss, prediction
+
+
+    def _load_batch(self, sample):
+        '''
+            Get the input images and the targets of a loaded batch.
+
+            Returns: image (tensor), targets (list - one per output)
+        '''
+        # output targets
+        targets = []
+        # Treat output
+        if type(sample) is list: # list output
+            bs = len(sample)
+            if len(sample[0]['image'].shape) < 3:
+                h, w = sample[0]['image'].shape
+                ch = 1
+            else:
+                ch, h, w = sample[0]['image'].shape
+            # Get images
+            image = torch.zeros(bs, ch, h, w)
+            for i in range(bs):
+                image[i] = sample[i]['image'].to(self.device)
+            # Get masks
+            for tgt_str in self.target:
+                targets.append([s[tgt_str] for s in sample])
+                # Set to device
+                for tgt_master in targets:
+                    for tgt in tgt_master:
+                        if type(tgt) is dict:
+                            for t_idx in tgt:
+                                tgt[t_idx] = tgt[t_idx].to(self.device)
+                        else:
+                            tgt = tgt.to(self.device)
+        else:                   # Dict output
+            # Load data
+            image = sample['image'].to(self.device)
+            # Get masks
+            for tgt_str in self.target:
+                targets.append(sample[tgt_str].to(self.device))
+
+            # Handle input
+            if len(image.size()) < 4:
+                image.unsqueeze_(1) # add a dimension to the tensor
+
+        # Memory format of the network
+        image = image.contiguous(memory_format=self.memory_format)
+
+        return image, targets
+
+
+    def _iterate_train(self, data_loader_train, micro_batch=0):
+
+        # Init loss count (kept on device, read back once per epoch)
+        loss_train_sum = torch.zeros((), device=self.device)
+        data_train_len = 0
 
         # Active train
         self.model.train()
@@ -76,77 +471,47 @@ class Training:
 
         # Batch iteration - Training dataset
         for batch_idx, sample in enumerate(data_loader_train):
-            # desired parameters
-            pred_masks = None
-            # output targets
-            targets = []
-            # Treat output
-            if type(sample) is list: # list output
-                bs = len(sample)
-                if len(sample[0]['image'].shape) < 3:
-                    h, w = sample[0]['image'].shape
-                    ch = 1
-                else:
-                    ch, h, w = sample[0]['image'].shape
-                # Get images
-                image = torch.zeros(bs, ch, h, w)
-                for i in range(bs):
-                    image[i] = sample[i]['image'].to(self.device)
-                # Get masks
-                for tgt_str in self.target:
-                    targets.append([s[tgt_str] for s in sample])
-                    # Set to device
-                    for tgt_master in targets:
-                        for tgt in tgt_master:
-                            if type(tgt) is dict:
-                                for t_idx in tgt:
-                                    tgt[t_idx] = tgt[t_idx].to(self.device)
-                            else:
-                                tgt = tgt.to(self.device)
-            else:                   # Dict output
-                # Load data
-                image = sample['image'].to(self.device)
-                # Get masks
-                for tgt_str in self.target:
-                    targets.append(sample[tgt_str].to(self.device))
-
-                # Handle input
-                if len(image.size()) < 4:
-                    image.unsqueeze_(1) # add a dimension to the tensor
-
-            # Run prediction
-            if self.train_with_targets:
-                loss_dict = self.model(image.to(self.device), targets[0])
-                loss = self.train_loss(loss_dict)
-                prediction = torch.zeros(image.shape) # To develop a function to generate an image with masks
-            else:
-                pred_masks = self.model(image)
-                # Handle multiples outputs
-                if type(pred_masks) is list:
-                    prediction = pred_masks[0]
-                    losses = []
-                    for k in range(len(pred_masks)):
-                        losses.append(self.train_loss(pred_masks[k], targets[k]) * self.loss_weights[k])
-                    loss = sum(losses)
-                else:
-                    prediction = pred_masks
-                    # Calculate loss for each batch
-                    loss = self.train_loss(pred_masks, targets[0])
+            image, targets = self._load_batch(sample)
 
-            # Update epoch loss
-            loss_train_sum += len(image) * loss.item()
+            # Batch augmentation (intensity)
+            if self.batch_transform is not None:
+                image = self.batch_transform(image.to(self.device))
 
-            # Update weights
+            # Micro-batches (gradient accumulation over the whole batch)
+            bs = len(image)
+            mb_size = micro_batch if micro_batch > 0 else bs
+            loss_batch = 0
             self.optimizer.zero_grad()
-            loss.backward()
+            for mb_start in range(0, bs, mb_size):
+                mb_end = min(mb_start + mb_size, bs)
+                mb_targets = [tgt[mb_start:mb_end] for tgt in targets]
+                # Gradients are all-reduced on the last micro-batch only
+                if self.world_size > 1 and mb_end < bs:
+                    sync_context = self.model.no_sync()
+                else:
+                    sync_context = contextlib.nullcontext()
+                with sync_context:
+                    loss, prediction = self._forward_loss(image[mb_start:mb_end], mb_targets)
+                    # Normalize by the micro-batch share (last one may be smaller)
+                    loss = loss * (mb_end - mb_start) / bs
+                    loss.backward()
+                loss_batch += loss.detach()
+
+            # Update epoch loss (no device synchronization)
+            loss_train_sum += bs * loss_batch
+            data_train_len += bs
+
+            # Update weights
             self.optimizer.step()
 
-            # Output preview
+            # Output preview (prediction of the last micro-batch)
             if batch_idx == len(data_loader_train) - 1:
-                ref_image_train = image[0,...]
+                ref_image_train = image[mb_start,...]
                 ref_pred_train = prediction[0,...]
 
-        # Calculate average loss per epoch
+        # Calculate average loss per epoch (over all processes)
+        totals = torch.stack((loss_train_sum, torch.full_like(loss_train_sum, data_train_len)))
+        loss_train_sum, data_train_len = all_reduce_sum(totals).tolist()
         avg_loss_train = loss_train_sum / data_train_len
 
         return avg_loss_train, ref_image_train, ref_pred_train
@@ -154,13 +519,16 @@ class Training:
 
     def _iterate_val(self, data_loader_val):
 
-        # Init loss count
-        loss_val_sum = 0
-        data_val_len = len(self.dataset_val)
+        # Init loss count (kept on device, read back once per epoch)
+        loss_val_sum = torch.zeros((), device=self.device)
+        data_val_len = 0
+        ref_image_val, ref_pred_val = None, None
 
         # To evaluate on validation set
         self.model.eval()
         self.model = self.model.to(self.device)
+        # Shards may differ in size: no collective calls (DDP buffers broadcast)
+        model = self._unwrap()
 
         # Batch iteration - Validation dataset
         for batch_idx, sample in enumerate(data_loader_val):
@@ -172,13 +540,16 @@ class Training:
             # Handle input
             if len(image.size()) < 4:
                 image.unsqueeze_(1) # add a dimension to the tensor
+            image = image.contiguous(memory_format=self.memory_format)
 
             # Prediction
             self.optimizer.zero_grad()
-            pred = self.model(image)
+            with torch.autocast(self.device.type, dtype=torch.bfloat16, enabled=self.bf16):
+                pred = model(image)
 
             # Handle output dictionary case
             if self.train_with_targets:
+                from nets.rcnn import get_semantic_segmentation
                 pred = [get_semantic_segmentation(pred, n_classes).to(self.device),
                         pred]
 
@@ -187,8 +558,9 @@ class Training:
                 pred = pred[0]
 
             # Calculate loss for each batch
-            val_loss = self.eval_loss(pred, gt_mask)
-            loss_val_sum += len(image) * val_loss.item()
+            val_loss = self.eval_loss(pred.float(), gt_mask)
+            loss_val_sum += len(image) * val_loss.detach()
+            data_val_len += len(image)
 
             # Print output preview
             if batch_idx == len(data_loader_val) - 1:
@@ -196,6 +568,8 @@ class Training:
                 ref_pred_val = pred[0,...]
 
         # Calculate average validation loss per epoch
+        totals = torch.stack((loss_val_sum, torch.full_like(loss_val_sum, data_val_len)))
+        loss_val_sum, data_val_len = all_reduce_sum(totals).tolist()
         avg_loss_val = loss_val_sum / data_val_len
 
         return avg_loss_val, ref_image_val, ref_pred_val
@@ -208,79 +582,208 @@ class Training:
             info = { 'avg_loss_train': avg_loss_train,
                     'avg_loss_valid': avg_loss_val
                 }
+            # Validation may be skipped on some epochs
+            if avg_loss_val is None:
+                del info['avg_loss_valid']
             for tag, value in info.items():
                 self.logger.scalar_summary(tag, value, epoch+1)
 
             # 2. Log values and gradients of the parameters (histogram summary)
-            for tag, value in self.model.named_parameters():
-                tag = tag.replace('.', '/')
-                self.logger.histo_summary(tag, value.data.cpu().numpy(), epoch+1)
-                if not value.grad is None:
-                    self.logger.histo_summary(tag +'/grad', value.grad.data.cpu().numpy(), epoch+1)
+            if self.histo_interval > 0 and (epoch + 1) % self.histo_interval == 0:
+                self._log_histograms(epoch)
 
             # 3. Log training images (image summary)
             info = {'train_image': ref_image_train.cpu().numpy(),
-                    'train_predi': ref_pred_train.cpu().detach().numpy(),
-                    'valid_image': ref_image_val.cpu().numpy(),
-                    'valid_predi': ref_pred_val.cpu().detach().numpy()
+                    'train_predi': ref_pred_train.cpu().detach().numpy()
                 }
+            if ref_image_val is not None:
+                info['valid_image'] = ref_image_val.cpu().numpy()
+                info['valid_predi'] = ref_pred_val.cpu().detach().numpy()
             for tag, im in info.items():
                 self.logger.image_summary(tag, im, epoch+1)
 
+            # Single flush per epoch
+            self.logger.flush()
+
 
-    def train(self, epochs=100, batch_size=4):
+    def _log_histograms(self, epoch):
+        '''
+            Log histograms of the parameters and gradients.
+
+            Bins and statistics are computed on the device with fixed bins
+            (between min and max of each tensor) and copied to host at once.
+        '''
+        tensors = []
+        for tag, value in self._unwrap().named_parameters():
+            if self.histo_layers and not any(l in tag for l in self.histo_layers):
+                continue
+            tag = tag.replace('.', '/')
+            tensors.append((tag, value.detach()))
+            if not value.grad is None:
+                tensors.append((tag + '/grad', value.grad.detach()))
+        if len(tensors) == 0:
+            return
+
+        bins = self.histo_bins
+        stats = []
+        counts = []
+        for _, value in tensors:
+            x = value.flatten().float()
+            vmin, vmax = x.min(), x.max()
+            stats.append(torch.stack((vmin, vmax, torch.full_like(vmin, x.numel()),
+                                      x.sum(), (x * x).sum())))
+            # Subsample large tensors (counts rescaled to the full tensor)
+            if self.histo_samples > 0 and x.numel() > self.histo_samples:
+                idx = torch.randint(x.numel(), (self.histo_samples,), device=x.device)
+                sample = x[idx]
+                scale = x.numel() / float(self.histo_samples)
+            else:
+                sample = x
+                scale = 1.
+            width = ((vmax - vmin) / bins).clamp(min=1e-12)
+            bin_idx = ((sample - vmin) / width).long().clamp(0, bins - 1)
+            counts.append(torch.bincount(bin_idx, minlength=bins).float() * scale)
+
+        # Single device to host transfer
+        stats = torch.stack(stats).double().cpu().tolist()
+        counts = torch.stack(counts).double().cpu().numpy()
+
+        for k, (tag, _) in enumerate(tensors):
+            vmin, vmax, num, vsum, sum_squares = stats[k]
+            edges = [vmin + (vmax - vmin) * (b + 1) / bins for b in range(bins)]
+            hist = histogram_proto(vmin, vmax, num, vsum, sum_squares, edges, counts[k])
+            self.logger.add_histogram_proto(tag, hist, epoch+1)
+
+
+    def train(self, epochs=100, batch_size=4, micro_batch=0,
+              val_interval=1, val_subset=0, val_full_interval=0, val_batch_size=1,
+              patience=0, plateau_patience=0, plateau_factor=0.1, min_delta=0.):
         '''
         Train network function
 
         Arguments:
             @param net: network model
             @param epochs: number of training epochs (int)
-            @param batch_size: batch size (int)
+            @param batch_size: batch size (int) - images per optimizer step
+            @param micro_batch: images per forward/backward pass, gradients are
+                accumulated over the batch (int, 0 uses the whole batch)
+            @param val_interval: epochs between validations (int)
+            @param val_subset: validate on a fixed random subset - number of
+                images (int > 1) or fraction of the set (float <= 1), 0 uses
+                the whole validation set
+            @param val_full_interval: epochs between full validation passes
+                when val_subset is used (int, 0 only on the last epoch)
+            @param val_batch_size: validation batch size (int)
+            @param patience: stop after this number of epochs without
+                improvement of the validation loss (int, 0 disables)
+            @param plateau_patience: multiply the learning rate by plateau_factor
+                after this number of epochs without improvement (int, 0 disables)
+            @param plateau_factor: learning rate factor on plateaus (float)
+            @param min_delta: minimum decrease of the validation loss counted as
+                improvement (float)
         '''
 
-        # Load Dataset
-        if self.train_with_targets:
-            data_loader_train = DataLoader(self.dataset_train, batch_size=batch_size, shuffle=True, collate_fn=collate_fn_ov_list)
-        else:
-            data_loader_train = DataLoader(self.dataset_train, batch_size=batch_size, shuffle=True)
-        data_loader_val = DataLoader(self.dataset_val, batch_size=1, shuffle=False)
+        # Load Dataset (sharded over processes in data-parallel mode)
+        train_sampler = None
+        if self.world_size > 1:
+            train_sampler = DistributedSampler(self.dataset_train, shuffle=True)
+        collate_fn = collate_fn_ov_list if self.train_with_targets else None
+        data_loader_train = DataLoader(self.dataset_train, batch_size=batch_size,
+                                       shuffle=train_sampler is None, sampler=train_sampler,
+                                       collate_fn=collate_fn, **self._loader_kwargs(persistent=True))
+        data_loader_val = self._val_loader(self.dataset_val, val_batch_size)
+
+        # Fixed random validation subset (monitored by checkpoints and early stopping)
+        data_loader_subset = None
+        if val_subset > 0:
+            n_val = len(self.dataset_val)
+            n_subset = int(round(val_subset * n_val)) if val_subset <= 1 else int(val_subset)
+            n_subset = min(max(n_subset, 1), n_val)
+            generator = torch.Generator().manual_seed(0)
+            indices = torch.randperm(n_val, generator=generator)[:n_subset].tolist()
+            data_loader_subset = self._val_loader(Subset(self.dataset_val, indices), val_batch_size)
 
         # Define parameters
-        best_loss = 1000    # Init best loss with a too high value
+        best_loss = self.best_loss
+        best_epoch = self.start_epoch
+        plateau_epoch = self.start_epoch
 
         # Run epochs
-        for epoch in range(epochs):
+        for epoch in range(self.start_epoch, epochs):
             print('Starting epoch {}/{}.'.format(epoch + 1, epochs))
+            last_epoch = epoch == epochs - 1
+            if train_sampler is not None:
+                train_sampler.set_epoch(epoch)
 
             # ========================= Training =============================== #
-            avg_loss_train, ref_image_train, ref_pred_train = self._iterate_train(data_loader_train)
+            avg_loss_train, ref_image_train, ref_pred_train = self._iterate_train(data_loader_train, micro_batch=micro_batch)
             print('training loss:  {:f}'.format(avg_loss_train))
 
             # ========================= Validation ============================= #
-            avg_loss_val, ref_image_val, ref_pred_val = self._iterate_val(data_loader_val)
-            print('validation loss: {:f}'.format(avg_loss_val))
+            avg_loss_val, ref_image_val, ref_pred_val = None, None, None
+            if (epoch + 1) % val_interval == 0 or last_epoch:
+                if data_loader_subset is not None:
+                    avg_loss_val, ref_image_val, ref_pred_val = self._iterate_val(data_loader_subset)
+                    print('validation loss (subset): {:f}'.format(avg_loss_val))
+                    # Periodic full pass (reported only)
+                    if last_epoch or (val_full_interval > 0 and (epoch + 1) % val_full_interval == 0):
+                        avg_loss_full, _, _ = self._iterate_val(data_loader_val)
+                        print('validation loss (full):   {:f}'.format(avg_loss_full))
+                        if self.logger:
+                            self.logger.scalar_summary('avg_loss_valid_full', avg_loss_full, epoch+1)
+                else:
+                    avg_loss_val, ref_image_val, ref_pred_val = self._iterate_val(data_loader_val)
+                    print('validation loss: {:f}'.format(avg_loss_val))
             print('')
 
             # ======================== Save weights ============================ #
-            if best_loss > avg_loss_val:
+            is_best = avg_loss_val is not None and best_loss > avg_loss_val
+            if avg_loss_val is not None and avg_loss_val < best_loss - min_delta:
+                best_epoch = epoch + 1
+                plateau_epoch = epoch + 1
+            if is_best:
                 best_loss = avg_loss_val
+            if self.main_process and (is_best or self.keep_last > 0):
+                state = {
+                        'epoch': epoch + 1,
+                        'arch': self.arch,
+                        'state_dict': self._unwrap().state_dict(),
+                        'target': self.target,
+                        'loss_function': str(self.train_loss),
+                        'loss_weights': self.loss_weights,
+                        'best_loss': best_loss,
+                        'optimizer': str(self.optimizer),
+                        'optimizer_dict': self.optimizer.state_dict(),
+                        'device': str(self.device)
+                        }
+                if self.build_kwargs is not None:
+                    state['build_kwargs'] = self.build_kwargs
+                    state['n_input'] = self.build_kwargs['n_channels']
+                    state['n_classes'] = self.build_kwargs['n_classes']
                 # save
-                self._saveweights({
-                            'epoch': epoch + 1,
-                            'arch': self.arch,
-                            'n_input': ref_image_train.shape[0],
-                            'n_classes': ref_pred_train.shape[0],
-                            'state_dict': self.model.state_dict(),
-                            'target': self.target,
-                            'loss_function': str(self.train_loss),
-                            'loss_weights': self.loss_weights,
-                            'best_loss': best_loss,
-                            'optimizer': str(self.optimizer),
-                            'optimizer_dict': self.optimizer.state_dict(),
-                            'device': str(self.device)
-                            })
+                if is_best:
+                    self._saveweights(state)
+                if self.keep_last > 0:
+                    self._saveweights(state, last=True)
 
             # ====================== Tensorboard Logging ======================= #
             if self.logger:
                 self._logging(epoch, avg_loss_train, avg_loss_val,
-                    ref_image_train, ref_pred_train, ref_image_val, ref_pred_val)
\ No newline at end of file
+                    ref_image_train, ref_pred_train, ref_image_val, ref_pred_val)
+
+            # ================== Plateau and early stopping ==================== #
+            if avg_loss_val is not None:
+                if plateau_patience > 0 and epoch + 1 - plateau_epoch >= plateau_patience:
+                    plateau_epoch = epoch + 1
+                    for group in self.optimizer.param_groups:
+                        group['lr'] *= plateau_factor
+                    print('Plateau detected: learning rate reduced by {:g}.'.format(plateau_factor))
+                if patience > 0 and epoch + 1 - best_epoch >= patience:
+                    print('Early stopping: no improvement since epoch {:d}.'.format(best_epoch))
+                    break
+
+        # Wait for the queued checkpoints and logs
+        self.best_loss = best_loss
+        self.checkpoint_writer.wait()
+        if self.logger:
+            self.logger.flush()
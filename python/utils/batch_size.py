@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 22 09:48:19 2026
+
+@author: Diego Wanderley
+@python: 3.6 and Pytroch
+@description: Batch size autotuner - largest batch whose training step fits
+    a memory budget (GPU memory, or RAM on CPU)
+"""
+
+import gc
+import os
+import time
+import ctypes
+import torch
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# =============================== Memory usage ================================= #
+
+def _read_proc(filename, field):
+    ''' Value (kB) of a field of a /proc status file (None if unavailable) '''
+    try:
+        with open(filename) as fp:
+            for line in fp:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def _release_memory(device):
+    ''' Give the freed memory back (allocator caches) '''
+    gc.collect()
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+    else:
+        try:
+            ctypes.CDLL('libc.so.6').malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+
+def _reset_peak_rss():
+    ''' Reset the peak resident memory of the process (Linux) '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _peak_rss():
+    ''' Peak resident memory of the process (bytes) '''
+    peak = _read_proc('/proc/self/status', 'VmHWM')
+    if peak is None and resource is not None:
+        # Peak since the process start (kB on Linux)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if peak is None:
+        return 0
+    return peak * 1024
+
+
+def memory_budget(device, fraction=0.9):
+    '''
+        Default memory budget: a fraction of the GPU memory, or of the RAM
+        available to the process on CPU.
+    '''
+    if device.type == 'cuda':
+        return int(fraction * torch.cuda.get_device_properties(device).total_memory)
+    available = _read_proc('/proc/meminfo', 'MemAvailable')
+    rss = _read_proc('/proc/self/status', 'VmRSS')
+    if available is None or rss is None:
+        return int(fraction * os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+    return int(fraction * (available + rss) * 1024)
+
+
+def step_memory(step_fn, batch_size, device):
+    '''
+        Peak memory of a training step (GPU memory allocated, or resident
+        memory of the process on CPU).
+
+        Arguments:
+            @param step_fn: function running a forward/backward step on a
+                batch of the given size
+            @param batch_size: batch size
+
+        Returns: peak memory (bytes), None when the step runs out of memory
+    '''
+    _release_memory(device)
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    else:
+        _reset_peak_rss()
+    try:
+        step_fn(batch_size)
+    except RuntimeError as e:
+        message = str(e).lower()
+        if 'out of memory' not in message and "can't allocate memory" not in message:
+            raise
+        _release_memory(device)
+        return None
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        return torch.cuda.max_memory_allocated(device)
+    return _peak_rss()
+
+
+# ================================ Autotuner =================================== #
+
+def find_batch_size(step_fn, device, budget=None, max_batch=256, verbose=True):
+    '''
+        Largest batch size whose training step fits the memory budget.
+        The batch size is doubled until the step does not fit, then a binary
+        search runs between the last size that fits and the first that does
+        not. Sizes whose memory (extrapolated from the previous steps) is far
+        above the budget are not run, so the process is not killed on CPU.
+
+        Arguments:
+            @param step_fn: function running a forward/backward step on a
+                batch of the given size
+            @param device: device of the network
+            @param budget: memory budget in bytes (None: see memory_budget)
+            @param max_batch: largest batch size tried
+
+        Returns: batch size, dictionary of the measured peak memory per size
+    '''
+    if budget is None:
+        budget = memory_budget(device)
+    measured = {}
+
+    def fits(batch_size):
+        # Linear extrapolation from the two largest measured sizes
+        sizes = sorted(b for b in measured if measured[b] is not None)
+        if len(sizes) >= 2:
+            b1, b2 = sizes[-2:]
+            per_sample = (measured[b2] - measured[b1]) / float(b2 - b1)
+            if measured[b2] + per_sample * (batch_size - b2) > 1.5 * budget:
+                if verbose:
+                    print('batch {:4d}: skipped (extrapolated above the budget)'.format(batch_size))
+                return False
+        peak = step_memory(step_fn, batch_size, device)
+        measured[batch_size] = peak
+        if verbose:
+            print('batch {:4d}: {:s}'.format(batch_size, 'out of memory' if peak is None
+                  else '{:.1f} MB'.format(peak / 1024. ** 2)))
+        return peak is not None and peak <= budget
+
+    if verbose:
+        print('--- Batch size search (budget {:.1f} MB) ---'.format(budget / 1024. ** 2))
+    # Exponential growth
+    low, high = 0, None
+    batch_size = 1
+    while True:
+        if not fits(batch_size):
+            high = batch_size
+            break
+        low = batch_size
+        if batch_size >= max_batch:
+            break
+        batch_size = min(2 * batch_size, max_batch)
+    if low == 0:
+        raise RuntimeError("A batch of one image does not fit the memory budget.")
+    # Binary search
+    if high is not None:
+        while high - low > 1:
+            mid = (low + high) // 2
+            if fits(mid):
+                low = mid
+            else:
+                high = mid
+    if verbose:
+        print('')
+
+    return low, dict((b, m) for b, m in measured.items() if m is not None)
+
+
+def measure_throughput(step_fn, batch_sizes, device, steps=3, warmup=1):
+    '''
+        Training throughput (images per second) of each batch size.
+
+        Arguments:
+            @param step_fn: function running a forward/backward step on a
+                batch of the given size
+            @param batch_sizes: batch sizes to be measured
+            @param device: device of the network
+            @param steps: timed steps per batch size (at least one)
+            @param warmup: steps run before the timed ones
+
+        Returns: dictionary of the throughput per batch size
+    '''
+    if steps < 1:
+        raise ValueError("At least one timed step is required (steps={}).".format(steps))
+    throughput = {}
+    for batch_size in batch_sizes:
+        _release_memory(device)
+        for i in range(warmup + steps):
+            if i == warmup:
+                if device.type == 'cuda':
+                    torch.cuda.synchronize(device)
+                start = time.perf_counter()
+            step_fn(batch_size)
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        throughput[batch_size] = steps * batch_size / (time.perf_counter() - start)
+    return throughput
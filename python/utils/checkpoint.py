@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:20:05 2026
+
+@author: Diego Wanderley
+@python: 3.6 and Pytroch
+@description: Asynchronous and atomic checkpoint writer
+"""
+
+import os
+import re
+import glob
+import threading
+import torch
+
+from collections import OrderedDict
+
+
+def snapshot_to_cpu(obj):
+    '''
+        Copy all tensors of a (nested) state to CPU memory.
+        CPU tensors are cloned, since training keeps updating them in-place.
+    '''
+    if torch.is_tensor(obj):
+        if obj.device.type == 'cpu':
+            return obj.detach().clone()
+        return obj.detach().to('cpu')
+    elif isinstance(obj, dict):
+        return type(obj)((k, snapshot_to_cpu(v)) for k, v in obj.items())
+    elif type(obj) is list:
+        return [snapshot_to_cpu(v) for v in obj]
+    elif type(obj) is tuple:
+        return tuple(snapshot_to_cpu(v) for v in obj)
+    return obj
+
+
+def _numeric_key(filename):
+    ''' Sort key of file names by their numbers (e.g. epoch) '''
+    return [int(n) for n in re.findall(r'\d+', os.path.basename(filename))]
+
+
+class CheckpointWriter(object):
+    '''
+    Save checkpoints on a background thread.
+
+    The state is copied to CPU memory on save() and serialized by a worker
+    thread to a temporary file, then renamed over the destination (atomic:
+    a crash never leaves a partial checkpoint). Each slot keeps only the most
+    recent state - a queued write is skipped when a newer one arrives.
+
+    Arguments:
+        @param weights_only: drop the optimizer state from the checkpoints
+        @param keep_last: number of rolling checkpoints kept on disk
+            (0 keeps all of them)
+        @param rolling_pattern: glob pattern of the rolling checkpoints already
+            on disk (e.g. of a resumed training), rotated out with the new ones
+            in the order of the numbers in their names (epoch)
+    '''
+
+    def __init__(self, weights_only=False, keep_last=0, rolling_pattern=None):
+        self.weights_only = weights_only
+        self.keep_last = keep_last
+        self.skipped = 0
+        self._pending = OrderedDict()   # slot -> (filename, state, rolling)
+        self._rolling = []
+        if rolling_pattern is not None:
+            self._rolling = sorted(glob.glob(rolling_pattern), key=_numeric_key)
+        self._busy = False
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def save(self, state, filename, slot=None, rolling=False):
+        '''
+            Queue a checkpoint.
+
+            Arguments:
+                @param state: dictionary to be saved
+                @param filename: destination path
+                @param slot: writes with the same slot replace each other while
+                    queued (default: filename)
+                @param rolling: file is part of the rolling (last N) checkpoints
+        '''
+        if self.weights_only:
+            state = dict((k, v) for k, v in state.items() if k != 'optimizer_dict')
+        state = snapshot_to_cpu(state)
+        if slot is None:
+            slot = filename
+
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Checkpoint writer is closed.")
+            # Report a failed write (e.g. full disk) as soon as possible
+            if self._error is not None:
+                error, self._error = self._error, None
+                raise error
+            # Newer state supersedes the queued one
+            if slot in self._pending:
+                del self._pending[slot]
+                self.skipped += 1
+            self._pending[slot] = (filename, state, rolling)
+            self._cond.notify_all()
+
+    def _write(self, filename, state):
+        ''' Serialize to a temporary file and rename it (atomic) '''
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as fp:
+            torch.save(state, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_filename, filename)
+
+    def _rotate(self, filename):
+        ''' Remove the oldest rolling checkpoints '''
+        if filename in self._rolling:
+            self._rolling.remove(filename)
+        self._rolling.append(filename)
+        while self.keep_last > 0 and len(self._rolling) > self.keep_last:
+            old_filename = self._rolling.pop(0)
+            if os.path.exists(old_filename):
+                os.remove(old_filename)
+
+    def _run(self):
+        ''' Worker thread '''
+        while True:
+            with self._cond:
+                while len(self._pending) == 0 and not self._closed:
+                    self._cond.wait()
+                if len(self._pending) == 0:
+                    return
+                _, (filename, state, rolling) = self._pending.popitem(last=False)
+                self._busy = True
+            try:
+                self._write(filename, state)
+                if rolling:
+                    self._rotate(filename)
+            except Exception as e:
+                self._error = e
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def wait(self):
+        '''
+            Block until all queued checkpoints are written.
+        '''
+        with self._cond:
+            while len(self._pending) > 0 or self._busy:
+                self._cond.wait()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def close(self):
+        '''
+            Write the queued checkpoints and stop the worker thread.
+        '''
+        self.wait()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
@@ -15,7 +15,6 @@ import random
 import numpy as np
 
 from PIL import Image
-from skimage import exposure, filters
 from torchvision import transforms
 from torch.utils.data import Dataset
 
@@ -313,6 +312,8 @@ class OvaryDataset(Dataset):
         '''
         # Check has clahe
         if self.clahe:
+            # Loaded only when CLAHE is used (slow import)
+            from skimage import exposure
             if len(im_np.shape) == 2:
                 im_np = im_np.reshape(im_np.shape+(1,))
             imclahe = np.zeros((im_np.shape[0], im_np.shape[1], 1))
@@ -409,7 +410,7 @@ class VOC2012Dataset(Dataset):
     Dataset of Pascal VCO 2012 images.
     """
 
-    def __init__(self, im_dir, gt_dir, file_list, one_hot=True, transform=None):
+    def __init__(self, im_dir, gt_dir, file_list, one_hot=True, transform=None, pad_void=False):
         """
         Args:
             im_dir (string): Directory with all the images.
@@ -418,11 +419,14 @@ class VOC2012Dataset(Dataset):
             on_hot (bool): Optional output encoding one-hot-encoding or gray levels
             transform (callable, optional): Optional transform to be applied
                 on a sample.
+            pad_void (bool, optional): Label the square padding as void (to be
+                ignored), instead of background - default is False.
         """
         self.im_dir = im_dir
         self.gt_dir = gt_dir
         self.transform = transform
         self.one_hot = one_hot
+        self.pad_void = pad_void
         self.n_classes = 20+2
         self.height = 512
         self.width = 512
@@ -527,7 +531,10 @@ class VOC2012Dataset(Dataset):
         hist = gt_im.histogram()
         main_class = np.argmax(hist[1:-1]) + 1 # ignore void and background
         # Apply gt to square
-        gt_square_p = np.zeros((self.height, self.width))
+        if self.pad_void:
+            gt_square_p = 255 * np.ones((self.height, self.width))
+        else:
+            gt_square_p = np.zeros((self.height, self.width))
         gt_square_p[p_top:p_down, p_left:p_right] = gt_np
         # Define lables from 0 (background) to n_classes-1 and add void idx
         labels_idx = list(range(self.n_classes-1)) +  [255]
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 09:12:33 2026
+
+@author: Diego Wanderley
+@python: 3.6 and Pytroch
+@description: Distributed (data-parallel) execution utilities
+"""
+
+import torch
+import torch.distributed as dist
+
+from torch.utils.data import Sampler
+
+
+def is_dist_avail_and_initialized():
+    if not dist.is_available():
+        return False
+    if not dist.is_initialized():
+        return False
+    return True
+
+
+def get_world_size():
+    if not is_dist_avail_and_initialized():
+        return 1
+    return dist.get_world_size()
+
+
+def get_rank():
+    if not is_dist_avail_and_initialized():
+        return 0
+    return dist.get_rank()
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def init_distributed(world_size=None, rank=None, backend='gloo', init_method='env://'):
+    '''
+    Initialize the default process group.
+
+    Arguments:
+        @param world_size: number of processes (None: from environment)
+        @param rank: rank of this process (None: from environment)
+        @param backend: 'gloo' (CPU) or 'nccl' (GPU)
+        @param init_method: URL to find the other processes, e.g.
+            'tcp://host:port' or 'env://' (MASTER_ADDR and MASTER_PORT)
+    '''
+    kwargs = {}
+    if world_size is not None:
+        kwargs['world_size'] = world_size
+    if rank is not None:
+        kwargs['rank'] = rank
+    dist.init_process_group(backend=backend, init_method=init_method, **kwargs)
+
+
+def cleanup_distributed():
+    if is_dist_avail_and_initialized():
+        dist.destroy_process_group()
+
+
+class ShardSampler(Sampler):
+    '''
+    Sequential sampler over the shard of this process (indices rank,
+    rank + world_size, ...). Unlike DistributedSampler, the dataset is not
+    padded: each sample is used exactly once, so shards may differ by one.
+
+    Arguments:
+        @param dataset: dataset to be sharded
+        @param num_replicas: number of processes (None: world size)
+        @param rank: rank of this process (None: current rank)
+    '''
+
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        self.dataset = dataset
+        self.num_replicas = num_replicas if num_replicas is not None else get_world_size()
+        self.rank = rank if rank is not None else get_rank()
+
+    def __iter__(self):
+        return iter(range(self.rank, len(self.dataset), self.num_replicas))
+
+    def __len__(self):
+        return len(range(self.rank, len(self.dataset), self.num_replicas))
+
+
+def all_reduce_sum(tensor):
+    '''
+    Sum a tensor over all processes (in-place), no-op without distribution.
+    '''
+    if get_world_size() > 1:
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+def reduce_dict(input_dict, average=True):
+    """
+    Args:
+        input_dict (dict): all the values will be reduced
+        average (bool): whether to do average or sum
+    Reduce the values in the dictionary from all processes so that all processes
+    have the averaged results. Returns a dict with the same fields as
+    input_dict, after reduction.
+    """
+    world_size = get_world_size()
+    if world_size < 2:
+        return input_dict
+    with torch.no_grad():
+        names = []
+        values = []
+        # sort the keys so that they are consistent across processes
+        for k in sorted(input_dict.keys()):
+            names.append(k)
+            values.append(input_dict[k])
+        values = torch.stack(values, dim=0)
+        dist.all_reduce(values)
+        if average:
+            values /= world_size
+        reduced_dict = {k: v for k, v in zip(names, values)}
+    return reduced_dict
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 10:14:37 2026
+
+@author: Diego Wanderley
+@python: 3.6 and Pytroch
+@description: TorchScript compilation of the networks and cache of the
+    compiled artefacts
+"""
+
+import os
+import json
+import hashlib
+import torch
+
+
+def script_model(model, freeze=True):
+    '''
+        Compile a network with TorchScript (inference mode).
+
+        Arguments:
+            @param model: network model (in the device it will run on)
+            @param freeze: inline the weights as constants, which enables
+                the graph optimizations (e.g. conv + batch norm folding)
+
+        Returns: scripted module
+    '''
+    model.eval()
+    scripted = torch.jit.script(model)
+    if freeze:
+        scripted = torch.jit.freeze(scripted)
+    return scripted
+
+
+def optimize_for_inference(scripted):
+    '''
+        Operator fusion passes of a frozen module (not serialized, so they
+        are applied after loading).
+    '''
+    return torch.jit.optimize_for_inference(scripted)
+
+
+def output_difference(model, scripted, image, bf16=False):
+    '''
+        Maximum absolute difference between the outputs of the eager and the
+        compiled network on the same input and autocast setting.
+
+        Arguments:
+            @param model: eager network model (inference mode)
+            @param scripted: compiled network
+            @param image: input batch
+            @param bf16: run both networks with bfloat16 autocast
+    '''
+    with torch.no_grad(), torch.autocast(image.device.type, dtype=torch.bfloat16,
+                                         enabled=bf16):
+        pred = model(image)
+        pred_jit = scripted(image)
+    return (pred.float() - pred_jit.float()).abs().max().item()
+
+
+def compiled_path(weights_path, cache_dir, *keys):
+    '''
+        Artefact file of a checkpoint. The name holds a hash of the checkpoint
+        file (path, size and modification time), the PyTorch version and the
+        extra keys (architecture, build arguments, device, memory format,
+        bfloat16...), so a stale artefact is never loaded.
+    '''
+    stat = os.stat(weights_path)
+    key = [os.path.abspath(weights_path), str(stat.st_size), str(stat.st_mtime_ns),
+           torch.__version__] + [str(k) for k in keys]
+    digest = hashlib.sha1('|'.join(key).encode('utf-8')).hexdigest()[:16]
+    name = os.path.basename(weights_path).split('.')[0]
+    return os.path.join(cache_dir, '{:s}.{:s}.pt'.format(name, digest))
+
+
+def save_compiled(scripted, filename, state=None):
+    '''
+        Save a scripted module (atomic) with the checkpoint information
+        (state without the weights and the optimizer).
+    '''
+    folder = os.path.dirname(filename)
+    if folder != '' and not os.path.exists(folder):
+        os.makedirs(folder)
+    info = {}
+    if state is not None:
+        info = dict((k, v) for k, v in state.items()
+                    if k not in ['state_dict', 'optimizer_dict'])
+    tmp_filename = filename + '.tmp'
+    torch.jit.save(scripted, tmp_filename,
+                   _extra_files={'state.json': json.dumps(info, default=str)})
+    os.replace(tmp_filename, filename)
+
+
+def load_compiled(filename, map_location=None):
+    '''
+        Load a scripted module saved by save_compiled.
+
+        Returns: scripted module, checkpoint information (dict)
+    '''
+    extra_files = {'state.json': ''}
+    scripted = torch.jit.load(filename, map_location=map_location, _extra_files=extra_files)
+    info = extra_files['state.json']
+    if isinstance(info, bytes):
+        info = info.decode('utf-8')
+    state = json.loads(info) if len(info) > 0 else {}
+    return scripted, state
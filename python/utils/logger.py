@@ -1,25 +1,234 @@
-# Code referenced from https://gist.github.com/gyglim/1f8dfb1b5c82627ae3efcfbbadb9f514
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 17:05:48 2026
 
-import tensorflow as tf
+@author: Diego Wanderley
+@python: 3.6
+@description: TensorBoard logger - writes event files without TensorFlow
+    (protocol buffers are encoded here). API referenced from
+    https://gist.github.com/gyglim/1f8dfb1b5c82627ae3efcfbbadb9f514
+"""
+
+import os
+import time
+import socket
+import struct
+import threading
 import numpy as np
-import scipy.misc
+
+from io import BytesIO
+from PIL import Image
+
+
+# ============================ CRC32-C (Castagnoli) ============================ #
+
+# Native implementations (optional)
 try:
-    from StringIO import StringIO  # Python 2.7
+    from crc32c import crc32c as _crc32c_native
 except ImportError:
-    from io import BytesIO         # Python 3.x
+    try:
+        from google_crc32c import value as _crc32c_native
+    except ImportError:
+        _crc32c_native = None
+
+
+def _crc32c_tables():
+    '''
+        Tables of the slicing-by-8 algorithm: table k gives the CRC of a byte
+        followed by k zero bytes.
+    '''
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    tables = [table]
+    for _ in range(7):
+        prev = tables[-1]
+        tables.append([(c >> 8) ^ table[c & 0xFF] for c in prev])
+    return tables
+
+_CRC_TABLES = _crc32c_tables()
+
+
+def _crc32c_python(data):
+    '''
+        CRC32-C checksum, 8 bytes per iteration (slicing-by-8).
+    '''
+    t0, t1, t2, t3, t4, t5, t6, t7 = _CRC_TABLES
+    data = bytes(data)
+    n8 = len(data) - len(data) % 8
+    crc = 0xFFFFFFFF
+    for lo, hi in struct.iter_unpack('<II', data[:n8]):
+        lo ^= crc
+        crc = (t7[lo & 0xFF] ^ t6[(lo >> 8) & 0xFF] ^ t5[(lo >> 16) & 0xFF] ^ t4[lo >> 24] ^
+               t3[hi & 0xFF] ^ t2[(hi >> 8) & 0xFF] ^ t1[(hi >> 16) & 0xFF] ^ t0[hi >> 24])
+    for b in data[n8:]:
+        crc = t0[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def masked_crc32c(data):
+    '''
+        Masked CRC32-C checksum of the TFRecord format.
+    '''
+    if _crc32c_native is not None:
+        crc = _crc32c_native(data)
+    else:
+        crc = _crc32c_python(data)
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+# ========================== Protocol buffers encoding ========================= #
+
+def _varint(value):
+    out = bytearray()
+    value &= 0xFFFFFFFFFFFFFFFF
+    while True:
+        bits = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(bits | 0x80)
+        else:
+            out.append(bits)
+            return bytes(out)
+
+def _field_varint(field, value):
+    return _varint(field << 3) + _varint(int(value))
+
+def _field_double(field, value):
+    return _varint((field << 3) | 1) + struct.pack('<d', float(value))
+
+def _field_float(field, value):
+    return _varint((field << 3) | 5) + struct.pack('<f', float(value))
+
+def _field_bytes(field, value):
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return _varint((field << 3) | 2) + _varint(len(value)) + value
+
+def _field_packed_doubles(field, values):
+    values = np.asarray(values, dtype='<f8').tobytes()
+    return _field_bytes(field, values)
+
+
+def _summary_value(tag, simple_value=None, image=None, histo=None):
+    ''' Summary.Value message '''
+    msg = _field_bytes(1, tag)
+    if simple_value is not None:
+        msg += _field_float(2, simple_value)
+    if image is not None:
+        msg += _field_bytes(4, image)
+    if histo is not None:
+        msg += _field_bytes(5, histo)
+    return msg
+
+
+def _image_proto(encoded, height, width, colorspace):
+    ''' Summary.Image message '''
+    return (_field_varint(1, height) + _field_varint(2, width) +
+            _field_varint(3, colorspace) + _field_bytes(4, encoded))
 
 
+def histogram_proto(vmin, vmax, num, vsum, sum_squares, bucket_limit, bucket):
+    '''
+        HistogramProto message.
+
+        Arguments:
+            @param vmin, vmax, num, vsum, sum_squares: statistics of the values
+            @param bucket_limit: right edge of each bin
+            @param bucket: count of each bin
+    '''
+    return (_field_double(1, vmin) + _field_double(2, vmax) +
+            _field_double(3, num) + _field_double(4, vsum) +
+            _field_double(5, sum_squares) +
+            _field_packed_doubles(6, bucket_limit) +
+            _field_packed_doubles(7, bucket))
+
+
+def _event(step, summary_values=None, file_version=None):
+    ''' Event message '''
+    msg = _field_double(1, time.time()) + _field_varint(2, step)
+    if file_version is not None:
+        msg += _field_bytes(3, file_version)
+    if summary_values is not None:
+        summary = b''.join(_field_bytes(1, v) for v in summary_values)
+        msg += _field_bytes(5, summary)
+    return msg
+
+
+# ================================== Logger ==================================== #
+
 class Logger(object):
+    '''
+    TensorBoard logger.
 
-    def __init__(self, log_dir):
+    Events are buffered in memory and written (as TFRecords) to the event file
+    by a background thread every flush_secs, or when flush() is called.
+
+    Arguments:
+        @param log_dir: logs folder
+        @param flush_secs: interval between automatic flushes (seconds)
+    '''
+
+    def __init__(self, log_dir, flush_secs=10):
         """Create a summary writer logging to log_dir."""
-        self.writer = tf.compat.v1.summary.FileWriter(log_dir)
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        filename = 'events.out.tfevents.{:010d}.{:s}'.format(int(time.time()), socket.gethostname())
+        self.filename = os.path.join(log_dir, filename)
+        self.flush_secs = flush_secs
+
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._file = open(self.filename, 'ab')
+        self._add_event(_event(0, file_version='brain.Event:2'))
+        self.flush()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    def _add_event(self, event):
+        with self._lock:
+            self._buffer.append(event)
+
+
+    def _run(self):
+        while not self._closed.wait(self.flush_secs):
+            self.flush()
+
+
+    def flush(self):
+        """Write buffered events to the event file."""
+        with self._flush_lock:
+            with self._lock:
+                events, self._buffer = self._buffer, []
+            if len(events) == 0 or self._file.closed:
+                return
+            records = []
+            for event in events:
+                header = struct.pack('<Q', len(event))
+                records.append(header + struct.pack('<I', masked_crc32c(header)) +
+                               event + struct.pack('<I', masked_crc32c(event)))
+            self._file.write(b''.join(records))
+            self._file.flush()
+
+
+    def close(self):
+        """Flush events and close the event file."""
+        self._closed.set()
+        self._thread.join()
+        self.flush()
+        self._file.close()
 
 
     def scalar_summary(self, tag, value, step):
         """Log a scalar variable."""
-        summary = tf.compat.v1.Summary(value=[tf.compat.v1.Summary.Value(tag=tag, simple_value=value)])
-        self.writer.add_summary(summary, step)
+        self._add_event(_event(step, [_summary_value(tag, simple_value=value)]))
 
 
     def image_summary(self, tag, images, step):
@@ -27,49 +236,41 @@ class Logger(object):
 
         img_summaries = []
         for i, img in enumerate(images):
+            img = np.asarray(img, dtype=np.float64)
+            # Scale to 8 bits (min-max, as scipy.misc.toimage)
+            vmin, vmax = img.min(), img.max()
+            scale = 255. / (vmax - vmin) if vmax > vmin else 0.
+            img = ((img - vmin) * scale).round().astype(np.uint8)
+
             # Write the image to a string
-            try:
-                s = StringIO()
-            except:
-                s = BytesIO()
-            scipy.misc.toimage(img).save(s, format="png")
-
-            # Create an Image object
-            img_sum = tf.compat.v1.Summary.Image(encoded_image_string=s.getvalue(),
-                                       height=img.shape[0],
-                                       width=img.shape[1])
+            s = BytesIO()
+            Image.fromarray(img).save(s, format="png")
+
             # Create a Summary value
-            img_summaries.append(tf.compat.v1.Summary.Value(tag='%s/%d' % (tag, i), image=img_sum))
+            colorspace = 1 if img.ndim < 3 else img.shape[2]
+            img_sum = _image_proto(s.getvalue(), img.shape[0], img.shape[1], colorspace)
+            img_summaries.append(_summary_value('%s/%d' % (tag, i), image=img_sum))
 
         # Create and write Summary
-        summary = tf.compat.v1.Summary(value=img_summaries)
-        self.writer.add_summary(summary, step)
+        self._add_event(_event(step, img_summaries))
 
 
     def histo_summary(self, tag, values, step, bins=1000):
         """Log a histogram of the tensor of values."""
 
         # Create a histogram using numpy
+        values = np.asarray(values)
         counts, bin_edges = np.histogram(values, bins=bins)
 
-        # Fill the fields of the histogram proto
-        hist = tf.compat.v1.HistogramProto()
-        hist.min = float(np.min(values))
-        hist.max = float(np.max(values))
-        hist.num = int(np.prod(values.shape))
-        hist.sum = float(np.sum(values))
-        hist.sum_squares = float(np.sum(values**2))
-
         # Drop the start of the first bin
-        bin_edges = bin_edges[1:]
-
-        # Add bin edges and counts
-        for edge in bin_edges:
-            hist.bucket_limit.append(edge)
-        for c in counts:
-            hist.bucket.append(c)
+        hist = histogram_proto(np.min(values), np.max(values), values.size,
+                               np.sum(values), np.sum(values.astype(np.float64)**2),
+                               bin_edges[1:], counts)
 
         # Create and write Summary
-        summary = tf.compat.v1.Summary(value=[tf.compat.v1.Summary.Value(tag=tag, histo=hist)])
-        self.writer.add_summary(summary, step)
-        self.writer.flush()
+        self.add_histogram_proto(tag, hist, step)
+
+
+    def add_histogram_proto(self, tag, hist, step):
+        """Log a histogram already encoded (see histogram_proto)."""
+        self._add_event(_event(step, [_summary_value(tag, histo=hist)]))
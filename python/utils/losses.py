@@ -10,53 +10,110 @@ Created on Wed Fev 27 18:37:58 2019
 import math
 import torch
 
-import numpy as np
 import torch.nn as nn
-import matplotlib.pyplot as plt
 
 #from PIL import Image
-from torch.autograd import Variable
 
 
-class DiceLoss(nn.Module):
+class FusedDiceLoss(nn.Module):
     '''
-    Dice Loss (Ignore background - channel 0)
+    Fused multi-class Dice Loss.
+
+    Intersections and unions of all classes are computed in a single reduction
+    over the spatial dimensions (B x C), without per-class copies.
 
     Arguments:
+        @param weights: list of class weights - weighted sum of the per-class
+            Dice of the first len(weights) classes. If None, the Dice is computed
+            over all pooled classes.
+        @param background: include channel 0 when weights is None
+        @param per_image: compute the Dice per image and average over the batch
+            (default: global Dice of the batch)
+        @param ignore_index: channel of the (one-hot) ground truth with pixels to
+            ignore, e.g. VOC void (default: None)
+        @param logits: predictions are raw logits - the softmax is fused here
+            (computed in float32)
         @param prediction: tensor with predictions classes
         @param groundtruth: tensor with ground truth mask
+        @param mask: (optional) tensor with valid pixels (B x H x W)
     '''
 
-    def __init__(self, background=False):
-        super(DiceLoss, self).__init__()
+    def __init__(self, weights=None, background=False, per_image=False, ignore_index=None,
+                        logits=False):
+        super(FusedDiceLoss, self).__init__()
 
         self.SMOOTH = 0.0001
+        self.weights = weights
         self.background = background
+        self.per_image = per_image
+        self.ignore_index = ignore_index
+        self.logits = logits
 
-    def forward (self, pred, gt):
+    def forward (self, pred, gt, mask=None):
 
-        nclasses = gt.size()[1]
+        bs, nclasses = gt.shape[:2]
 
-        if (self.background):
-            prediction = pred.contiguous()
-            groundtruth = gt.contiguous()
-        else:
-            prediction = pred[:,1:,...].contiguous()
-            groundtruth = gt[:,1:,...].contiguous()
+        # Fused softmax over classes
+        if self.logits:
+            pred = torch.softmax(pred.float(), dim=1)
 
-        iflat = prediction.view(-1)
-        tflat = groundtruth.view(-1)
+        # Valid pixels mask (B x 1 x N)
+        if self.ignore_index is not None:
+            valid = 1. - gt[:,self.ignore_index,...]
+            mask = valid if mask is None else mask * valid
+        if mask is not None:
+            mask = mask.reshape(bs, 1, -1)
 
-        intersection = (iflat * tflat).sum()
-        union = iflat.sum() + tflat.sum()
+        # Reductions in float32 (predictions may come from autocast)
+        iflat = pred.reshape(bs, nclasses, -1).float()
+        tflat = gt.reshape(bs, nclasses, -1).float()
 
-        dsc = ((2. * intersection + self.SMOOTH) / (union + self.SMOOTH))
+        # Intersection and union per image and class (B x C)
+        if mask is None:
+            intersection = (iflat * tflat).sum(dim=2)
+            union = iflat.sum(dim=2) + tflat.sum(dim=2)
+        else:
+            intersection = (iflat * tflat * mask).sum(dim=2)
+            union = (iflat * mask).sum(dim=2) + (tflat * mask).sum(dim=2)
+
+        # Global aggregation (1 x C)
+        if not self.per_image:
+            intersection = intersection.sum(dim=0, keepdim=True)
+            union = union.sum(dim=0, keepdim=True)
+
+        if self.weights is None:
+            # Pooled classes
+            first = 0 if self.background else 1
+            intersection = intersection[:,first:].sum(dim=1)
+            union = union[:,first:].sum(dim=1)
+            dsc = (2. * intersection + self.SMOOTH) / (union + self.SMOOTH)
+        else:
+            # Weighted sum of each class
+            nw = len(self.weights)
+            w = torch.tensor(self.weights, dtype=intersection.dtype, device=intersection.device)
+            dsc_classes = (2. * intersection[:,:nw] + self.SMOOTH) / (union[:,:nw] + self.SMOOTH)
+            dsc = (dsc_classes * w).sum(dim=1)
 
-        loss_dsc = 1. - dsc
+        loss_dsc = 1. - dsc.mean()
 
         return loss_dsc
 
 
+class DiceLoss(FusedDiceLoss):
+    '''
+    Dice Loss (Ignore background - channel 0)
+
+    Arguments:
+        @param prediction: tensor with predictions classes
+        @param groundtruth: tensor with ground truth mask
+    '''
+
+    def __init__(self, background=False, per_image=False, ignore_index=None, logits=False):
+        super(DiceLoss, self).__init__(weights=None, background=background,
+                                       per_image=per_image, ignore_index=ignore_index,
+                                       logits=logits)
+
+
 class DiceCoefficients(nn.Module):
 
     def __init__(self):
@@ -85,7 +142,45 @@ class DiceCoefficients(nn.Module):
         return dsc
 
 
-class WeightedDiceLoss(nn.Module):
+class BatchDiceCoefficients(nn.Module):
+    '''
+    Per-image and per-class Dice (or IoU) scores of a batch.
+
+    Arguments:
+        @param mode: 'dice' or 'iou'
+        @param prediction: tensor with predictions classes (B x C x H x W)
+        @param groundtruth: tensor with ground truth mask (B x C x H x W)
+
+    Returns: tensor of scores (B x C)
+    '''
+
+    def __init__(self, mode='dice'):
+        super(BatchDiceCoefficients, self).__init__()
+
+        if mode not in ['dice', 'iou']:
+            raise ValueError("Mode must be 'dice' or 'iou'.")
+        self.mode = mode
+        self.SMOOTH = 0.0001
+
+    def forward (self, pred, target):
+
+        # Flatten spatial dimensions (views, no copies for contiguous inputs)
+        bs, nclasses = target.shape[:2]
+        iflat = pred.reshape(bs, nclasses, -1).float()
+        tflat = target.reshape(bs, nclasses, -1).float()
+
+        intersection = (iflat * tflat).sum(dim=2)
+        union = iflat.sum(dim=2) + tflat.sum(dim=2)
+
+        if self.mode == 'iou':
+            scores = (intersection + self.SMOOTH) / (union - intersection + self.SMOOTH)
+        else:
+            scores = (2. * intersection + self.SMOOTH) / (union + self.SMOOTH)
+
+        return scores
+
+
+class WeightedDiceLoss(FusedDiceLoss):
     '''
     Weighted Dice Loss
 
@@ -94,31 +189,112 @@ class WeightedDiceLoss(nn.Module):
         @param groundtruth: tensor with ground truth mask
     '''
 
-    def __init__(self, w=[.2,.4,.4]):
-        super(WeightedDiceLoss, self).__init__()
-        self.weights = w
+    def __init__(self, w=[.2,.4,.4], per_image=False, ignore_index=None, logits=False):
+        super(WeightedDiceLoss, self).__init__(weights=w, per_image=per_image,
+                                               ignore_index=ignore_index, logits=logits)
 
 
-    def forward (self, pred, gt):
+class SampledLoss(nn.Module):
+    '''
+    Evaluate a segmentation loss on a subset of pixels of each image.
 
-        SMOOTH = 0.0001
+    The sampled pixels of each image are gathered into a (B x C x S x 1)
+    tensor, so any loss that reduces over the spatial dimensions (Dice losses,
+    cross entropy) can be wrapped and its cost scales with S instead of H x W.
 
-        dsc = 0
+    Arguments:
+        @param loss: loss function to be wrapped
+        @param samples: number of pixels per image (int) or fraction of the
+            pixels (float <= 1)
+        @param mode: 'random', 'stratified' (balanced over ground truth classes)
+            or 'uncertainty' (oversampled candidates with the lowest margin
+            between the two highest scores)
+        @param oversample: candidates per sample in 'uncertainty' mode
+        @param importance: fraction of uncertain samples in 'uncertainty' mode,
+            the remaining ones are random
+        @param prediction: tensor with predictions classes (B x C x H x W)
+        @param groundtruth: tensor with ground truth (B x C x H x W or B x H x W)
+    '''
 
-        for i in range(len(self.weights)):
+    def __init__(self, loss, samples=4096, mode='stratified', oversample=3, importance=0.75):
+        super(SampledLoss, self).__init__()
 
-            prediction = pred[:,i,...].contiguous()
-            groundtruth = gt[:,i,...].contiguous()
+        if mode not in ['random', 'stratified', 'uncertainty']:
+            raise ValueError("Sampling mode must be 'random', 'stratified' or 'uncertainty'.")
+        self.loss = loss
+        self.samples = samples
+        self.mode = mode
+        self.oversample = oversample
+        self.importance = importance
 
-            iflat = prediction.view(-1)
-            tflat = groundtruth.view(-1)
+    def _n_samples(self, n_loc):
+        '''
+            Number of samples per image.
+        '''
+        if type(self.samples) is float and self.samples <= 1.:
+            return max(1, int(self.samples * n_loc))
+        return min(int(self.samples), n_loc)
 
-            intersection = (iflat * tflat).sum()
-            union = iflat.sum() + tflat.sum()
-            dsc += self.weights[i] * ((2. * intersection + SMOOTH) / (union + SMOOTH))
+    def _sample(self, pred, gt, n_samples):
+        '''
+            Indexes of the sampled pixels (B x S).
+        '''
+        bs, n_loc = pred.shape[0], pred.shape[2]
+        device = pred.device
+
+        if self.mode == 'stratified':
+            # Class of each pixel and number of pixels of each class
+            if gt.dim() == 3:
+                counts = gt.sum(dim=2)
+                labels = gt.argmax(dim=1)
+            else:
+                labels = gt.long()
+                counts = torch.zeros(bs, int(labels.max().item()) + 1, device=device)
+                counts.scatter_add_(1, labels, torch.ones_like(labels, dtype=counts.dtype))
+            # Inverse class frequency weights of each pixel
+            weights = 1. / counts.gather(1, labels).float().clamp(min=1)
+            return torch.multinomial(weights, n_samples, replacement=True)
+
+        if self.mode == 'uncertainty':
+            n_unc = int(self.importance * n_samples)
+            candidates = torch.randint(0, n_loc, (bs, self.oversample * n_unc), device=device)
+            scores = pred.gather(2, candidates.unsqueeze(1).expand(-1, pred.shape[1], -1))
+            top2 = scores.topk(2, dim=1).values
+            uncertainty = top2[:,1] - top2[:,0]
+            idx_unc = candidates.gather(1, uncertainty.topk(n_unc, dim=1).indices)
+            idx_rand = torch.randint(0, n_loc, (bs, n_samples - n_unc), device=device)
+            return torch.cat((idx_unc, idx_rand), dim=1)
+
+        return torch.randint(0, n_loc, (bs, n_samples), device=device)
 
-        loss_dsc = 1. - dsc
-        return loss_dsc
+    def forward (self, pred, gt):
+
+        bs, nclasses = pred.shape[:2]
+        pred_flat = pred.reshape(bs, nclasses, -1)
+        n_loc = pred_flat.shape[2]
+        n_samples = self._n_samples(n_loc)
+
+        # One-hot ground truth is flattened as the prediction
+        if gt.dim() == pred.dim():
+            gt_flat = gt.reshape(bs, gt.shape[1], -1)
+        else:
+            gt_flat = gt.reshape(bs, -1)
+
+        # Select pixels (no gradient)
+        with torch.no_grad():
+            idx = self._sample(pred_flat.detach(), gt_flat, n_samples)
+
+        # Gather samples as images of S x 1 pixels
+        pred_s = pred_flat.gather(2, idx.unsqueeze(1).expand(-1, nclasses, -1)).unsqueeze(3)
+        if gt_flat.dim() == 3:
+            gt_s = gt_flat.gather(2, idx.unsqueeze(1).expand(-1, gt_flat.shape[1], -1)).unsqueeze(3)
+        else:
+            gt_s = gt_flat.gather(1, idx).unsqueeze(2)
+
+        return self.loss(pred_s, gt_s)
+
+    def __repr__(self):
+        return self.__class__.__name__ + '({0}, samples={1}, mode={2})'.format(self.loss, self.samples, self.mode)
 
 
 class MultiTaskDictLoss(nn.Module):
@@ -153,156 +329,140 @@ class DiscriminativeLoss(nn.Module):
         self.beta = beta
         self.gamma = gamma
 
-    def _plot(self, mean, data):
+    def _plot(self, means, data, labels):
         '''
             Plot a scatter chart (print as png)
         '''
-        COLOR = ['b', 'g', 'r', 'c', 'm', 'y', 'k', 'w']
+        # Loaded only when plotting (slow import)
+        import matplotlib.pyplot as plt
 
-        nf, pos, c = data.shape
-
-        mean_np = mean
-        mean_np = mean_np.detach().numpy()
+        COLOR = ['b', 'g', 'r', 'c', 'm', 'y', 'k', 'w']
 
-        data_np = data
-        data_np = data_np.detach().numpy()
+        means_np = means.detach().cpu().numpy()     # n_instances x n_features
+        data_np = data.detach().cpu().numpy()       # n_loc x n_features
+        labels_np = labels.cpu().numpy()            # n_loc
 
         area_ext = (math.pi * self.delta_d)**2
         area_int = (math.pi * self.delta_v)**2
 
-        for i in range(1,c):
-            plt.scatter(data_np[0,:,i], data_np[1,:,i], c=COLOR[i], marker='.')
-            plt.scatter(mean_np[0,i], mean_np[1,i], c=COLOR[i], marker='X')
+        for i in range(1, len(means_np)):
+            color = COLOR[i % len(COLOR)]
+            inst = labels_np == i
+            plt.scatter(data_np[inst,0], data_np[inst,1], c=color, marker='.')
+            plt.scatter(means_np[i,0], means_np[i,1], c=color, marker='X')
 
-            plt.scatter(mean_np[0,i], mean_np[1,i], c='#555555', s=area_ext, alpha=0.1)
-            plt.scatter(mean_np[0,i], mean_np[1,i], c='#000000', s=area_int, alpha=0.1)
+            plt.scatter(means_np[i,0], means_np[i,1], c='#555555', s=area_ext, alpha=0.1)
+            plt.scatter(means_np[i,0], means_np[i,1], c='#000000', s=area_int, alpha=0.1)
 
         plt.savefig('cluster/cluster_map.png')
         plt.close()
 
-    def _sort_instances(self, pred, gt):
+    def _sort_instances(self, target):
+        '''
+            Map every pixel of the batch to a segment (image, instance).
 
-        # Get unic labesl from 0 to max (n_instances-1)
-        unique_labels = torch.unique(gt, sorted=True) # instances labels (including background = 0)
-        # Get data dimensions
-        n_instances = len(unique_labels)
-        n_filters, n_loc = pred.size()
-        # Reshape and expand (repeat) to the number of instances
-        pred_repeated = pred.unsqueeze(2).expand(n_filters, n_loc, n_instances).contiguous()  # n_filters, n_loc, n_instances
+            Segments are sorted by image, so the instances of each image are
+            contiguous (per-image offsets).
 
-        # Mask with instances, each depth is a instance
-        imasks = torch.zeros(n_loc, n_instances)
-        for i in range(n_instances):
-            imasks[...,i] = torch.where(gt == unique_labels[i], torch.ones(gt.shape), torch.zeros(gt.shape))
-        # Reshape and expand (repeat) to the number of features
-        imasks.unsqueeze_(0) # 1, n_loc, n_instances
+            Returns: segment of each pixel (B*N), image of each segment (S)
+        '''
+        batch_size = target.shape[0]
+        labels = target.reshape(batch_size, -1).long()
+        # Unique key for each (image, instance label) pair
+        n_labels = int(labels.max().item()) + 1
+        offsets = n_labels * torch.arange(batch_size, device=labels.device).unsqueeze(1)
+        seg_keys, seg_idx = torch.unique((labels + offsets).view(-1), sorted=True, return_inverse=True)
+        seg_img = seg_keys // n_labels
 
-        return pred_repeated, imasks, n_instances
+        return seg_idx, seg_img
 
 
-    def _variance_term(self, mu, x, gt):
+    def _variance_term(self, x, means, seg_idx, seg_img, counts, n_inst):
         ''' l_var  - intra-cluster distance '''
 
-        # Count pixels of each instance
-        counts = torch.sum(gt, dim=1)
-        _, C = counts.shape # number of clusterss
-
-        # Mean of the instance at each expected position for that instance
-        mu_expand = mu.unsqueeze_(1).expand(x.shape) * gt
+        batch_size = len(n_inst)
 
-        # Calculate intra distance
-        diff = torch.norm(mu_expand - x, dim=0)
+        # Distance of each pixel to the mean of its instance
+        diff = torch.norm(x - means[seg_idx], dim=1)
         distance = torch.clamp(diff - self.delta_v, 0., 100000.)**2
 
+        # Total distance of each image, weighted by the inverse of the size of
+        # each of its instances (same weighting of the former dense version)
+        dist_img = distance.view(batch_size, -1).sum(dim=1)
+        inv_counts = x.new_zeros(batch_size).index_add_(0, seg_img, 1. / counts)
+
         # variance
-        l_var = torch.sum(torch.div(torch.sum(distance), counts)) / C
+        l_var = dist_img * inv_counts / n_inst
 
         return l_var
 
 
-    def _distance_term(self, mu):
+    def _distance_term(self, means, seg_img, n_inst):
         ''' l_dist - inter-cluster distance'''
 
-        # number features and number of clusterss
-        nf, _, C = mu.shape
+        batch_size = len(n_inst)
+        n_segs = len(seg_img)
 
-        # Prepare data - meshgrid
-        means = mu.reshape(nf,C).permute(1, 0)
-        means_1 = means.unsqueeze(1).expand(C, C, nf)
-        means_2 = means_1.permute(1, 0, 2)
+        # Pairs of different instances from the same image (n_segs x n_segs)
+        same_img = seg_img.unsqueeze(0) == seg_img.unsqueeze(1)
+        same_img = same_img & ~torch.eye(n_segs, dtype=torch.bool, device=seg_img.device)
+        idx_a, idx_b = same_img.nonzero(as_tuple=True)
 
         # Calculate norm of distance
-        diff = means_1 - means_2
-        norm = torch.norm(diff, dim=2)
-        margin = Variable(2 * self.delta_d * (1.0 - torch.eye(C))) # cluster radius
+        norm = torch.norm(means[idx_a] - means[idx_b], dim=1)
+        hinge = torch.clamp(2 * self.delta_d - norm, 0., 100000.)**2
 
-        # calculate distance term
-        l_dist = torch.sum(torch.clamp(margin - norm, 0., 100000.)**2) / (C*(C-1))
+        # calculate distance term (images with a single instance have no pairs)
+        dist_img = means.new_zeros(batch_size).index_add_(0, seg_img[idx_a], hinge)
+        l_dist = dist_img / torch.clamp(n_inst * (n_inst - 1), min=1)
 
         return l_dist
 
 
-    def _regularization_term(self, mu, num_instances):
+    def _regularization_term(self, means, seg_img, n_inst):
         ''' l_reg - regularization term '''
 
-        l_reg = (torch.norm(mu, dim=0) / num_instances).sum()
+        batch_size = len(n_inst)
+
+        norm = torch.norm(means, dim=1)
+        l_reg = means.new_zeros(batch_size).index_add_(0, seg_img, norm) / n_inst
 
         return l_reg
 
 
-    def _discriminative_loss(self, pred, tgt, plot):
-        '''
-            Calculate discriminative loss function (l_var, l_dist, l_reg).
-        '''
+    def forward(self, prediction, target, plot=False):
 
-        # Adjust data - CHECK IF NECESSARY
-        correct_label = tgt.unsqueeze_(0).view(1, self.height * self.width)
-        correct_label.long()
+        batch_size, height, width = target.shape
+        n_loc = height * width
 
-        # Prediction
-        reshaped_pred = pred.reshape(self.n_features, self.height*self.width).contiguous()
+        # Pixels of the whole batch as rows: (B*N) x n_features
+        x = prediction.reshape(batch_size, self.n_features, n_loc).permute(0, 2, 1)
+        x = x.reshape(batch_size * n_loc, self.n_features)
 
-        # Count instances
-        pred_repeated, unique_id, num_instances = self._sort_instances(reshaped_pred, correct_label)
+        # Segments (instances of each image)
+        seg_idx, seg_img = self._sort_instances(target.to(prediction.device))
+        n_segs = len(seg_img)
+        n_inst = torch.bincount(seg_img, minlength=batch_size).to(x.dtype)
 
-        # Calculate correspondence map of prediction
-        pred_masked = pred_repeated * unique_id
-        # Calculate means
-        means = torch.div(pred_masked.sum(1), unique_id.sum(1))
+        # Means of each instance (segment reduction)
+        counts = torch.bincount(seg_idx, minlength=n_segs).to(x.dtype)
+        sums = x.new_zeros(n_segs, self.n_features).index_add_(0, seg_idx, x)
+        means = sums / counts.unsqueeze(1)
 
         if plot:
-            self._plot(means, pred_masked)
+            # Last image of the batch
+            first = int((seg_img < batch_size - 1).sum().item())
+            self._plot(means[first:], x[-n_loc:], seg_idx[-n_loc:] - first)
 
         # Variance term
-        l_var = self._variance_term(means, pred_masked, unique_id)
+        l_var = self._variance_term(x, means, seg_idx, seg_img, counts, n_inst)
         # Distance term
-        l_dist = self._distance_term(means)
+        l_dist = self._distance_term(means, seg_img, n_inst)
         # Regularization term
-        l_reg = self._regularization_term(means, num_instances)
+        l_reg = self._regularization_term(means, seg_img, n_inst)
 
-        # Loss
+        # Loss (average of the batch)
         loss = self.alpha * l_var + self.beta *  l_dist + self.gamma * l_reg
-        #print(loss)
-
-        return loss, l_var, l_dist, l_reg
-
-
-    def forward(self, prediction, target, plot=False):
-
-        # Adjust data - CHECK IF NECESSARY
-        batch_size, self.height, self.width = target.shape
-
-        loss_list = []
-
-        for i in range(batch_size):
-
-            pred = prediction[i,...].contiguous()
-            tgt = target[i,...].contiguous()
-
-            loss, l_var, l_dist, l_reg = self._discriminative_loss(pred, tgt, plot)
-
-            loss_list.append(loss / batch_size)
-
-        out_loss = torch.sum(torch.stack(loss_list))
+        out_loss = loss.mean()
 
         return  out_loss
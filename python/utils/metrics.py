@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:12:40 2026
+
+@author: Diego Wanderley
+@python: 3.6
+@description: Evaluation metrics (streaming confusion matrix, instances and
+    surface distances)
+"""
+
+import os
+import torch
+import hashlib
+
+import numpy as np
+
+# scipy is imported where it is used (slow import, evaluation only)
+
+
+def confusion_scores(cm, smooth=0.0001):
+    '''
+    Dice, IoU, precision and recall from confusion matrices.
+
+    Arguments:
+        @param cm: tensor (... x C x C) with ground truth in the rows and
+            predictions in the columns
+        @param smooth: smooth value (same used by the Dice losses)
+
+    Returns: dict of tensors (... x C)
+    '''
+    tp = torch.diagonal(cm, dim1=-2, dim2=-1)
+    fp = cm.sum(dim=-2) - tp
+    fn = cm.sum(dim=-1) - tp
+
+    scores = {
+        'dice': (2. * tp + smooth) / (2. * tp + fp + fn + smooth),
+        'iou': (tp + smooth) / (tp + fp + fn + smooth),
+        'precision': (tp + smooth) / (tp + fp + smooth),
+        'recall': (tp + smooth) / (tp + fn + smooth)
+    }
+
+    return scores
+
+
+def merge_classes(cm, groups):
+    '''
+    Binary (group vs rest) confusion matrices of groups of classes.
+
+    Arguments:
+        @param cm: tensor (... x C x C)
+        @param groups: list of lists of classes, e.g. [[1, 2]] for ovary
+
+    Returns: tensor (... x G x 2 x 2), index 1 is the group
+    '''
+    n_classes = cm.shape[-1]
+    merged = []
+    for group in groups:
+        sel = torch.zeros(n_classes, dtype=torch.bool, device=cm.device)
+        sel[list(group)] = True
+        tp = cm[..., sel, :][..., :, sel].sum(dim=(-2, -1))
+        fn = cm[..., sel, :][..., :, ~sel].sum(dim=(-2, -1))
+        fp = cm[..., ~sel, :][..., :, sel].sum(dim=(-2, -1))
+        tn = cm[..., ~sel, :][..., :, ~sel].sum(dim=(-2, -1))
+        merged.append(torch.stack((torch.stack((tn, fp), dim=-1),
+                                   torch.stack((fn, tp), dim=-1)), dim=-2))
+
+    return torch.stack(merged, dim=-3)
+
+
+class ConfusionMatrix():
+    '''
+    Streaming confusion matrix evaluator.
+
+    The confusion matrix is kept on the device and updated with a single
+    bincount per batch, so the predictions do not need to be stored.
+
+    Arguments:
+        @param n_classes: number of classes
+        @param ignore_index: ground truth class to ignore, e.g. VOC void (default: None)
+        @param per_image: keep one confusion matrix per image (default: True)
+        @param device: device of the confusion matrix
+    '''
+
+    def __init__(self, n_classes, ignore_index=None, per_image=True, device='cpu'):
+        self.n_classes = n_classes
+        self.ignore_index = ignore_index
+        self.per_image = per_image
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        '''
+            Clear accumulated values.
+        '''
+        self.cm = torch.zeros(self.n_classes, self.n_classes, dtype=torch.long, device=self.device)
+        self.image_cm = []
+        self.names = []
+
+    def update(self, pred, gt, valid=None, names=None):
+        '''
+            Update confusion matrix with a batch.
+
+            Arguments:
+                @param pred: predictions (B x C x H x W scores or B x H x W labels)
+                @param gt: ground truth (B x C x H x W one-hot or B x H x W labels)
+                @param valid: (optional) valid pixels (B x H x W), e.g. no padding
+                @param names: (optional) list of image names
+
+            Pixels with labels out of [0, n_classes) are not counted.
+        '''
+        if pred.dim() == 4:
+            pred = pred.argmax(dim=1)
+        if gt.dim() == 4:
+            gt = gt.argmax(dim=1)
+        pred = pred.to(self.device).long()
+        gt = gt.to(self.device).long()
+
+        bs = gt.shape[0]
+        n = self.n_classes
+        pred = pred.reshape(bs, -1)
+        gt = gt.reshape(bs, -1)
+
+        # Valid pixels (labels out of range would index other images)
+        keep = (gt >= 0) & (gt < n) & (pred >= 0) & (pred < n)
+        if self.ignore_index is not None:
+            keep = keep & (gt != self.ignore_index)
+        if valid is not None:
+            keep = keep & valid.to(self.device).reshape(bs, -1).bool()
+
+        # One bincount for the whole batch: (image, gt, pred)
+        image_idx = torch.arange(bs, device=self.device).unsqueeze(1)
+        idx = image_idx * n * n + gt * n + pred
+        counts = torch.bincount(idx[keep], minlength=bs * n * n).view(bs, n, n)
+
+        self.cm += counts.sum(dim=0)
+        if self.per_image:
+            self.image_cm.append(counts)
+            if names is not None:
+                self.names += list(names)
+
+    def compute(self, groups=None):
+        '''
+            Compute global and per image scores.
+
+            Arguments:
+                @param groups: (optional) list of lists of classes to be
+                    evaluated as a single class, e.g. [[1, 2]] (ovary)
+
+            Returns: dict with 'global' and 'per_image' scores (dicts of
+                tensors on CPU) and image names
+        '''
+        cm = self.cm.double()
+        results = {'global': confusion_scores(cm)}
+        if groups is not None:
+            results['global_groups'] = confusion_scores(merge_classes(cm, groups))
+
+        if self.per_image and len(self.image_cm) > 0:
+            image_cm = torch.cat(self.image_cm, dim=0).double()
+            results['per_image'] = confusion_scores(image_cm)
+            if groups is not None:
+                results['per_image_groups'] = confusion_scores(merge_classes(image_cm, groups))
+        results['names'] = self.names
+
+        # Results to host
+        for key in results:
+            if type(results[key]) is dict:
+                results[key] = {k: v.cpu() for k, v in results[key].items()}
+
+        return results
+
+
+def instance_iou(pred_labels, gt_labels, n_pred, n_gt):
+    '''
+    IoU matrix between instances of two label maps, from their co-occurrence
+    counts (a single bincount, no per-pair mask comparisons).
+
+    Arguments:
+        @param pred_labels: predicted label map (0 is background)
+        @param gt_labels: ground truth label map (0 is background)
+        @param n_pred: number of predicted instances
+        @param n_gt: number of ground truth instances
+
+    Returns: iou (n_gt x n_pred), intersection (n_gt x n_pred),
+        areas of gt instances (n_gt), areas of predicted instances (n_pred)
+    '''
+    joint = np.bincount(gt_labels.ravel() * (n_pred + 1) + pred_labels.ravel(),
+                        minlength=(n_gt + 1) * (n_pred + 1)).reshape(n_gt + 1, n_pred + 1)
+    area_gt = joint.sum(axis=1)[1:]
+    area_pred = joint.sum(axis=0)[1:]
+    inter = joint[1:, 1:]
+    union = area_gt[:, None] + area_pred[None, :] - inter
+    iou = inter / np.maximum(union, 1)
+
+    return iou, inter, area_gt, area_pred
+
+
+class InstanceMatcher():
+    '''
+    Instance level (follicle) detection evaluator.
+
+    Predicted instances are the connected components of the predicted class,
+    matched to the ground truth instances by optimal assignment on the IoU.
+
+    Arguments:
+        @param channel: class channel of the instances (default: 2 - follicles)
+        @param iou_threshold: minimum IoU of a match (default: 0.5)
+        @param min_size: predicted instances smaller than this are ignored (default: 0)
+    '''
+
+    def __init__(self, channel=2, iou_threshold=0.5, min_size=0):
+        self.channel = channel
+        self.iou_threshold = iou_threshold
+        self.min_size = min_size
+        self.reset()
+
+    def reset(self):
+        '''
+            Clear accumulated values.
+        '''
+        self.rows = []
+
+    def _match(self, pred_mask, gt_mask):
+        '''
+            Match instances of a single image.
+        '''
+        from scipy import ndimage as ndi
+        from scipy.optimize import linear_sum_assignment
+
+        pred_labels, n_pred = ndi.label(pred_mask)
+        gt_labels, n_gt = ndi.label(gt_mask)
+
+        iou, inter, area_gt, area_pred = instance_iou(pred_labels, gt_labels, n_pred, n_gt)
+
+        # Remove small predicted instances
+        if self.min_size > 0:
+            keep = area_pred >= self.min_size
+            iou, inter, area_pred = iou[:, keep], inter[:, keep], area_pred[keep]
+            n_pred = int(keep.sum())
+
+        # Optimal assignment
+        dsc = np.zeros(n_gt)
+        tp = 0
+        if n_gt > 0 and n_pred > 0:
+            gt_idx, pred_idx = linear_sum_assignment(-iou)
+            matched = iou[gt_idx, pred_idx] >= self.iou_threshold
+            gt_idx, pred_idx = gt_idx[matched], pred_idx[matched]
+            tp = len(gt_idx)
+            dsc[gt_idx] = 2. * inter[gt_idx, pred_idx] / (area_gt[gt_idx] + area_pred[pred_idx])
+
+        return {
+            'n_gt': n_gt,
+            'n_pred': n_pred,
+            'matched': tp,
+            'missed': n_gt - tp,
+            'false': n_pred - tp,
+            'dice_matched': dsc[dsc > 0].mean() if tp > 0 else 0.,
+            'dice_instances': dsc.mean() if n_gt > 0 else float(n_pred == 0)
+        }
+
+    def update(self, pred, gt, names=None):
+        '''
+            Update with a batch.
+
+            Arguments:
+                @param pred: predictions (B x C x H x W scores or B x H x W labels)
+                @param gt: ground truth (B x C x H x W one-hot or B x H x W labels)
+                @param names: (optional) list of image names
+        '''
+        if pred.dim() == 4:
+            pred = pred.argmax(dim=1)
+        if gt.dim() == 4:
+            gt = gt.argmax(dim=1)
+        # Single transfer per batch
+        pred_np = (pred == self.channel).cpu().numpy()
+        gt_np = (gt == self.channel).cpu().numpy()
+
+        for i in range(len(pred_np)):
+            row = self._match(pred_np[i], gt_np[i])
+            row['name'] = names[i] if names is not None else str(len(self.rows))
+            self.rows.append(row)
+
+    def compute(self):
+        '''
+            Compute dataset level detection scores.
+
+            Returns: dict with totals, precision, recall, f1 and mean instance Dice.
+        '''
+        matched = sum(r['matched'] for r in self.rows)
+        n_gt = sum(r['n_gt'] for r in self.rows)
+        n_pred = sum(r['n_pred'] for r in self.rows)
+        precision = matched / n_pred if n_pred > 0 else 0.
+        recall = matched / n_gt if n_gt > 0 else 0.
+        f1 = 2 * precision * recall / (precision + recall) if matched > 0 else 0.
+        n_images = max(len(self.rows), 1)
+
+        return {
+            'n_gt': n_gt,
+            'n_pred': n_pred,
+            'matched': matched,
+            'missed': n_gt - matched,
+            'false': n_pred - matched,
+            'precision': precision,
+            'recall': recall,
+            'f1': f1,
+            'dice_instances': sum(r['dice_instances'] for r in self.rows) / n_images,
+            'per_image': self.rows
+        }
+
+
+def mask_boundary(mask):
+    '''
+    Boundary pixels of a binary mask (mask minus its erosion).
+    '''
+    from scipy import ndimage as ndi
+
+    mask = mask.astype(bool)
+    return mask & ~ndi.binary_erosion(mask, border_value=0)
+
+
+class SurfaceDistance():
+    '''
+    Boundary distance metrics: Hausdorff (percentile) and average symmetric
+    surface distance.
+
+    The distance transforms of the ground truth boundaries are cached per image
+    (in memory and, optionally, on disk across evaluation runs), so each new
+    checkpoint only computes the transform of its own predicted boundaries.
+    Cache entries are keyed by the ground truth boundary content and the pixel
+    spacing, so an edited annotation or a new spacing is never served stale.
+
+    Arguments:
+        @param structures: dict of structure name and list of classes, e.g.
+            {'ovary': [1, 2], 'follicles': [2]}
+        @param cache_dir: (optional) folder to store the ground truth distance maps
+        @param percentile: Hausdorff distance percentile (default: 95)
+        @param spacing: (optional) pixel spacing
+    '''
+
+    def __init__(self, structures={'ovary': [1, 2], 'follicles': [2]},
+                cache_dir=None, percentile=95, spacing=None):
+        self.structures = structures
+        self.cache_dir = cache_dir
+        self.percentile = percentile
+        self.spacing = spacing
+        self._cache = {}
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.reset()
+
+    def reset(self):
+        '''
+            Clear accumulated values (cached distance maps are kept).
+        '''
+        self.rows = []
+
+    def _gt_distance(self, name, structure, gt_border):
+        '''
+            Distance map to the ground truth boundary (cached).
+        '''
+        # Ground truth content and spacing in the key (stale maps are not reused)
+        digest = hashlib.sha1(str(gt_border.shape).encode('utf-8'))
+        digest.update(np.packbits(gt_border).tobytes())
+        digest.update(str(self.spacing).encode('utf-8'))
+        key = name + '_' + structure + '_' + digest.hexdigest()[:16]
+        if key in self._cache:
+            return self._cache[key]
+
+        path = None
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir, key + '.npy')
+            if os.path.exists(path):
+                dist = np.load(path)
+                self._cache[key] = dist
+                return dist
+
+        from scipy import ndimage as ndi
+        dist = ndi.distance_transform_edt(~gt_border, sampling=self.spacing).astype(np.float32)
+        self._cache[key] = dist
+        if path is not None:
+            np.save(path, dist)
+
+        return dist
+
+    def _distances(self, name, structure, pred_mask, gt_mask):
+        '''
+            Hausdorff and average surface distance of a single structure.
+        '''
+        from scipy import ndimage as ndi
+
+        pred_border = mask_boundary(pred_mask)
+        gt_border = mask_boundary(gt_mask)
+        if not pred_border.any() or not gt_border.any():
+            return float('nan'), float('nan')
+
+        # Prediction to ground truth (cached transform)
+        dist_gt = self._gt_distance(name, structure, gt_border)
+        d_pred_gt = dist_gt[pred_border]
+        # Ground truth to prediction
+        dist_pred = ndi.distance_transform_edt(~pred_border, sampling=self.spacing)
+        d_gt_pred = dist_pred[gt_border]
+
+        # Largest of the directed (percentile) Hausdorff distances
+        hd = max(np.percentile(d_pred_gt, self.percentile),
+                 np.percentile(d_gt_pred, self.percentile))
+        asd = (d_pred_gt.mean() + d_gt_pred.mean()) / 2.
+
+        return float(hd), float(asd)
+
+    def update(self, pred, gt, names):
+        '''
+            Update with a batch.
+
+            Arguments:
+                @param pred: predictions (B x C x H x W scores or B x H x W labels)
+                @param gt: ground truth (B x C x H x W one-hot or B x H x W labels)
+                @param names: list of image names (cache keys)
+        '''
+        if pred.dim() == 4:
+            pred = pred.argmax(dim=1)
+        if gt.dim() == 4:
+            gt = gt.argmax(dim=1)
+        # Single transfer per batch
+        pred_np = pred.cpu().numpy()
+        gt_np = gt.cpu().numpy()
+
+        for i in range(len(pred_np)):
+            row = {'name': names[i]}
+            for structure, classes in self.structures.items():
+                hd, asd = self._distances(names[i], structure,
+                                          np.isin(pred_np[i], classes),
+                                          np.isin(gt_np[i], classes))
+                row['hd_' + structure] = hd
+                row['asd_' + structure] = asd
+            self.rows.append(row)
+
+    def compute(self):
+        '''
+            Mean distances over the images (undefined cases are ignored).
+
+            Returns: dict with mean values and per image rows.
+        '''
+        results = {'per_image': self.rows}
+        for structure in self.structures:
+            for m in ['hd_', 'asd_']:
+                values = np.array([r[m + structure] for r in self.rows], dtype=np.float64)
+                values = values[~np.isnan(values)]
+                results[m + structure] = values.mean() if len(values) > 0 else float('nan')
+
+        return results
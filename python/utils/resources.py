@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 11:03:52 2026
+
+@author: Diego Wanderley
+@python: 3.6 and Pytroch
+@description: CPU resources manager - partitions the cores between compute
+    threads and data loader workers
+"""
+
+import os
+import time
+import torch
+
+from torch.utils.data import DataLoader
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+
+# Environment variables read by OpenMP/BLAS runtimes (NumPy, SciPy, scikit-image)
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS']
+
+
+def available_cores():
+    '''
+        Cores available to this process (affinity mask when supported).
+    '''
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def set_affinity(cores):
+    '''
+        Pin the calling process (or thread group) to the given cores.
+    '''
+    if hasattr(os, 'sched_setaffinity') and len(cores) > 0:
+        os.sched_setaffinity(0, cores)
+
+
+class ResourceManager(object):
+    '''
+    Partition of the CPU cores between compute (PyTorch intra-op) threads and
+    data loader workers.
+
+    Compute threads use the first cores of the set and each loader worker is
+    pinned to its own core from the remaining ones (shared round-robin when
+    there are fewer cores than workers). Inside workers, PyTorch and the
+    OpenMP/BLAS runtimes are limited to worker_threads.
+
+    Arguments:
+        @param compute_threads: intra-op threads (None: cores not used by workers)
+        @param loader_workers: number of data loader workers
+        @param worker_threads: threads per loader worker
+        @param cores: list of cores to partition (None: all available cores)
+        @param pin: pin the main process and the workers to their cores
+    '''
+
+    def __init__(self, compute_threads=None, loader_workers=0, worker_threads=1,
+                 cores=None, pin=False):
+        self.cores = list(cores) if cores is not None else available_cores()
+        n_cores = len(self.cores)
+        self.loader_workers = max(0, loader_workers)
+        self.worker_threads = max(1, worker_threads)
+        self.pin = pin
+
+        if compute_threads is None or compute_threads <= 0:
+            compute_threads = n_cores - self.loader_workers
+        self.compute_threads = min(max(1, compute_threads), n_cores)
+
+        # Partition
+        self.compute_cores = self.cores[:self.compute_threads]
+        spare_cores = self.cores[self.compute_threads:]
+        if len(spare_cores) == 0:
+            spare_cores = self.cores
+        self.worker_cores = [[spare_cores[w % len(spare_cores)]]
+                             for w in range(self.loader_workers)]
+
+    def apply(self):
+        '''
+            Set the compute threads (and affinity) of the current process.
+        '''
+        torch.set_num_threads(self.compute_threads)
+        if self.pin:
+            set_affinity(self.compute_cores)
+
+    def worker_init_fn(self, worker_id):
+        '''
+            Data loader worker initialization: pinning and thread limits.
+        '''
+        if self.pin:
+            set_affinity(self.worker_cores[worker_id % len(self.worker_cores)])
+        torch.set_num_threads(self.worker_threads)
+        # Runtimes already loaded (inherited) are limited with threadpoolctl,
+        # the variables cover the ones loaded later
+        for var in THREAD_ENV_VARS:
+            os.environ[var] = str(self.worker_threads)
+        if threadpool_limits is not None:
+            threadpool_limits(self.worker_threads)
+
+    def loader_kwargs(self, persistent=False):
+        '''
+            DataLoader arguments of this partition.
+
+            Arguments:
+                @param persistent: keep the workers alive across epochs (for
+                    a loader iterated every epoch, e.g. training)
+        '''
+        if self.loader_workers == 0:
+            return {'num_workers': 0}
+        kwargs = {'num_workers': self.loader_workers,
+                  'worker_init_fn': self.worker_init_fn}
+        if persistent:
+            kwargs['persistent_workers'] = True
+        return kwargs
+
+    def report(self):
+        '''
+            Print the resulting layout.
+        '''
+        print('--- CPU Resources ---')
+        print('cores:           {:d}'.format(len(self.cores)))
+        print('compute threads: {:d} (cores {:s})'.format(self.compute_threads,
+              _cores_str(self.compute_cores) if self.pin else 'not pinned'))
+        print('loader workers:  {:d} x {:d} thread(s)'.format(self.loader_workers, self.worker_threads))
+        for w, cores in enumerate(self.worker_cores):
+            print('  worker {:d}:      core {:s}'.format(w, _cores_str(cores) if self.pin else 'not pinned'))
+        print('---------------------')
+        print('')
+
+    @classmethod
+    def autotune(cls, dataset, step_fn, batch_size=4, n_batches=10, candidates=None,
+                 cores=None, worker_threads=1, pin=False, collate_fn=None):
+        '''
+            Measure the throughput of a few partitions and apply the best one.
+
+            Arguments:
+                @param dataset: dataset to be loaded
+                @param step_fn: function running one step on a loaded batch
+                @param batch_size: batch size
+                @param n_batches: timed batches per partition (after one warmup)
+                @param candidates: list of numbers of loader workers to try
+                    (None: 0, 1, 2, 4 and a quarter/half of the cores)
+                @param cores: list of cores to partition (None: all available cores)
+                @param worker_threads: threads per loader worker
+                @param pin: pin the main process and the workers to their cores
+                @param collate_fn: DataLoader collate function
+
+            Returns: best ResourceManager (already applied)
+        '''
+        cores = list(cores) if cores is not None else available_cores()
+        n_cores = len(cores)
+        if candidates is None:
+            candidates = sorted(set([0, 1, 2, 4, n_cores // 4, n_cores // 2]))
+        candidates = [w for w in candidates if 0 <= w < n_cores]
+
+        best, best_throughput = None, 0.
+        print('--- Resources autotune (images/s) ---')
+        for workers in candidates:
+            resources = cls(loader_workers=workers, worker_threads=worker_threads,
+                            cores=cores, pin=pin)
+            resources.apply()
+            data_loader = DataLoader(dataset, batch_size=batch_size, shuffle=True,
+                                     collate_fn=collate_fn, **resources.loader_kwargs())
+            n_images = 0
+            start = None
+            for batch_idx, sample in enumerate(data_loader):
+                if batch_idx == 1:
+                    start = time.perf_counter()
+                step_fn(sample)
+                if batch_idx >= 1:
+                    n_images += len(sample) if type(sample) is list else len(sample['image'])
+                if batch_idx == n_batches:
+                    break
+            del data_loader
+            if start is None or n_images == 0:
+                continue
+            throughput = n_images / (time.perf_counter() - start)
+            print('threads {:3d}, workers {:3d}: {:10.2f}'.format(resources.compute_threads,
+                                                                 workers, throughput))
+            if throughput > best_throughput:
+                best, best_throughput = resources, throughput
+        print('')
+
+        if best is None:
+            best = cls(cores=cores, worker_threads=worker_threads, pin=pin)
+        best.apply()
+        return best
+
+
+def _cores_str(cores):
+    ''' Compact list of cores (e.g. 0-7,16) '''
+    ranges = []
+    for c in cores:
+        if len(ranges) > 0 and c == ranges[-1][1] + 1:
+            ranges[-1][1] = c
+        else:
+            ranges.append([c, c])
+    return ','.join(str(a) if a == b else '{:d}-{:d}'.format(a, b) for a, b in ranges)
@@ -2,7 +2,7 @@ from __future__ import division
 import torch
 import math
 import random
-from PIL import Image, ImageOps, ImageEnhance
+from PIL import Image, ImageOps, ImageEnhance, ImageFilter
 try:
     import accimage
 except ImportError:
@@ -13,12 +13,14 @@ import types
 import collections
 import warnings
 
+import torch.nn.functional as nnF
 from torchvision.transforms import functional as F
 
 __all__ = ["Compose", "ToTensor", "ToPILImage", "Normalize", "Resize", "Scale", "CenterCrop", "Pad",
            "Lambda", "RandomApply", "RandomChoice", "RandomOrder", "RandomCrop", "RandomHorizontalFlip",
            "RandomVerticalFlip", "RandomResizedCrop", "RandomSizedCrop", "FiveCrop", "TenCrop", "LinearTransformation",
-           "ColorJitter", "RandomRotation", "RandomAffine", "Grayscale", "RandomGrayscale", "RandomGrayscale_extra"]
+           "ColorJitter", "RandomRotation", "RandomAffine", "Grayscale", "RandomGrayscale", "RandomGrayscale_extra",
+           "BatchColorJitter", "BatchRandomDefocusBlur"]
 
 _pil_interpolation_to_str = {
     Image.NEAREST: 'PIL.Image.NEAREST',
@@ -1203,8 +1205,211 @@ class myRandomDefocusBlur(object):
         """
 
         kernel_radius = self.get_params(self.radius)
-        from PIL.ImageFilter import GaussianBlur
-        return img.filter(GaussianBlur(radius=kernel_radius)), target, roi
+        return img.filter(ImageFilter.GaussianBlur(radius=kernel_radius)), target, roi
 
     def __repr__(self):
         return self.__class__.__name__ + '(p={})'.format(self.radius)
+
+
+def _apply_on_channels(fn, img, channels=None):
+    '''
+        Apply a batch transformation on a slice of the channels only
+        (all channels if None).
+    '''
+    if channels is None:
+        return fn(img)
+    out = img.clone()
+    out[:, channels] = fn(img[:, channels])
+    return out
+
+
+class BatchColorJitter(object):
+    """Randomly change the brightness, contrast and gamma of a batch of tensor images.
+
+    Each sample of the batch gets its own factors, so the whole batch is jittered
+    with a few element-wise operations on the tensor device.
+
+    Args:
+        brightness (float): How much to jitter brightness. brightness_factor
+            is chosen uniformly from [max(0, 1 - brightness), 1 + brightness].
+        contrast (float): How much to jitter contrast. contrast_factor
+            is chosen uniformly from [max(0, 1 - contrast), 1 + contrast].
+        gamma (float): How much to jitter gamma. gamma_factor is chosen
+            uniformly from [max(0, 1 - gamma), 1 + gamma].
+        channels (slice, optional): Image channels to be jittered. The other
+            channels (e.g. CLAHE or interaction maps) are kept unchanged.
+            If None, all channels are jittered.
+
+    The images are expected in [0, 1]: the jittered channels are clamped to
+    this range.
+    """
+    def __init__(self, brightness=0, contrast=0, gamma=0, channels=None):
+        self.brightness = brightness
+        self.contrast = contrast
+        self.gamma = gamma
+        self.channels = channels
+
+    @staticmethod
+    def get_params(brightness, contrast, gamma, batch_size, device):
+        """Get randomized per-sample factors to be applied on a batch.
+
+        Returns:
+            list: (name, factors) pairs in a random order, where factors is a
+            tensor of size (B, 1, 1, 1).
+        """
+        params = []
+        for name, value in [('brightness', brightness), ('contrast', contrast), ('gamma', gamma)]:
+            if value > 0:
+                factors = torch.empty(batch_size, 1, 1, 1, device=device)
+                factors.uniform_(max(0, 1 - value), 1 + value)
+                params.append((name, factors))
+
+        random.shuffle(params)
+
+        return params
+
+    def _jitter(self, img):
+        '''
+            Jitter all channels of a batch.
+        '''
+        params = self.get_params(self.brightness, self.contrast, self.gamma,
+                                 img.shape[0], img.device)
+        for name, factors in params:
+            factors = factors.to(img.dtype)
+            if name == 'brightness':
+                img = (img * factors).clamp(0, 1)
+            elif name == 'contrast':
+                # Blend with the mean gray level of each image
+                if img.shape[1] == 3:
+                    gray = 0.299 * img[:, 0] + 0.587 * img[:, 1] + 0.114 * img[:, 2]
+                    mean = gray.mean(dim=(1, 2)).view(-1, 1, 1, 1)
+                else:
+                    mean = img.mean(dim=(1, 2, 3), keepdim=True)
+                img = (factors * img + (1 - factors) * mean).clamp(0, 1)
+            else:
+                img = img.clamp(0, 1).pow(factors)
+        return img
+
+    def __call__(self, img, target=None, mask=None):
+        """
+        Args:
+            img (Tensor): Batch of images of size (B, C, H, W) in [0, 1].
+
+        Returns:
+            Tensor: Color jittered batch.
+        """
+        img = _apply_on_channels(self._jitter, img, self.channels)
+
+        if target is not None and mask is None:
+            return img, target
+        if target is not None and mask is not None:
+            return img, target, mask
+        return img
+
+    def __repr__(self):
+        format_string = self.__class__.__name__ + '('
+        format_string += 'brightness={0}'.format(self.brightness)
+        format_string += ', contrast={0}'.format(self.contrast)
+        format_string += ', gamma={0}'.format(self.gamma)
+        format_string += ', channels={0})'.format(self.channels)
+        return format_string
+
+
+class BatchRandomDefocusBlur(object):
+    """Blur each image of a batch with a random Gaussian (defocus) radius.
+
+    The radius of each sample is quantised to ``step`` so the separable Gaussian
+    kernels can be computed once and cached. The whole batch is then blurred with
+    two grouped 1D convolutions (vertical and horizontal).
+
+    Args:
+        radius (sequence or float or int): Range of radius to select from.
+            If radius is a number instead of sequence like (min, max), the range
+            of radius will be (0, radius).
+        step (float): Quantisation step of the radius (default: 0.25).
+        channels (slice, optional): Image channels to be blurred. The other
+            channels (e.g. CLAHE or interaction maps) are kept unchanged.
+            If None, all channels are blurred.
+    """
+
+    def __init__(self, radius, step=0.25, channels=None):
+        if isinstance(radius, numbers.Number):
+            if radius < 0:
+                raise ValueError("If radius is a single number, it must be non-negative.")
+            self.radius = (0, radius)
+        else:
+            if len(radius) != 2:
+                raise ValueError("If radius is a sequence, it must be of len 2.")
+            if radius[0] < 0 or radius[1] < radius[0]:
+                raise ValueError("If radius is a sequence, it must be non-negative and sorted.")
+            self.radius = radius
+        if step <= 0:
+            raise ValueError("Quantisation step must be positive.")
+        self.step = step
+        self.channels = channels
+        self.n_bins = int(round((self.radius[1] - self.radius[0]) / step)) + 1
+        self.half_size = int(math.ceil(3 * self.radius[1]))
+        self._kernels = {}
+
+    def _get_kernels(self, device, dtype):
+        '''
+            Get (and cache) the bank of 1D Gaussian kernels, one row per
+            quantised radius, all zero padded to the largest kernel size.
+        '''
+        key = (str(device), dtype)
+        if key not in self._kernels:
+            radii = self.radius[0] + self.step * torch.arange(self.n_bins, dtype=torch.float64)
+            x = torch.arange(-self.half_size, self.half_size + 1, dtype=torch.float64)
+            sigma = radii.clamp(min=1e-6).unsqueeze(1)
+            bank = torch.exp(-x.unsqueeze(0)**2 / (2 * sigma**2))
+            bank = bank / bank.sum(dim=1, keepdim=True)
+            self._kernels[key] = bank.to(device=device, dtype=dtype)
+        return self._kernels[key]
+
+    def get_params(self, batch_size):
+        """Get the quantised radius index of each sample.
+
+        Returns:
+            Tensor: bin indexes of size (B).
+        """
+        return torch.randint(0, self.n_bins, (batch_size,))
+
+    def _blur(self, img):
+        '''
+            Blur all channels of a batch.
+        '''
+        if self.half_size > 0:
+            bs, ch, h, w = img.shape
+            bank = self._get_kernels(img.device, img.dtype)
+            idx = self.get_params(bs).to(img.device)
+            # One kernel per (sample, channel) pair
+            kernels = bank[idx].repeat_interleave(ch, dim=0)
+            k = kernels.shape[1]
+            # Fold batch into channels to run a single grouped convolution
+            x = img.reshape(1, bs * ch, h, w)
+            x = nnF.pad(x, (0, 0, self.half_size, self.half_size), mode='replicate')
+            x = nnF.conv2d(x, kernels.view(bs * ch, 1, k, 1), groups=bs * ch)
+            x = nnF.pad(x, (self.half_size, self.half_size, 0, 0), mode='replicate')
+            x = nnF.conv2d(x, kernels.view(bs * ch, 1, 1, k), groups=bs * ch)
+            img = x.view(bs, ch, h, w)
+        return img
+
+    def __call__(self, img, target=None, mask=None):
+        """
+        Args:
+            img (Tensor): Batch of images of size (B, C, H, W).
+
+        Returns:
+            Tensor: Blurred batch.
+        """
+        img = _apply_on_channels(self._blur, img, self.channels)
+
+        if target is not None and mask is None:
+            return img, target
+        if target is not None and mask is not None:
+            return img, target, mask
+        return img
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(radius={0}, step={1}, channels={2})'.format(
+            self.radius, self.step, self.channels)